@@ -0,0 +1,23 @@
+"""Benchmarks for building surface constraint matrices"""
+
+import numpy as np
+
+from psiresp.constraint import ESPSurfaceConstraintMatrix
+
+
+class SurfaceConstraintMatrixSuite:
+    """Surface constraint matrices for random molecules and grids"""
+    params = [[10, 100], [2000, 20000], ["float64", "float32"]]
+    param_names = ["n_atoms", "n_points", "dtype"]
+
+    def setup(self, n_atoms, n_points, dtype):
+        rng = np.random.default_rng(0)
+        self.coordinates = rng.normal(scale=5, size=(n_atoms, 3))
+        self.grid = rng.normal(scale=8, size=(n_points, 3))
+        self.esp = rng.normal(size=n_points)
+
+    def time_from_grid(self, n_atoms, n_points, dtype):
+        ESPSurfaceConstraintMatrix.from_grid(self.coordinates, self.grid, self.esp, dtype=dtype)
+
+    def peakmem_from_grid(self, n_atoms, n_points, dtype):
+        ESPSurfaceConstraintMatrix.from_grid(self.coordinates, self.grid, self.esp, dtype=dtype)
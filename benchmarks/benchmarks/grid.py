@@ -0,0 +1,158 @@
+"""Benchmarks for grid generation"""
+
+import glob
+import os
+import re
+
+import numpy as np
+import qcelemental as qcel
+
+from psiresp.grid import GridOptions, SPHERE_GENERATORS, clear_template_cache
+from psiresp.tests.datafiles import datapath
+
+
+def _can_load(filename):
+    try:
+        qcel.models.Molecule.from_file(filename)
+    except qcel.MoleculeFormatError:
+        return False
+    return True
+
+
+# every optimized geometry that QCElemental can read,
+# leaving out rotated copies of the same conformer
+MOLECULE_FILES = sorted(
+    x for x in glob.glob(datapath("molecules/*opt*.xyz"))
+    if not re.search(r"_o\d+\.xyz$", x) and _can_load(x)
+)
+MOLECULE_NAMES = [os.path.basename(x)[:-len(".xyz")] for x in MOLECULE_FILES]
+
+VDW_SCALE_FACTORS = {
+    "single": [1.4],
+    "msk": [1.4, 1.6, 1.8, 2.0],
+}
+
+
+def load_molecule(name):
+    return qcel.models.Molecule.from_file(datapath(f"molecules/{name}.xyz"))
+
+
+def generate_chain(n_atoms, seed=0):
+    """Generate a zig-zag hydrocarbon-like chain of ``n_atoms`` atoms,
+    alternating one carbon with two hydrogens"""
+    rng = np.random.default_rng(seed)
+    n_carbons = max(n_atoms // 3, 1)
+    steps = np.zeros((n_carbons, 3))
+    steps[:, 0] = 1.25
+    steps[:, 1] = np.where(np.arange(n_carbons) % 2, 0.45, -0.45)
+    steps[:, 2] = rng.normal(scale=0.1, size=n_carbons)
+    carbons = np.cumsum(steps, axis=0)
+
+    symbols = []
+    geometry = []
+    for i, carbon in enumerate(carbons):
+        symbols.append("C")
+        geometry.append(carbon)
+        side = -1 if i % 2 else 1
+        for dz in (-0.9, 0.9):
+            if len(symbols) >= n_atoms:
+                break
+            symbols.append("H")
+            geometry.append(carbon + [0, side * 0.5, dz])
+    while len(symbols) < n_atoms:
+        symbols.append("H")
+        geometry.append(geometry[-1] + [1.1, 0, 0])
+    geometry = np.array(geometry) * qcel.constants.conversion_factor("angstrom", "bohr")
+    return qcel.models.Molecule(symbols=symbols, geometry=geometry,
+                                fix_com=True, fix_orientation=True)
+
+
+class _GridBenchmark:
+    timeout = 600
+
+    def setup_options(self, vdw_point_density=1.0, vdw_scale_factors="msk", **kwargs):
+        self.options = GridOptions(vdw_point_density=vdw_point_density,
+                                   vdw_scale_factors=VDW_SCALE_FACTORS[vdw_scale_factors],
+                                   **kwargs)
+        clear_template_cache()
+
+    def time_generate_grid(self, *args):
+        self.options.generate_grid(self.qcmol)
+
+    def peakmem_generate_grid(self, *args):
+        self.options.generate_grid(self.qcmol)
+
+    def track_n_grid_points(self, *args):
+        return len(self.options.generate_grid(self.qcmol))
+
+    track_n_grid_points.unit = "points"
+
+
+class MoleculeGridSuite(_GridBenchmark):
+    """Grids for the molecules in the test data"""
+    params = [MOLECULE_NAMES, [1.0, 5.0, 20.0], list(VDW_SCALE_FACTORS)]
+    param_names = ["molecule", "vdw_point_density", "vdw_scale_factors"]
+
+    def setup(self, molecule, vdw_point_density, vdw_scale_factors):
+        self.qcmol = load_molecule(molecule)
+        self.setup_options(vdw_point_density, vdw_scale_factors)
+
+
+class ChainGridSuite(_GridBenchmark):
+    """Grids for synthetic chains of increasing size"""
+    params = [[10, 30, 100, 300, 1000], [1.0, 5.0], list(VDW_SCALE_FACTORS)]
+    param_names = ["n_atoms", "vdw_point_density", "vdw_scale_factors"]
+
+    def setup(self, n_atoms, vdw_point_density, vdw_scale_factors):
+        self.qcmol = generate_chain(n_atoms)
+        self.setup_options(vdw_point_density, vdw_scale_factors)
+
+
+GRID_METHOD_PARAMS = [["cdist", "kdtree"], list(SPHERE_GENERATORS), ["vdw", "sas"]]
+GRID_METHOD_PARAM_NAMES = ["neighbor_search", "sphere_point_generator", "surface_type"]
+
+
+class MoleculeGridMethodSuite(_GridBenchmark):
+    """Grids for the test molecules with each neighbor search,
+    sphere point generator and surface type"""
+    params = [["dmso_opt_c1", "nme2ala2_opt_c1"], *GRID_METHOD_PARAMS]
+    param_names = ["molecule", *GRID_METHOD_PARAM_NAMES]
+
+    def setup(self, molecule, neighbor_search, sphere_point_generator, surface_type):
+        self.qcmol = load_molecule(molecule)
+        self.setup_options(neighbor_search=neighbor_search,
+                           sphere_point_generator=sphere_point_generator,
+                           surface_type=surface_type)
+
+
+class ChainGridMethodSuite(_GridBenchmark):
+    """Grids for synthetic chains with each neighbor search,
+    sphere point generator and surface type"""
+    params = [[30, 300, 1000], *GRID_METHOD_PARAMS]
+    param_names = ["n_atoms", *GRID_METHOD_PARAM_NAMES]
+
+    def setup(self, n_atoms, neighbor_search, sphere_point_generator, surface_type):
+        self.qcmol = generate_chain(n_atoms)
+        self.setup_options(neighbor_search=neighbor_search,
+                           sphere_point_generator=sphere_point_generator,
+                           surface_type=surface_type)
+
+
+class ThinGridSuite:
+    """Thinning dense grids of the test molecules to a maximum number of points"""
+    timeout = 600
+    params = [["dmso_opt_c1", "nme2ala2_opt_c1"], [100, 1000, 5000]]
+    param_names = ["molecule", "max_n_points"]
+
+    def setup(self, molecule, max_n_points):
+        qcmol = load_molecule(molecule)
+        self.points = GridOptions(vdw_point_density=20.0).generate_grid(qcmol)
+        self.options = GridOptions(max_n_points=max_n_points)
+
+    def time_thin_grid(self, *args):
+        self.options.thin_grid(self.points)
+
+    def track_n_thinned_points(self, *args):
+        return len(self.options.thin_grid(self.points)[0])
+
+    track_n_thinned_points.unit = "points"
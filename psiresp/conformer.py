@@ -1,12 +1,14 @@
 
-from typing import Optional, List
+from typing import Optional, List, Union
+import pathlib
 from typing_extensions import Literal
 from pydantic import Field
 
 import numpy as np
 import qcelemental as qcel
 
-from . import base
+from . import base, orutils
+from .grid import GridOptions
 from .orientation import Orientation
 from .moleculebase import BaseMolecule
 from .utils import require_package
@@ -25,9 +27,44 @@ class Conformer(BaseMolecule):
     def n_orientations(self):
         return len(self.orientations)
 
-    def add_orientation_with_coordinates(self, coordinates, units="angstrom"):
+    def add_orientation_with_coordinates(self, coordinates, units="angstrom",
+                                         transformation=None):
         qcmol = self.qcmol_with_coordinates(coordinates, units=units)
-        self.orientations.append(Orientation(qcmol=qcmol))
+        self.orientations.append(Orientation(qcmol=qcmol,
+                                             transformation=transformation))
+
+    def map_grid_to_orientations(self, grid_options: GridOptions = GridOptions(),
+                                 working_directory: Optional[Union[str, pathlib.Path]] = None):
+        """Generate a grid once for the conformer geometry and map it
+        onto every orientation that is a known rigid-body transformation
+        of the conformer, and does not yet have a grid or an ESP.
+        Orientations whose grid was discarded after their
+        surface constraint matrix was computed are left alone.
+
+        Orientations whose transformation does not reproduce their
+        coordinates are skipped, and get their own grid generated later.
+        If ``working_directory`` is given, the conformer grid is cached there.
+        """
+        orientations = [
+            orientation
+            for orientation in self.orientations
+            if orientation.grid is None
+            and orientation.esp is None
+            and orientation._constraint_matrix is None
+            and orientation.transformation is not None
+        ]
+        if not orientations:
+            return
+        if working_directory is None:
+            grid = grid_options.generate_grid(self.qcmol)
+        else:
+            grid = grid_options.load_or_generate_grid(self.qcmol,
+                                                      working_directory=working_directory)
+        for orientation in orientations:
+            matrix = orientation.transformation
+            coordinates = orutils.apply_affine_matrix(matrix, self.coordinates)
+            if np.allclose(coordinates, orientation.coordinates, atol=1e-6):
+                orientation.grid = orutils.apply_affine_matrix(matrix, grid)
 
     def set_optimized_geometry(self, coordinates, units="bohr"):
         cf = qcel.constants.conversion_factor(units, "bohr")
@@ -3,7 +3,10 @@ import copy
 
 import numpy as np
 from pydantic import validator
+import qcelemental as qcel
+import scipy.linalg
 import scipy.sparse
+import scipy.sparse.csgraph
 import scipy.sparse.linalg
 
 from . import base
@@ -59,20 +62,75 @@ class ESPSurfaceConstraintMatrix(base.Model):
         return cls(matrix=np.zeros((n_dim + 1, n_dim)))
 
     @classmethod
-    def from_orientations(cls, orientations=[], temperature: float = 298.15):
+    def from_orientations(cls, orientations=[], temperature: float = 298.15,
+                          dtype: Optional[str] = None):
 
         if not len(orientations):
             raise ValueError("At least one Orientation must be provided")
 
-        if not all(ort.esp is not None for ort in orientations):
+        if not all(ort.esp is not None or ort._constraint_matrix is not None
+                   for ort in orientations):
             raise ValueError("All Orientations must have had the ESP computed")
 
         first = orientations[0]
         matrix = cls.with_n_dim(first.qcmol.geometry.shape[0])
         for ort in orientations:
-            matrix += ort.get_weighted_matrix(temperature=temperature)
+            matrix += ort.get_weighted_matrix(temperature=temperature, dtype=dtype)
         return matrix
 
+    @classmethod
+    def from_grid(cls, coordinates: np.ndarray, grid: np.ndarray, esp: np.ndarray,
+                  max_block_memory: int = 2 ** 25, dtype: str = "float64"):
+        """Construct the matrix from the ESP on a grid around a molecule.
+
+        The inverse distances are computed for blocks of grid points
+        at a time, and accumulated into the coefficient matrix and
+        constant vector with matrix products. With ``dtype="float32"``,
+        each block is computed in single precision and only the
+        sum over blocks is accumulated in double precision.
+
+        Parameters
+        ----------
+        coordinates: numpy.ndarray
+            Atom coordinates in angstrom, with shape (N, 3)
+        grid: numpy.ndarray
+            Grid points in angstrom, with shape (M, 3)
+        esp: numpy.ndarray
+            ESP at each grid point in atomic units, with shape (M,)
+        max_block_memory: int
+            Approximate maximum number of bytes of
+            temporary arrays to use for each block
+        dtype: str
+            Precision of the inverse distances and products
+            for each block, either "float64" or "float32"
+        """
+        dtype = np.dtype(dtype)
+        coordinates = np.asarray(coordinates, dtype=dtype)
+        grid = np.asarray(grid, dtype=dtype).reshape((-1, 3))
+        esp = np.asarray(esp, dtype=dtype)
+        n_atoms = len(coordinates)
+        # displacements and inverse distances
+        block_size = max(1, max_block_memory // (4 * dtype.itemsize * n_atoms))
+        if dtype.itemsize < 8:
+            # single precision sums lose accuracy quickly, so only
+            # sum over a few points before accumulating in float64
+            block_size = min(block_size, 64)
+
+        # r_inv should be in bohr units, even though
+        # coordinates and displacement are in angstrom?
+        BOHR_TO_ANGSTROM = dtype.type(qcel.constants.conversion_factor("bohr", "angstrom"))
+        a = np.zeros((n_atoms, n_atoms))
+        b = np.zeros(n_atoms)
+        for start in range(0, len(grid), block_size):
+            end = start + block_size
+            displacement = coordinates - grid[start:end].reshape((-1, 1, 3))
+            r_inv = BOHR_TO_ANGSTROM / np.sqrt(
+                np.einsum("ijk, ijk->ij", displacement, displacement)
+            )
+            a += r_inv.T @ r_inv
+            b += esp[start:end] @ r_inv
+        return cls.from_coefficient_matrix(a, b)
+
     @classmethod
     def from_coefficient_matrix(cls, coefficient_matrix, constant_vector=None):
         n_dim = coefficient_matrix.shape[0]
@@ -128,6 +186,13 @@ class SparseGlobalConstraintMatrix(base.Model):
     _n_atoms: Optional[int] = None
     _array_mask: Optional[Tuple[np.ndarray, np.ndarray]] = None
     _array_indices: Optional[np.ndarray] = None
+    _diagonal_data_indices: Optional[np.ndarray] = None
+    _column_order: Optional[np.ndarray] = None
+    _permuted_matrix: Optional[scipy.sparse.csc_matrix] = None
+    _permuted_diagonal_data_indices: Optional[np.ndarray] = None
+    _permuted_diagonal: Optional[np.ndarray] = None
+    _reduced_system: Optional[dict] = None
+    _atom_matrix: Optional[scipy.sparse.csr_matrix] = None
 
     @classmethod
     def from_constraints(
@@ -205,7 +270,14 @@ class SparseGlobalConstraintMatrix(base.Model):
             return None
         return self._charges[self._array_indices]
 
-    def _solve(self):
+    def _solve(self, reduced: bool = False,
+               constant_vector: Optional[np.ndarray] = None):
+        if reduced:
+            self._solve_reduced(constant_vector=constant_vector)
+            return
+        if constant_vector is None:
+            constant_vector = self.constant_vector
+
         try:
             from scipy.sparse.linalg.dsolve import _superlu
         except ImportError:
@@ -219,23 +291,339 @@ class SparseGlobalConstraintMatrix(base.Model):
             self.coefficient_matrix.data,
             self.coefficient_matrix.indices,
             self.coefficient_matrix.indptr,
-            self.constant_vector,
+            constant_vector,
             0,  # csr matrix
             options=dict(ColPerm=None),
         )
         if info != 0 or np.isnan(charges).any():
             charges = scipy.sparse.linalg.lsmr(
-                self.coefficient_matrix, self.constant_vector
+                self.coefficient_matrix, constant_vector
             )[0]
         self._charges = charges
 
-    def _iter_solve(self, restraint_height, restraint_slope, b2):
-        hyp_a = (restraint_height * self.n_structure_array)[self._array_indices]
+    def _iter_solve(self, restraint_height, restraint_slope, b2,
+                    reuse_factorization: bool = False,
+                    reduced: bool = False):
+        hyp_a = self._get_restraint_strengths(restraint_height)
         increment = hyp_a / np.sqrt(
             self._charges[self._array_indices] ** 2 + b2
         )
+        self._solve_with_increment(increment,
+                                   reuse_factorization=reuse_factorization,
+                                   reduced=reduced)
+
+    def _solve_with_increment(self, increment: np.ndarray,
+                              constant_vector: Optional[np.ndarray] = None,
+                              reuse_factorization: bool = False,
+                              reduced: bool = False):
+        """Solve the system with ``increment`` added to the diagonal
+        of restrained atoms, optionally with another constant vector"""
+        if reduced:
+            self._solve_reduced(increment, constant_vector=constant_vector)
+            return
+        if reuse_factorization and self._diagonal_data_indices is None:
+            self._diagonal_data_indices = self._get_data_indices(
+                self._original_coefficient_matrix,
+                self._array_indices, self._array_indices,
+            )
+        if reuse_factorization:
+            diagonal = self._diagonal_data_indices
+            # diagonal elements can be missing if they are exactly 0
+            if len(diagonal) == len(self._array_indices):
+                self._solve_with_column_order(increment, constant_vector=constant_vector)
+                return
+
         self.coefficient_matrix = self._original_coefficient_matrix.copy()
 
         a_shape = self.coefficient_matrix[self._array_mask].shape
         self.coefficient_matrix[self._array_mask] += increment.reshape(a_shape)
-        self._solve()
+        self._solve(constant_vector=constant_vector)
+
+    def _get_restraint_strengths(self, restraint_height):
+        return (restraint_height * self.n_structure_array)[self._array_indices]
+
+    def _get_restraint_objective(self, charges, restraint_height, b2):
+        """The restrained objective ``q.A.q / 2 - b.q + sum(a * sqrt(q^2 + b^2))``
+        over restrained atoms, whose stationary point the iterations find"""
+        n_atoms = len(self.mask)
+        if self._atom_matrix is None:
+            self._atom_matrix = self._original_coefficient_matrix[:n_atoms, :n_atoms].tocsr()
+        charges = charges[:n_atoms]
+        hyp_a = self._get_restraint_strengths(restraint_height)
+        restraint = hyp_a * np.sqrt(charges[self._array_indices] ** 2 + b2)
+        return (0.5 * charges @ (self._atom_matrix @ charges)
+                - self.constant_vector[:n_atoms] @ charges
+                + restraint.sum())
+
+    def _get_restraint_residual(self, restraint_height, b2):
+        """Largest element of the gradient of the Lagrangian
+        with respect to the charges, at the current solution"""
+        n_atoms = len(self.mask)
+        hyp_a = self._get_restraint_strengths(restraint_height)
+        charges = self._charges[self._array_indices]
+        gradient = self._original_coefficient_matrix[:n_atoms] @ self._charges
+        gradient -= self.constant_vector[:n_atoms]
+        gradient[self._array_indices] += hyp_a * charges / np.sqrt(charges ** 2 + b2)
+        return np.max(np.abs(gradient), initial=0)
+
+    def _newton_iter_solve(self, restraint_height, restraint_slope, b2,
+                           reuse_factorization: bool = False,
+                           reduced: bool = False):
+        """Take a Newton step on the restrained objective,
+        backtracking until the objective decreases enough.
+        The constraints are linear, so steps from charges
+        that satisfy them continue to satisfy them.
+
+        If the line search fails, a fixed-point iteration
+        is taken instead, so a stalled step is never mistaken
+        for convergence.
+
+        Returns
+        -------
+        float
+            The fraction of the Newton step taken,
+            or 0 if a fixed-point iteration was taken
+        """
+        n_atoms = len(self.mask)
+        hyp_a = self._get_restraint_strengths(restraint_height)
+        current = self._charges.copy()
+        charges = current[self._array_indices]
+        root = np.sqrt(charges ** 2 + b2)
+        restraint_gradient = hyp_a * charges / root
+        restraint_hessian = hyp_a * b2 / root ** 3
+
+        # (A + H) q_new + C l = b - g + H q
+        constant_vector = self.constant_vector.copy()
+        constant_vector[self._array_indices] += restraint_hessian * charges - restraint_gradient
+        self._solve_with_increment(restraint_hessian,
+                                   constant_vector=constant_vector,
+                                   reuse_factorization=reuse_factorization,
+                                   reduced=reduced)
+        newton = self._charges
+
+        direction = newton[:n_atoms] - current[:n_atoms]
+        objective = self._get_restraint_objective(current, restraint_height, b2)
+        gradient = self._atom_matrix @ current[:n_atoms] - self.constant_vector[:n_atoms]
+        gradient[self._array_indices] += restraint_gradient
+        slope = gradient @ direction
+        # allow for rounding error once converged
+        tolerance = 1e-12 * max(abs(objective), 1)
+
+        step = 1.0
+        while step > 1e-10:
+            trial = current[:n_atoms] + step * direction
+            trial_objective = self._get_restraint_objective(trial, restraint_height, b2)
+            if trial_objective <= objective + 1e-4 * step * slope + tolerance:
+                break
+            step /= 2
+        else:
+            self._charges = current
+            self._iter_solve(restraint_height, restraint_slope, b2,
+                             reuse_factorization=reuse_factorization,
+                             reduced=reduced)
+            return 0.0
+
+        self._charges = np.r_[current[:n_atoms] + step * direction, newton[n_atoms:]]
+        self._previous_charges = current
+        return step
+
+    @staticmethod
+    def _get_data_indices(matrix, major_indices, minor_indices):
+        """Find where elements are stored in the data of a compressed
+        sparse matrix. Elements that are not stored are left out.
+        Major indices are rows of CSR matrices and columns of CSC matrices."""
+        n_minor = max(matrix.shape)
+        majors = np.repeat(np.arange(len(matrix.indptr) - 1), np.diff(matrix.indptr))
+        keys = majors.astype(np.int64) * n_minor + matrix.indices
+        wanted = np.asarray(major_indices, dtype=np.int64) * n_minor + minor_indices
+        sorter = np.argsort(keys, kind="stable")
+        found = sorter[np.searchsorted(keys, wanted, sorter=sorter).clip(max=len(keys) - 1)]
+        return found[keys[found] == wanted]
+
+    def _get_restrained_matrix(self, increment: np.ndarray) -> scipy.sparse.csr_matrix:
+        """Copy the original coefficient matrix with ``increment``
+        added to the diagonal of restrained atoms"""
+        matrix = self._original_coefficient_matrix.copy()
+        matrix.data[self._diagonal_data_indices] += increment
+        return matrix
+
+    def _solve_with_column_order(self, increment: np.ndarray,
+                                 constant_vector: Optional[np.ndarray] = None):
+        """Solve the system with SuperLU, reusing the column ordering
+        found for the first restrained matrix. Only the restrained
+        diagonal changes between iterations, so the sparsity pattern
+        and fill-reducing ordering stay the same. The restrained
+        diagonal of the permuted matrix is overwritten in place,
+        and the unpermuted matrix is only rebuilt if SuperLU fails."""
+        self._previous_charges = copy.deepcopy(self._charges)
+        if constant_vector is None:
+            constant_vector = self.constant_vector
+
+        try:
+            if self._column_order is None:
+                lu = scipy.sparse.linalg.splu(self._get_restrained_matrix(increment).tocsc(),
+                                              permc_spec="COLAMD")
+                # L @ U == Pr @ A[:, order]
+                self._column_order = order = np.argsort(lu.perm_c)
+                permuted = self._original_coefficient_matrix.tocsc()[:, order]
+                permuted.sort_indices()
+                positions = np.argsort(order)
+                self._permuted_matrix = permuted
+                self._permuted_diagonal_data_indices = indices = self._get_data_indices(
+                    permuted, positions[self._array_indices], self._array_indices,
+                )
+                self._permuted_diagonal = permuted.data[indices]
+                charges = lu.solve(constant_vector)
+            else:
+                permuted = self._permuted_matrix
+                permuted.data[self._permuted_diagonal_data_indices] = self._permuted_diagonal + increment
+                lu = scipy.sparse.linalg.splu(permuted, permc_spec="NATURAL")
+                charges = np.empty_like(constant_vector)
+                charges[self._column_order] = lu.solve(constant_vector)
+        except RuntimeError:  # singular matrix
+            charges = np.full_like(constant_vector, np.nan)
+        if np.isnan(charges).any():
+            charges = scipy.sparse.linalg.lsmr(
+                self._get_restrained_matrix(increment), constant_vector
+            )[0]
+        self._charges = charges
+
+    def _get_reduced_system(self):
+        """Eliminate the equality constraints from the system.
+
+        The coefficient matrix is the KKT matrix ``[[A, C], [C.T, 0]]``,
+        where ``A`` is the (n_atoms, n_atoms) ESP matrix and ``C.T``
+        holds one row for each constraint ``C.T @ q = d``.
+        Every charge vector satisfying the constraints is written as
+        ``q0 + Z @ y``. Equivalence constraints are eliminated by
+        merging atoms into groups, fixed charges by substituting their
+        values, and any other constraints with a dense null space
+        over the remaining groups.
+        """
+        if self._reduced_system is not None:
+            return self._reduced_system
+
+        n_atoms = len(self.mask)
+        matrix = self._original_coefficient_matrix.tocsr()
+        if matrix[n_atoms:, n_atoms:].count_nonzero():
+            raise ValueError("The reduced formulation needs a coefficient "
+                             "matrix of the form [[A, C], [C.T, 0]]")
+        a = matrix[:n_atoms, :n_atoms].toarray()
+        b = self.constant_vector[:n_atoms]
+        constraints = matrix[n_atoms:, :n_atoms].tocsr()
+        constraints.eliminate_zeros()
+        d = self.constant_vector[n_atoms:]
+        n_terms = np.diff(constraints.indptr)
+        starts = constraints.indptr[:-1]
+
+        # q_i - q_j = 0
+        is_equivalence = n_terms == 2
+        is_equivalence[is_equivalence] = (
+            (constraints.data[starts[is_equivalence]]
+             == -constraints.data[starts[is_equivalence] + 1])
+            & (d[is_equivalence] == 0)
+        )
+        pairs = constraints.indices[starts[is_equivalence, None] + [0, 1]]
+        graph = scipy.sparse.coo_matrix(
+            (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+            shape=(n_atoms, n_atoms),
+        )
+        n_groups, groups = scipy.sparse.csgraph.connected_components(graph, directed=False)
+
+        # c * q_i = d
+        fixed_values = np.full(n_groups, np.nan)
+        is_general = ~is_equivalence
+        for row in np.where(n_terms == 1)[0]:
+            group = groups[constraints.indices[starts[row]]]
+            value = d[row] / constraints.data[starts[row]]
+            if np.isnan(fixed_values[group]):
+                fixed_values[group] = value
+                is_general[row] = False
+            elif np.isclose(fixed_values[group], value):
+                is_general[row] = False
+
+        is_fixed = ~np.isnan(fixed_values)
+        free_groups = np.where(~is_fixed)[0]
+        free_index = np.full(n_groups, -1)
+        free_index[free_groups] = np.arange(len(free_groups))
+        atom_free_index = free_index[groups]
+        is_free_atom = atom_free_index >= 0
+        aggregation = scipy.sparse.csr_matrix(
+            (np.ones(is_free_atom.sum()),
+             (np.where(is_free_atom)[0], atom_free_index[is_free_atom])),
+            shape=(n_atoms, len(free_groups)),
+        )
+        fixed_charges = np.where(is_fixed[groups], fixed_values[groups], 0)
+
+        # remaining constraints over the free groups
+        general = constraints[is_general]
+        general_matrix = (general @ aggregation).toarray()
+        general_d = d[is_general] - general @ fixed_charges
+        if len(general_matrix):
+            group_particular = np.linalg.lstsq(general_matrix, general_d, rcond=None)[0]
+            group_nullspace = scipy.linalg.null_space(general_matrix)
+        else:
+            group_particular = np.zeros(len(free_groups))
+            group_nullspace = np.identity(len(free_groups))
+
+        particular = fixed_charges + aggregation @ group_particular
+        nullspace = np.asarray(aggregation @ group_nullspace)
+
+        # to recover Lagrange multipliers l from C @ l = b - A @ q
+        normal_matrix = (constraints @ constraints.T).tocsc()
+        try:
+            normal_lu = scipy.sparse.linalg.splu(normal_matrix)
+        except RuntimeError:  # redundant constraints
+            normal_lu = None
+
+        self._reduced_system = dict(
+            a=a,
+            b=b,
+            constraints=constraints,
+            normal_lu=normal_lu,
+            particular=particular,
+            nullspace=nullspace,
+            reduced_a=nullspace.T @ a @ nullspace,
+            reduced_b=nullspace.T @ (b - a @ particular),
+        )
+        return self._reduced_system
+
+    def _solve_reduced(self, increment: Optional[np.ndarray] = None,
+                       constant_vector: Optional[np.ndarray] = None):
+        """Solve the system in the null space of the constraints.
+        ``increment`` is added to the diagonal of restrained atoms.
+        A different ``constant_vector`` may only change the
+        rows of atoms, not of the constraints.
+        The Lagrange multipliers are recovered afterwards, so the
+        charges have the same layout as from :meth:`_solve`."""
+        self._previous_charges = copy.deepcopy(self._charges)
+        system = self._get_reduced_system()
+        nullspace = system["nullspace"]
+        particular = system["particular"]
+        reduced_a = system["reduced_a"]
+        reduced_b = system["reduced_b"]
+        b = system["b"]
+        if constant_vector is not None:
+            b = constant_vector[:len(b)]
+            reduced_b = reduced_b + nullspace.T @ (b - system["b"])
+        diagonal = np.zeros(len(particular))
+        if increment is not None:
+            diagonal[self._array_indices] = increment
+            restrained = nullspace[self._array_indices]
+            reduced_a = reduced_a + restrained.T @ (increment[:, None] * restrained)
+            reduced_b = reduced_b - nullspace.T @ (diagonal * particular)
+
+        try:
+            y = scipy.linalg.solve(reduced_a, reduced_b, assume_a="sym")
+        except (np.linalg.LinAlgError, ValueError):
+            y = np.linalg.lstsq(reduced_a, reduced_b, rcond=None)[0]
+        charges = particular + nullspace @ y
+        residual = b - system["a"] @ charges - diagonal * charges
+        constraints = system["constraints"]
+        if not constraints.shape[0]:
+            multipliers = np.zeros(0)
+        elif system["normal_lu"] is not None:
+            multipliers = system["normal_lu"].solve(constraints @ residual)
+        else:
+            multipliers = scipy.sparse.linalg.lsqr(constraints.T, residual)[0]
+        self._charges = np.r_[charges, multipliers]
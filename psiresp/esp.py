@@ -0,0 +1,578 @@
+"""
+Analytic electrostatic potential from a QCSchema wavefunction.
+
+This evaluates the nuclear attraction integrals over contracted Gaussian
+basis functions with the McMurchie-Davidson scheme, vectorized over
+primitive pairs and grid points with NumPy. It follows the psi4 conventions
+for the basis set: the QCSchema contraction coefficients already include the
+primitive normalization, every Cartesian component of a shell shares the
+normalization of the :math:`x^l` component, and pure functions are
+ordered :math:`m = 0, 1, -1, 2, -2, \\ldots` like the density returned by
+:meth:`psiresp.qcutils.QCWaveFunction.reconstruct_density`.
+"""
+
+import functools
+import hashlib
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import qcelemental as qcel
+from scipy.special import comb, gamma, gammainc
+
+logger = logging.getLogger(__name__)
+
+ANGSTROM_TO_BOHR = qcel.constants.conversion_factor("angstrom", "bohr")
+
+
+class Shell(NamedTuple):
+    """A contracted shell of basis functions on one center"""
+    center: Optional[np.ndarray]
+    atom: int
+    angular_momentum: int
+    exponents: np.ndarray
+    coefficients: np.ndarray
+    pure: bool
+    offset: int
+
+    @property
+    def n_functions(self):
+        if self.pure:
+            return 2 * self.angular_momentum + 1
+        return get_n_cartesian_functions(self.angular_momentum)
+
+    @property
+    def n_cartesian_functions(self):
+        return get_n_cartesian_functions(self.angular_momentum)
+
+
+def get_n_cartesian_functions(angular_momentum: int) -> int:
+    return (angular_momentum + 1) * (angular_momentum + 2) // 2
+
+
+@functools.lru_cache(maxsize=None)
+def get_cartesian_components(angular_momentum: int) -> np.ndarray:
+    """Get the Cartesian exponents (lx, ly, lz) of a shell,
+    in the psi4 order (xx, xy, xz, yy, yz, zz for d shells)
+
+    Returns
+    -------
+    numpy.ndarray
+        This has shape (n_cartesian_functions, 3)
+    """
+    components = []
+    for i in range(angular_momentum + 1):
+        lx = angular_momentum - i
+        for lz in range(i + 1):
+            components.append((lx, i - lz, lz))
+    components = np.array(components, dtype=int).reshape((-1, 3))
+    components.flags.writeable = False
+    return components
+
+
+def _double_factorial(n):
+    # (-1)!! = 1
+    return np.prod(np.arange(n, 0, -2, dtype=float))
+
+
+@functools.lru_cache(maxsize=None)
+def get_spherical_transformation(angular_momentum: int) -> np.ndarray:
+    """Get the coefficients of real solid harmonics
+    in terms of Cartesian functions.
+
+    Rows are ordered m = 0, 1, -1, 2, -2, ...; columns follow
+    :func:`get_cartesian_components`. Each row is normalized
+    for Cartesian functions that share the :math:`x^l` normalization.
+
+    Returns
+    -------
+    numpy.ndarray
+        This has shape (2 * angular_momentum + 1, n_cartesian_functions)
+    """
+    L = angular_momentum
+    components = get_cartesian_components(L)
+    index = {tuple(c): i for i, c in enumerate(components)}
+
+    ms = [0] + [m for k in range(1, L + 1) for m in (k, -k)]
+    transformation = np.zeros((len(ms), len(components)))
+    for row, m in enumerate(ms):
+        abs_m = abs(m)
+        vm2 = 0 if m >= 0 else 1  # twice v_m
+        for t in range((L - abs_m) // 2 + 1):
+            for u in range(t + 1):
+                for v2 in range(vm2, abs_m + 1, 2):  # twice v
+                    sign = (-1) ** (t + (v2 - vm2) // 2)
+                    coefficient = (sign * 0.25 ** t * comb(L, t, exact=True)
+                                   * comb(L - t, abs_m + t, exact=True)
+                                   * comb(t, u, exact=True)
+                                   * comb(abs_m, v2, exact=True))
+                    ly = 2 * u + v2
+                    lx = 2 * t + abs_m - ly
+                    lz = L - 2 * t - abs_m
+                    transformation[row, index[(lx, ly, lz)]] += coefficient
+
+    # overlap of the Cartesian functions of one primitive
+    total = components[:, None, :] + components[None, :, :]
+    dfact = np.vectorize(_double_factorial)(total - 1)
+    overlap = np.where((total % 2).any(axis=-1), 0, dfact.prod(axis=-1))
+    overlap /= _double_factorial(2 * L - 1)
+    norms = np.einsum("ij,jk,ik->i", transformation, overlap, transformation)
+    transformation /= np.sqrt(norms)[:, None]
+    transformation.flags.writeable = False
+    return transformation
+
+
+class BasisTemplate(NamedTuple):
+    """Geometry-independent layout of a basis set, which can be
+    shared by every wavefunction computed with the same basis"""
+    shells: List[Shell]
+    transformation: np.ndarray
+    ecp_electrons: np.ndarray
+
+
+def get_basis_signature(basis: qcel.models.BasisSet) -> str:
+    """Get a hash identifying the atom map and shells of a basis set"""
+    return hashlib.sha1(basis.json().encode("utf-8")).hexdigest()
+
+
+def get_basis_template(basis: qcel.models.BasisSet) -> BasisTemplate:
+    """Parse a QCSchema basis set into shells without centers,
+    in the order of the atomic orbitals"""
+    shells = []
+    offset = 0
+    for i, atom in enumerate(basis.atom_map):
+        for shell in basis.center_data[atom].electron_shells:
+            pure = shell.harmonic_type == "spherical"
+            exponents = np.asarray(shell.exponents, dtype=float)
+            for L, coefficients in zip(shell.angular_momentum, shell.coefficients):
+                shell_ = Shell(center=None, atom=i, angular_momentum=L,
+                               exponents=exponents,
+                               coefficients=np.asarray(coefficients, dtype=float),
+                               pure=pure, offset=offset)
+                shells.append(shell_)
+                offset += shell_.n_functions
+    ecp_electrons = np.array([basis.center_data[atom].ecp_electrons or 0
+                              for atom in basis.atom_map], dtype=float)
+    return BasisTemplate(shells=shells,
+                         transformation=get_cartesian_transformation(shells),
+                         ecp_electrons=ecp_electrons)
+
+
+def get_shells(qc_wavefunction, template: Optional[BasisTemplate] = None) -> List[Shell]:
+    """Get the shells of a wavefunction's basis set,
+    in the order of the atomic orbitals
+
+    Parameters
+    ----------
+    qc_wavefunction: psiresp.qcutils.QCWaveFunction
+    template: BasisTemplate
+        Parsed basis set of the wavefunction. If not given,
+        it is parsed from the wavefunction
+
+    Returns
+    -------
+    List[Shell]
+    """
+    if template is None:
+        template = get_basis_template(qc_wavefunction.qc_wavefunction.basis)
+    geometry = np.asarray(qc_wavefunction.qcmol.geometry).reshape((-1, 3))
+    return [shell._replace(center=geometry[shell.atom]) for shell in template.shells]
+
+
+def get_nuclear_charges(qc_wavefunction, template: Optional[BasisTemplate] = None) -> np.ndarray:
+    """Get nuclear charges, less any electrons replaced by ECPs"""
+    if template is None:
+        template = get_basis_template(qc_wavefunction.qc_wavefunction.basis)
+    charges = np.array(qc_wavefunction.qcmol.atomic_numbers, dtype=float)
+    return charges - template.ecp_electrons
+
+
+def get_cartesian_transformation(shells: List[Shell]) -> np.ndarray:
+    """Get the matrix transforming Cartesian functions
+    into the pure and Cartesian functions of the basis
+
+    Returns
+    -------
+    numpy.ndarray
+        This has shape (n_functions, n_cartesian_functions)
+    """
+    n_functions = sum(shell.n_functions for shell in shells)
+    n_cartesian = sum(shell.n_cartesian_functions for shell in shells)
+    transformation = np.zeros((n_functions, n_cartesian))
+    j = 0
+    for shell in shells:
+        n = shell.n_cartesian_functions
+        rows = slice(shell.offset, shell.offset + shell.n_functions)
+        if shell.pure:
+            transformation[rows, j:j + n] = get_spherical_transformation(shell.angular_momentum)
+        else:
+            transformation[rows, j:j + n] = np.eye(n)
+        j += n
+    transformation.flags.writeable = False
+    return transformation
+
+
+def get_cartesian_density(shells: List[Shell], density: np.ndarray,
+                          transformation: Optional[np.ndarray] = None) -> np.ndarray:
+    """Transform a density matrix over pure and Cartesian functions
+    into one over Cartesian functions only"""
+    if transformation is None:
+        transformation = get_cartesian_transformation(shells)
+    return transformation.T @ density @ transformation
+
+
+def boys_function(n_max: int, t: np.ndarray,
+                  t_far: Optional[np.ndarray] = None) -> np.ndarray:
+    """Evaluate the Boys functions F_0 to F_n_max
+
+    Parameters
+    ----------
+    n_max: int
+        Highest order
+    t: numpy.ndarray
+        Arguments
+    t_far: numpy.ndarray
+        Arguments above ``t_far`` (broadcast against ``t``)
+        use the asymptotic limit of the Boys function
+        instead of being evaluated exactly.
+
+    Returns
+    -------
+    numpy.ndarray
+        This has shape (n_max + 1, *t.shape)
+    """
+    t = np.asarray(t, dtype=float)
+    values = np.empty((n_max + 1,) + t.shape)
+    if t_far is None:
+        values[:] = _boys_function_exact(n_max, t)
+        return values
+
+    far = t > t_far
+    values[:, far] = _boys_function_asymptotic(n_max, t[far])
+    near = ~far
+    values[:, near] = _boys_function_exact(n_max, t[near])
+    return values
+
+
+def _boys_function_exact(n_max, t):
+    values = np.empty((n_max + 1,) + t.shape)
+    a = n_max + 0.5
+    small = t < 1e-12
+    safe_t = np.where(small, 1, t)
+    large = gamma(a) * gammainc(a, safe_t) / (2 * safe_t ** a)
+    values[n_max] = np.where(small, 1 / (2 * n_max + 1) - t / (2 * n_max + 3), large)
+    # downward recursion is stable
+    exp_t = np.exp(-t)
+    for n in range(n_max, 0, -1):
+        values[n - 1] = (2 * t * values[n] + exp_t) / (2 * n - 1)
+    return values
+
+
+def _boys_function_asymptotic(n_max, t):
+    # the limit of large t, where a Gaussian charge
+    # distribution looks like a point multipole
+    values = np.empty((n_max + 1,) + t.shape)
+    values[0] = 0.5 * np.sqrt(np.pi / t)
+    for n in range(1, n_max + 1):
+        values[n] = values[n - 1] * (2 * n - 1) / (2 * t)
+    return values
+
+
+def _get_hermite_expansion(l_a, l_b, one_over_2p, pa, pb):
+    """Get the Hermite expansion coefficients E^{ij}_t of
+    products of 1D Gaussians, without the exponential prefactor
+
+    Returns
+    -------
+    numpy.ndarray
+        This has shape (l_a + 1, l_b + 1, l_a + l_b + 1, n_primitive_pairs)
+    """
+    coefficients = np.zeros((l_a + 1, l_b + 1, l_a + l_b + 2, len(pa)))
+    coefficients[0, 0, 0] = 1
+    for i in range(l_a + 1):
+        for j in range(l_b + 1):
+            if i == j == 0:
+                continue
+            if i > 0:
+                previous, shift = coefficients[i - 1, j], pa
+            else:
+                previous, shift = coefficients[i, j - 1], pb
+            current = coefficients[i, j]
+            current[:-1] = shift * previous[:-1]
+            current[1:] += one_over_2p * previous[:-1]
+            current[:-2] += np.arange(1, l_a + l_b + 1)[:, None] * previous[1:-1]
+    return coefficients[:, :, :-1]
+
+
+def _get_hermite_integrals(L, p, pc, t_far=None):
+    """Get the Hermite Coulomb integrals R_{tuv} for t + u + v <= L
+
+    Parameters
+    ----------
+    L: int
+        Total angular momentum
+    p: numpy.ndarray
+        Exponents of the primitive pairs, with shape (K, 1)
+    pc: numpy.ndarray
+        Displacements from the grid points to the pair centers,
+        with shape (3, K, N)
+    t_far: numpy.ndarray
+        Thresholds above which to use the asymptotic Boys function,
+        with shape (K, 1)
+
+    Returns
+    -------
+    dict
+        Mapping (t, u, v) to arrays with shape (K, N)
+    """
+    boys = boys_function(L, p * np.einsum("ikn,ikn->kn", pc, pc), t_far=t_far)
+    minus_2p = -2 * p
+    integrals = {}
+    for n in range(L, -1, -1):
+        previous = integrals
+        integrals = {(0, 0, 0): minus_2p ** n * boys[n]}
+        for t, u, v in itertools.product(range(L - n + 1), repeat=3):
+            if not 0 < t + u + v <= L - n:
+                continue
+            if t:
+                value = pc[0] * previous[(t - 1, u, v)]
+                if t > 1:
+                    value += (t - 1) * previous[(t - 2, u, v)]
+            elif u:
+                value = pc[1] * previous[(t, u - 1, v)]
+                if u > 1:
+                    value += (u - 1) * previous[(t, u - 2, v)]
+            else:
+                value = pc[2] * previous[(t, u, v - 1)]
+                if v > 1:
+                    value += (v - 1) * previous[(t, u, v - 2)]
+            integrals[(t, u, v)] = value
+    return integrals
+
+
+def compute_electronic_esp(shells: List[Shell], density: np.ndarray,
+                           points: np.ndarray, tolerance: float = 0) -> np.ndarray:
+    """Compute the electronic contribution to the ESP
+
+    Parameters
+    ----------
+    shells: List[Shell]
+    density: numpy.ndarray
+        Total density matrix over Cartesian functions
+    points: numpy.ndarray
+        Grid points in bohr, with shape (N, 3)
+    tolerance: float
+        If positive, primitive pairs whose density-weighted contribution
+        is estimated to stay below ``tolerance`` are skipped, and
+        grid points far enough from a primitive pair that its charge
+        distribution acts as a point multipole to within ``tolerance``
+        use the asymptotic Boys function.
+
+    Returns
+    -------
+    numpy.ndarray
+        This has shape (N,)
+    """
+    esp = np.zeros(len(points))
+    offsets = np.cumsum([0] + [shell.n_cartesian_functions for shell in shells])
+    for i, shell_a in enumerate(shells):
+        components_a = get_cartesian_components(shell_a.angular_momentum)
+        for j, shell_b in enumerate(shells[:i + 1]):
+            components_b = get_cartesian_components(shell_b.angular_momentum)
+            block = density[offsets[i]:offsets[i + 1], offsets[j]:offsets[j + 1]]
+            if i != j:
+                block = 2 * block
+
+            alpha = shell_a.exponents[:, None]
+            beta = shell_b.exponents[None, :]
+            p = (alpha + beta).ravel()
+            mu = (alpha * beta).ravel() / p
+            ab = shell_a.center - shell_b.center
+            prefactor = (2 * np.pi / p
+                         * np.exp(-mu * ab.dot(ab))
+                         * np.outer(shell_a.coefficients, shell_b.coefficients).ravel())
+            centers = (np.multiply.outer(alpha, shell_a.center)
+                       + np.multiply.outer(beta, shell_b.center)).reshape((-1, 3)) / p[:, None]
+            pa = (centers - shell_a.center).T
+            pb = (centers - shell_b.center).T
+
+            la, lb = shell_a.angular_momentum, shell_b.angular_momentum
+            hermite = [
+                _get_hermite_expansion(la, lb, 0.5 / p, pa[k], pb[k])[
+                    components_a[:, k][:, None], components_b[:, k][None, :]
+                ]
+                for k in range(3)
+            ]
+            # contract the density into the Hermite expansion
+            weights = np.einsum("ab,abtk,abuk,abvk->tuvk", block, *hermite)
+            weights *= prefactor
+
+            t_far = None
+            if tolerance > 0:
+                # estimate the largest contribution of each primitive pair
+                orders = np.add.outer(np.add.outer(*[np.arange(la + lb + 1)] * 2),
+                                      np.arange(la + lb + 1))
+                scale = np.einsum("tuvk,tuvk->k", np.abs(weights),
+                                  np.power.outer(2 * p, orders / 2).transpose((1, 2, 3, 0)))
+                keep = scale >= tolerance
+                if not keep.any():
+                    continue
+                p, centers, weights, scale = p[keep], centers[keep], weights[..., keep], scale[keep]
+                t_far = (np.log(scale / tolerance) + 2 * (la + lb + 1))[:, None]
+
+            pc = centers.T[:, :, None] - points.T[:, None, :]
+            integrals = _get_hermite_integrals(la + lb, p[:, None], pc, t_far=t_far)
+            for (t, u, v), integral in integrals.items():
+                esp -= weights[t, u, v] @ integral
+    return esp
+
+
+def compute_nuclear_esp(coordinates: np.ndarray, charges: np.ndarray,
+                        points: np.ndarray) -> np.ndarray:
+    """Compute the nuclear contribution to the ESP, in bohr units"""
+    displacement = points[:, None, :] - coordinates[None, :, :]
+    distance = np.sqrt(np.einsum("ijk,ijk->ij", displacement, displacement))
+    return (charges / distance).sum(axis=1)
+
+
+def compute_esp(qc_wavefunction, grid: np.ndarray, block_size: int = 2048,
+                template: Optional[BasisTemplate] = None,
+                tolerance: float = 0) -> np.ndarray:
+    """Compute the ESP of a wavefunction on a grid.
+
+    This has the same signature as :func:`psiresp.psi4utils.compute_esp`,
+    but does not require psi4.
+
+    Parameters
+    ----------
+    qc_wavefunction: psiresp.qcutils.QCWaveFunction
+        Restricted wavefunction
+    grid: numpy.ndarray
+        Grid points in angstrom, with shape (N, 3)
+    block_size: int
+        Number of grid points to evaluate at once
+    template: BasisTemplate
+        Parsed basis set of the wavefunction. If not given,
+        it is parsed from the wavefunction
+    tolerance: float
+        Screening tolerance for primitive pair contributions.
+        See :func:`compute_electronic_esp`. The default of 0
+        evaluates every contribution exactly.
+
+    Returns
+    -------
+    numpy.ndarray
+        ESP in atomic units, with shape (N,)
+    """
+    if template is None:
+        template = get_basis_template(qc_wavefunction.qc_wavefunction.basis)
+    shells = get_shells(qc_wavefunction, template=template)
+    density = 2 * get_cartesian_density(shells, qc_wavefunction.reconstruct_density(),
+                                        transformation=template.transformation)
+    coordinates = np.asarray(qc_wavefunction.qcmol.geometry).reshape((-1, 3))
+    charges = get_nuclear_charges(qc_wavefunction, template=template)
+
+    points = np.asarray(grid, dtype=float).reshape((-1, 3)) * ANGSTROM_TO_BOHR
+    esp = np.empty(len(points))
+    for start in range(0, len(points), block_size):
+        block = points[start:start + block_size]
+        esp[start:start + block_size] = (compute_nuclear_esp(coordinates, charges, block)
+                                         + compute_electronic_esp(shells, density, block,
+                                                                  tolerance=tolerance))
+    return esp
+
+
+def group_by_basis(qc_wavefunctions: Sequence) -> Dict[str, Dict[int, List[int]]]:
+    """Group wavefunctions by basis set signature, and then by wavefunction
+
+    Returns
+    -------
+    Dict[str, Dict[int, List[int]]]
+        Indices of ``qc_wavefunctions``, keyed by basis signature
+        and then by the index of the first occurrence of the
+        same wavefunction object
+    """
+    groups = {}
+    first_indices = {}
+    for i, wfn in enumerate(qc_wavefunctions):
+        signature = get_basis_signature(wfn.qc_wavefunction.basis)
+        first = first_indices.setdefault(id(wfn), i)
+        groups.setdefault(signature, {}).setdefault(first, []).append(i)
+    return groups
+
+
+def compute_esps(qc_wavefunctions: Sequence, grids: Sequence[np.ndarray],
+                 block_size: int = 2048, tolerance: float = 0,
+                 ) -> Tuple[List[np.ndarray], List[Dict[str, Any]]]:
+    """Compute the ESPs of many (wavefunction, grid) pairs.
+
+    Pairs are grouped by basis set, so each basis is only parsed once.
+    All grids paired with the same wavefunction object are evaluated
+    together in one pass over the shell pairs.
+
+    Parameters
+    ----------
+    qc_wavefunctions: Sequence[psiresp.qcutils.QCWaveFunction]
+        Restricted wavefunctions
+    grids: Sequence[numpy.ndarray]
+        Grid points in angstrom, each with shape (N_i, 3)
+    block_size: int
+        Number of grid points to evaluate at once
+    tolerance: float
+        Screening tolerance for primitive pair contributions.
+        See :func:`compute_electronic_esp`
+
+    Returns
+    -------
+    esps: List[numpy.ndarray]
+        ESP in atomic units for each pair
+    timings: List[Dict[str, Any]]
+        Timings in seconds for each batch of pairs sharing a basis set
+    """
+    if len(qc_wavefunctions) != len(grids):
+        raise ValueError("The number of wavefunctions and grids must be the same")
+
+    esps = [None] * len(grids)
+    timings = []
+    for signature, wavefunction_indices in group_by_basis(qc_wavefunctions).items():
+        start = time.perf_counter()
+        first = next(iter(wavefunction_indices))
+        template = get_basis_template(qc_wavefunctions[first].qc_wavefunction.basis)
+        setup_time = time.perf_counter() - start
+
+        n_points = 0
+        for i, indices in wavefunction_indices.items():
+            batch_grids = [np.asarray(grids[j]).reshape((-1, 3)) for j in indices]
+            batch_esp = compute_esp(qc_wavefunctions[i], np.concatenate(batch_grids),
+                                    block_size=block_size, template=template,
+                                    tolerance=tolerance)
+            sections = np.cumsum([len(grid) for grid in batch_grids])[:-1]
+            for j, esp in zip(indices, np.split(batch_esp, sections)):
+                esps[j] = esp
+            n_points += len(batch_esp)
+
+        timings.append(get_batch_timing(signature, wavefunction_indices,
+                                        n_points=n_points, start=start,
+                                        setup_time=setup_time))
+    return esps, timings
+
+
+def get_batch_timing(signature: str, wavefunction_indices: Dict[int, List[int]],
+                     n_points: int, start: float, setup_time: float = 0) -> Dict[str, Any]:
+    """Summarize and log the time taken to compute a batch of ESPs
+    started at ``start`` (from :func:`time.perf_counter`).
+    ``indices`` lists the grids computed in the batch."""
+    timing = {
+        "basis": signature,
+        "indices": sorted(j for indices in wavefunction_indices.values() for j in indices),
+        "n_wavefunctions": len(wavefunction_indices),
+        "n_grids": sum(len(indices) for indices in wavefunction_indices.values()),
+        "n_points": n_points,
+        "setup": setup_time,
+        "total": time.perf_counter() - start,
+    }
+    logger.info(f"Computed {timing['n_grids']} ESPs with {n_points} points "
+                f"for basis {signature[:8]} in {timing['total']:.3f} s")
+    return timing
@@ -9,21 +9,233 @@ set the options and call :meth:`psiresp.job.Job.run`.
 
 .. autoclass:: psiresp.grid.GridOptions
     :members:
+
+.. autofunction:: psiresp.grid.get_template_cache_info
+
+.. autofunction:: psiresp.grid.clear_template_cache
 """
 
-from typing import Dict, List, Any, Optional, Union, TYPE_CHECKING
+import functools
+import hashlib
+import itertools
+import logging
+import pathlib
+import tempfile
+from typing import Dict, Iterator, List, Any, Optional, Tuple, Union, TYPE_CHECKING
 
 import numpy as np
 from scipy.spatial import distance as spdist
+from scipy.spatial import cKDTree
 from pydantic import Field
+from typing_extensions import Literal
 import qcelemental as qcel
 
 from . import vdwradii, base
 
+logger = logging.getLogger(__name__)
+
 if TYPE_CHECKING:  # pragma: no cover
     import qcelemental
     import qcfractal
 
+#: Maximum number of sphere templates kept in each process-wide cache
+TEMPLATE_CACHE_SIZE = 1024
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+def _generate_gamess_sphere(n_points: int) -> np.ndarray:
+    if n_points < 1:
+        return np.empty((0, 3))
+    INCREMENT = 1e-10
+    n_latitude_points = int((np.pi * n_points) ** 0.5)
+    # one or two points are placed at the poles
+    n_longitude_points = max(int(n_latitude_points / 2), 1)
+
+    rows = np.arange(n_longitude_points + 1)
+    vertical_angles = rows * np.pi / n_longitude_points
+    z = np.cos(vertical_angles)
+    xy = np.sin(vertical_angles)
+    n_points_per_row = (xy * n_latitude_points + INCREMENT).astype(int)
+    n_points_per_row[n_points_per_row < 1] = 1
+    circum_fraction = [np.arange(n_in_row) / n_in_row
+                       for n_in_row in n_points_per_row]
+    row_points = np.concatenate(circum_fraction) * 2 * np.pi
+    n_specific_points = sum(n_points_per_row)
+
+    points = np.empty((n_specific_points, 3))
+    points[:, -1] = np.repeat(z, n_points_per_row)
+    all_xy = np.repeat(xy, n_points_per_row)
+    points[:, 0] = np.cos(row_points) * all_xy
+    points[:, 1] = np.sin(row_points) * all_xy
+
+    return points[:n_points]
+
+
+#: Parameters of the symmetry orbits that make up each Lebedev point set,
+#: keyed by the number of points. ``a1``, ``a2`` and ``a3`` orbits have no
+#: parameters; ``b`` orbits are (l, l, m); ``c`` orbits are (p, q, 0);
+#: ``d`` orbits are (r, s, t). See Lebedev and Laikov,
+#: Doklady Mathematics 59 (1999) 477.
+LEBEDEV_ORBITS = {
+    6: [("a1",)],
+    14: [("a1",), ("a3",)],
+    26: [("a1",), ("a2",), ("a3",)],
+    38: [("a1",), ("a3",), ("c", 0.4597008433809831)],
+    50: [("a1",), ("a2",), ("a3",), ("b", 0.3015113445777636)],
+    74: [("a1",), ("a2",), ("a3",), ("b", 0.4803844614152614),
+         ("c", 0.3207726489807764)],
+    86: [("a1",), ("a3",), ("b", 0.3696028464541502),
+         ("b", 0.6943540066026664), ("c", 0.3742430390903412)],
+    110: [("a1",), ("a3",), ("b", 0.1851156353447362),
+          ("b", 0.6904210483822922), ("b", 0.3956894730559419),
+          ("c", 0.4783690288121502)],
+    146: [("a1",), ("a2",), ("a3",), ("b", 0.6764410400114264),
+          ("b", 0.4174961227965453), ("b", 0.1574676672039082),
+          ("d", 0.1403553811713183, 0.4493328323269557)],
+    170: [("a1",), ("a2",), ("a3",), ("b", 0.2551252621114134),
+          ("b", 0.6743601460362766), ("b", 0.4318910696719410),
+          ("c", 0.2613931360335988),
+          ("d", 0.4990453161796037, 0.1446630744325115)],
+    194: [("a1",), ("a2",), ("a3",), ("b", 0.6712973442695226),
+          ("b", 0.2892465627575439), ("b", 0.4446933178717437),
+          ("b", 0.1299335447650067), ("c", 0.3457702197611283),
+          ("d", 0.1590417105383530, 0.8360360154824589)],
+    302: [("a1",), ("a3",), ("b", 0.3515640345570105),
+          ("b", 0.6566329410219612), ("b", 0.4729054132581005),
+          ("b", 0.09618308522614784), ("b", 0.2219645236294178),
+          ("b", 0.7011766416089545), ("c", 0.2644152887060663),
+          ("c", 0.5718955891878961),
+          ("d", 0.2510034751770465, 0.8000727494073952),
+          ("d", 0.1233548532583327, 0.4127724083168531)],
+}
+
+
+#: Requests for more points than the largest Lebedev set times this
+#: factor raise an error, instead of silently lowering the point density
+LEBEDEV_MAX_EXCESS = 1.25
+
+
+def _generate_lebedev_orbit(orbit_type: str, *parameters: float) -> np.ndarray:
+    if orbit_type == "a1":
+        generator = (1, 0, 0)
+    elif orbit_type == "a2":
+        generator = (0, 0.5 ** 0.5, 0.5 ** 0.5)
+    elif orbit_type == "a3":
+        generator = (1 / 3 ** 0.5,) * 3
+    elif orbit_type == "b":
+        l, = parameters
+        generator = (l, l, (1 - 2 * l ** 2) ** 0.5)
+    elif orbit_type == "c":
+        p, = parameters
+        generator = (p, (1 - p ** 2) ** 0.5, 0)
+    else:
+        r, s = parameters
+        generator = (r, s, (1 - r ** 2 - s ** 2) ** 0.5)
+
+    permutations = np.array(list(itertools.permutations(generator)))
+    signs = np.array(list(itertools.product([1, -1], repeat=3)))
+    points = (permutations[:, None] * signs[None]).reshape((-1, 3))
+    return np.unique(points + 0.0, axis=0)
+
+
+def _generate_lebedev_sphere(n_points: int) -> np.ndarray:
+    if n_points < 1:
+        return np.empty((0, 3))
+    orders = np.array(sorted(LEBEDEV_ORBITS))
+    if n_points > orders[-1] * LEBEDEV_MAX_EXCESS:
+        raise ValueError(f"Lebedev point sets have at most {orders[-1]} points, "
+                         f"but {n_points} points were requested. "
+                         "Lower the point density or use the `fibonacci` "
+                         "or `gamess` sphere point generators.")
+    order = orders[np.argmin(np.abs(orders - n_points))]
+    orbits = [_generate_lebedev_orbit(*orbit) for orbit in LEBEDEV_ORBITS[order]]
+    return np.concatenate(orbits)
+
+
+def _generate_fibonacci_sphere(n_points: int) -> np.ndarray:
+    indices = np.arange(n_points)
+    z = 1 - (2 * indices + 1) / n_points
+    xy = np.sqrt(1 - z ** 2)
+    golden_angle = np.pi * (3 - np.sqrt(5))
+    azimuths = indices * golden_angle
+
+    points = np.empty((n_points, 3))
+    points[:, 0] = np.cos(azimuths) * xy
+    points[:, 1] = np.sin(azimuths) * xy
+    points[:, 2] = z
+    return points
+
+
+def _allocate_largest_remainder(weights: np.ndarray, n_total: int) -> np.ndarray:
+    """Split ``n_total`` into integers in proportion to ``weights``,
+    giving the remainder to the largest fractional parts"""
+    weights = np.asarray(weights, dtype=float)
+    if not weights.sum():
+        return np.zeros(len(weights), dtype=int)
+    shares = weights / weights.sum() * n_total
+    counts = np.floor(shares).astype(int)
+    n_remaining = n_total - counts.sum()
+    order = np.argsort(counts - shares, kind="stable")
+    counts[order[:n_remaining]] += 1
+    return counts
+
+
+def _get_evenly_spaced_indices(n_points: int, n_target: int) -> np.ndarray:
+    """Indices of ``n_target`` of ``n_points`` items, evenly spaced"""
+    return np.linspace(0, n_points - 1, n_target).round().astype(int)
+
+
+SPHERE_GENERATORS = {
+    "gamess": _generate_gamess_sphere,
+    "fibonacci": _generate_fibonacci_sphere,
+    "lebedev": _generate_lebedev_sphere,
+}
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _get_unit_sphere(n_points: int, generator: str = "gamess") -> np.ndarray:
+    points = SPHERE_GENERATORS[generator](n_points)
+    return _readonly(np.array(points))
+
+
+def _get_n_sphere_points(radius: float, point_density: float) -> int:
+    surface_area = (np.float64(radius) ** 2) * np.pi * 4
+    return int(surface_area * point_density)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _get_connolly_sphere(radius: float, point_density: float,
+                         generator: str = "gamess") -> np.ndarray:
+    n_points = _get_n_sphere_points(radius, point_density)
+    return _readonly(_get_unit_sphere(n_points, generator) * radius)
+
+
+def get_template_cache_info() -> Dict[str, Any]:
+    """
+    Return the hit and miss statistics of the process-wide caches
+    of unit spheres and scaled Connolly spheres.
+
+    Returns
+    -------
+    dict
+        ``functools.lru_cache`` statistics, keyed by
+        ``"unit_sphere"`` and ``"connolly_sphere"``
+    """
+    return {
+        "unit_sphere": _get_unit_sphere.cache_info(),
+        "connolly_sphere": _get_connolly_sphere.cache_info(),
+    }
+
+
+def clear_template_cache():
+    """Clear the process-wide caches of sphere templates"""
+    _get_unit_sphere.cache_clear()
+    _get_connolly_sphere.cache_clear()
+
 
 class GridOptions(base.Model):
     """Options for setting up the grid for ESP computation"""
@@ -54,6 +266,71 @@ class GridOptions(base.Model):
         default=1.0,
         description="Point density in the generated grid shells"
     )
+    sphere_point_generator: Literal["gamess", "fibonacci", "lebedev"] = Field(
+        default="gamess",
+        description=("Method used to place points on each sphere. "
+                     "`gamess` uses the latitude/longitude scheme from GAMESS; "
+                     "`fibonacci` places exactly the number of points given by "
+                     "the point density on a Fibonacci lattice; "
+                     "`lebedev` uses the Lebedev quadrature point set with "
+                     "the closest number of points, up to 302. Shells "
+                     "that need many more points raise an error.")
+    )
+    surface_type: Literal["vdw", "sas"] = Field(
+        default="vdw",
+        description=("Surface model for the grid shells. `vdw` uses "
+                     "Connolly shells at scaled VdW radii, filtered by "
+                     "`grid_rmin` and `grid_rmax`. `sas` uses the "
+                     "solvent-accessible surface of a probe of "
+                     "`probe_radius` around atoms with scaled VdW radii.")
+    )
+    probe_radius: float = Field(
+        default=1.4,
+        description="Radius of the solvent probe for `sas` surfaces, in angstrom"
+    )
+    n_surface_points: Optional[int] = Field(
+        default=None,
+        description=("Target total number of points over all `sas` shells. "
+                     "Grids never have more points than this. "
+                     "If set, this is used instead of `vdw_point_density`.")
+    )
+    merge_tolerance: float = Field(
+        default=0,
+        description=("Points closer than this distance (in angstrom) "
+                     "to an earlier point are removed from the grid. "
+                     "If 0, no points are merged.")
+    )
+    max_n_points: Optional[int] = Field(
+        default=None,
+        description=("Maximum number of points in the grid. Larger grids "
+                     "are thinned with Poisson-disk sampling. "
+                     "If None, grids are not thinned.")
+    )
+    grid_memory_limit: Optional[float] = Field(
+        default=None,
+        description=("Approximate memory ceiling, in megabytes, for "
+                     "filtering shell points. If set, atoms are processed "
+                     "in blocks that fit within this limit. If None, "
+                     "all atoms are processed at once.")
+    )
+    neighbor_search: Literal["cdist", "kdtree"] = Field(
+        default="cdist",
+        description=("Method used to filter shell points against "
+                     "neighboring atoms. `cdist` computes the full "
+                     "distance matrix between all points and atoms; "
+                     "`kdtree` uses a spatial index to only compare "
+                     "points to atoms within the cutoff. "
+                     "Both produce identical grids.")
+    )
+
+    def get_grid_hash(self) -> str:
+        """Hash of the options that affect the generated grid points.
+        ``grid_memory_limit`` and ``neighbor_search`` only change how
+        the grid is computed, so they are excluded."""
+        mash = hashlib.sha1()
+        text = self.json(exclude={"grid_memory_limit", "neighbor_search"})
+        mash.update(text.encode("utf-8"))
+        return mash.hexdigest()
 
     @property
     def effective_rmax(self):
@@ -78,44 +355,27 @@ class GridOptions(base.Model):
         return np.array([given_radii[el] for el in symbols])
 
     @staticmethod
-    def generate_unit_sphere(n_points):
+    def generate_unit_sphere(n_points, generator="gamess"):
         """
         Get coordinates of n points on a unit sphere.
 
-        Adapted from GAMESS.
+        The default generator is adapted from GAMESS.
+        Results are cached and returned as read-only arrays.
 
         Parameters
         ----------
         n_points: int
             maximum number of points
+        generator: str
+            Method used to place the points. One of
+            ``"gamess"``, ``"fibonacci"``, or ``"lebedev"``.
 
         Returns
         -------
         coordinates: np.ndarray
             cartesian coordinates of points
         """
-        INCREMENT = 1e-10
-        n_latitude_points = int((np.pi * n_points) ** 0.5)
-        n_longitude_points = int(n_latitude_points / 2)
-
-        rows = np.arange(n_longitude_points + 1)
-        vertical_angles = rows * np.pi / n_longitude_points
-        z = np.cos(vertical_angles)
-        xy = np.sin(vertical_angles)
-        n_points_per_row = (xy * n_latitude_points + INCREMENT).astype(int)
-        n_points_per_row[n_points_per_row < 1] = 1
-        circum_fraction = [np.arange(n_in_row) / n_in_row
-                           for n_in_row in n_points_per_row]
-        row_points = np.concatenate(circum_fraction) * 2 * np.pi
-        n_specific_points = sum(n_points_per_row)
-
-        points = np.empty((n_specific_points, 3))
-        points[:, -1] = np.repeat(z, n_points_per_row)
-        all_xy = np.repeat(xy, n_points_per_row)
-        points[:, 0] = np.cos(row_points) * all_xy
-        points[:, 1] = np.sin(row_points) * all_xy
-
-        return points[:n_points]
+        return _get_unit_sphere(int(n_points), generator)
 
     def generate_connolly_spheres(self, radii):
         """
@@ -133,14 +393,15 @@ class GridOptions(base.Model):
         """
         radii = np.asarray(radii)
         unique_radii, inverse = np.unique(radii, return_inverse=True)
-        surface_areas = (unique_radii ** 2) * np.pi * 4
-        n_points = (surface_areas * self.vdw_point_density).astype(int)
+        density = float(self.vdw_point_density)
+        shells = [_get_connolly_sphere(float(radius), density,
+                                       self.sphere_point_generator)
+                  for radius in unique_radii]
+        n_points = [max(_get_n_sphere_points(radius, density), len(shell))
+                    for radius, shell in zip(unique_radii, shells)]
         nan_points = np.full((len(unique_radii), max(n_points), 3), np.nan)
-        for i, n in enumerate(n_points):
-            shell = self.generate_unit_sphere(n)
+        for i, shell in enumerate(shells):
             nan_points[i][:len(shell)] = shell
-        nan_points *= unique_radii.reshape((-1, 1, 1))
-        # nan_points = nan_points[:, ~np.all(np.isnan(nan_points), axis=(0, 2))]
         return nan_points[inverse]
 
     def get_shell_within_bounds(self,
@@ -154,8 +415,6 @@ class GridOptions(base.Model):
         ----------
         radii: numpy.ndarray
             This has shape (N,) where N is the number of atoms
-        spheres: numpy.ndarray
-            This has shape (N, M, 3)
         coordinates: numpy.ndarray
             This has shape (N, 3)
 
@@ -164,30 +423,318 @@ class GridOptions(base.Model):
         numpy.ndarray
             with shape (L, 3)
         """
+        blocks = list(self.iter_shell_within_bounds(radii, coordinates))
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate(blocks + [np.empty((0, 3))])
+
+    def get_atom_block_size(self, radii: np.ndarray) -> int:
+        """
+        Get the number of atoms whose shells can be filtered at once
+        while staying within ``grid_memory_limit``.
+
+        Parameters
+        ----------
+        radii: numpy.ndarray
+            This has shape (N,) where N is the number of atoms
+
+        Returns
+        -------
+        int
+        """
+        n_atoms = len(radii)
+        if self.grid_memory_limit is None or not n_atoms:
+            return max(n_atoms, 1)
+        density = float(self.vdw_point_density)
+        n_points = max(_get_n_sphere_points(radius, density)
+                       for radius in np.unique(radii))
+        n_points = max(n_points, 1)
+        # shell coordinates and padded spheres, plus either the dense
+        # distance matrix and its masks or the sparse neighbor pairs
+        if self.neighbor_search == "kdtree":
+            bytes_per_point = 48 + 24 * min(n_atoms, 64)
+        else:
+            bytes_per_point = 48 + 16 * n_atoms
+        limit = self.grid_memory_limit * 1024 ** 2
+        n_block = int(limit // (bytes_per_point * n_points))
+        return min(max(n_block, 1), n_atoms)
+
+    def iter_shell_within_bounds(self,
+                                 radii: np.ndarray,
+                                 coordinates: np.ndarray,
+                                 ) -> Iterator[np.ndarray]:
+        """
+        Filter shell points to lie between `inner_bound` and `outer_bound`,
+        processing the atoms in blocks sized by ``grid_memory_limit``.
+
+        Parameters
+        ----------
+        radii: numpy.ndarray
+            This has shape (N,) where N is the number of atoms
+        coordinates: numpy.ndarray
+            This has shape (N, 3)
 
+        Yields
+        ------
+        numpy.ndarray
+            Accepted points from each block of atoms, with shape (L, 3)
+        """
+        radii = np.asarray(radii)
         inner_bound = radii * self.grid_rmin
         inner_bound = np.where(inner_bound < radii, radii, inner_bound)
         outer_bound = radii * self.effective_rmax
 
-        spheres = self.generate_connolly_spheres(radii)
-        shell = spheres + coordinates.reshape((-1, 1, 3))  # n_atoms, n_points, 3
-        shell_points = np.concatenate(shell)
-        # shell_points = shell_points[~np.isnan(shell_points)]
-
-        # we want to ignore self-to-self false negatives
-        # so we mask all distances calculated from an atom's sphere to the atom
-        # x, y form the mask
-        n_atoms, n_points, _ = spheres.shape
-        atom_indices = np.arange(n_atoms)
-        y = np.repeat(atom_indices, n_points)
-        x = np.arange(len(shell_points))
-
-        distances = spdist.cdist(shell_points, coordinates)  # n_points, n_atoms
-        distances[np.isnan(distances)] = -1
-        within_bounds = (distances >= inner_bound) & (distances <= outer_bound)
-        within_bounds[(x, y)] = True
-        inside = np.all(within_bounds, axis=1)
-        return shell_points[inside]
+        n_atoms = len(radii)
+        n_block = self.get_atom_block_size(radii)
+        for start in range(0, n_atoms, n_block):
+            stop = min(start + n_block, n_atoms)
+            spheres = self.generate_connolly_spheres(radii[start:stop])
+            shell = spheres + coordinates[start:stop].reshape((-1, 1, 3))
+            shell_points = np.concatenate(shell)
+
+            # we want to ignore self-to-self false negatives
+            # so we mask all distances calculated from an atom's sphere to the atom
+            # x, y form the mask
+            n_points = spheres.shape[1]
+            y = np.repeat(np.arange(start, stop), n_points)
+            x = np.arange(len(shell_points))
+
+            if self.neighbor_search == "kdtree":
+                inside = self._get_kdtree_mask(shell_points, y, coordinates,
+                                               inner_bound, outer_bound)
+            else:
+                distances = spdist.cdist(shell_points, coordinates)  # n_points, n_atoms
+                distances[np.isnan(distances)] = -1
+                within_bounds = (distances >= inner_bound) & (distances <= outer_bound)
+                within_bounds[(x, y)] = True
+                inside = np.all(within_bounds, axis=1)
+                inside &= ~np.isnan(shell_points[:, 0])
+            yield shell_points[inside]
+
+    @staticmethod
+    def _get_kdtree_mask(shell_points: np.ndarray,
+                         owners: np.ndarray,
+                         coordinates: np.ndarray,
+                         inner_bound: np.ndarray,
+                         outer_bound: np.ndarray,
+                         ) -> np.ndarray:
+        """
+        Find shell points between `inner_bound` and `outer_bound`
+        of every atom, except the atom each point was generated from.
+        Only atom--point pairs within the largest bound are compared.
+
+        Parameters
+        ----------
+        shell_points: numpy.ndarray
+            This has shape (L, 3). Rows may be NaN.
+        owners: numpy.ndarray
+            This has shape (L,) and contains the index of the atom
+            that generated each point
+        coordinates: numpy.ndarray
+            This has shape (N, 3)
+        inner_bound: numpy.ndarray
+            This has shape (N,)
+        outer_bound: numpy.ndarray
+            This has shape (N,)
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask with shape (L,)
+        """
+        inside = ~np.any(np.isnan(shell_points), axis=1)
+        candidates = np.flatnonzero(inside)
+        if not len(candidates):
+            return inside
+
+        atom_tree = cKDTree(coordinates)
+        point_tree = cKDTree(shell_points[candidates])
+        pairs = atom_tree.sparse_distance_matrix(point_tree, inner_bound.max(),
+                                                 output_type="ndarray")
+        atoms, points = pairs["i"], pairs["j"]
+        too_close = ((pairs["v"] < inner_bound[atoms])
+                     & (owners[candidates][points] != atoms))
+        inside[candidates[points[too_close]]] = False
+
+        if np.all(np.isinf(outer_bound)):
+            return inside
+
+        # every other atom must also lie within its outer bound
+        candidates = np.flatnonzero(inside)
+        if not len(candidates):
+            return inside
+        point_tree = cKDTree(shell_points[candidates])
+        pairs = atom_tree.sparse_distance_matrix(point_tree, outer_bound.max(),
+                                                 output_type="ndarray")
+        atoms, points = pairs["i"], pairs["j"]
+        within = ((pairs["v"] <= outer_bound[atoms])
+                  & (owners[candidates][points] != atoms))
+        n_within = np.bincount(points[within], minlength=len(candidates))
+        inside[candidates[n_within < len(coordinates) - 1]] = False
+        return inside
+
+    def generate_vdw_shells(self,
+                            symbols: List[str],
+                            coordinates: np.ndarray,
+                            ) -> Tuple[np.ndarray, np.ndarray]:
+        """Generate VdW surface points for every scale factor
+        into a single array.
+
+        Parameters
+        ----------
+        symbols: list of str
+            Atom elements
+        coordinates: numpy.ndarray
+            This has shape (N, 3)
+
+        Returns
+        -------
+        points: numpy.ndarray
+            This has shape (M, 3)
+        offsets: numpy.ndarray
+            This has shape (F + 1,), where F is the number of
+            scale factors. The points of the shell generated with
+            ``vdw_scale_factors[i]`` are
+            ``points[offsets[i]:offsets[i + 1]]``
+        """
+        symbol_radii = self.get_vdwradii_for_elements(symbols)
+        # only accepted points are kept, so memory beyond the
+        # block currently being filtered scales with the grid.
+        # The blocks of all shells are joined with one concatenate
+        # at the end, rather than one per shell
+        blocks = []
+        offsets = np.zeros(len(self.vdw_scale_factors) + 1, dtype=int)
+        for i, factor in enumerate(self.vdw_scale_factors):
+            radii = symbol_radii * factor
+            n_points = offsets[i]
+            for block in self.iter_shell_within_bounds(radii, coordinates):
+                blocks.append(block)
+                n_points += len(block)
+            offsets[i + 1] = n_points
+        points = np.concatenate(blocks + [np.empty((0, 3))])
+        return points, offsets
+
+    def generate_sas_shells(self,
+                            symbols: List[str],
+                            coordinates: np.ndarray,
+                            ) -> Tuple[np.ndarray, np.ndarray]:
+        """Generate solvent-accessible surface points for every
+        scale factor into a single array.
+
+        Each shell is the surface traced by the centre of a probe of
+        ``probe_radius`` rolling over the atoms, whose VdW radii are
+        scaled by the scale factor. Points on each expanded atom
+        sphere are kept if they are not inside any other expanded
+        sphere (Shrake and Rupley, 1973). ``grid_rmin`` and
+        ``grid_rmax`` are not used.
+
+        If ``n_surface_points`` is set, it is split between shells in
+        proportion to their exposed surface area, with the remainders
+        of the split given to the shells with the largest fractions so
+        that the shares sum exactly to ``n_surface_points``. Each shell
+        is generated at a point density that gives at least its share,
+        where the sphere point generator allows, and is subsampled to
+        its share. The grid therefore never has more than
+        ``n_surface_points`` points. Lebedev shells have at most the
+        points of the largest Lebedev set on each sphere, and may have
+        fewer than their share.
+
+        Parameters
+        ----------
+        symbols: list of str
+            Atom elements
+        coordinates: numpy.ndarray
+            This has shape (N, 3)
+
+        Returns
+        -------
+        points: numpy.ndarray
+            This has shape (M, 3)
+        offsets: numpy.ndarray
+            This has shape (F + 1,), where F is the number of
+            scale factors. The points of the shell generated with
+            ``vdw_scale_factors[i]`` are
+            ``points[offsets[i]:offsets[i + 1]]``
+        """
+        symbol_radii = self.get_vdwradii_for_elements(symbols)
+        all_radii = [symbol_radii * factor + self.probe_radius
+                     for factor in self.vdw_scale_factors]
+        unbounded = self.copy(update={"grid_rmin": 0, "grid_rmax": -1})
+
+        if self.n_surface_points is None:
+            shells = [unbounded.get_shell_within_bounds(radii, coordinates)
+                      for radii in all_radii]
+        else:
+            shells = self._generate_sas_shells_with_n_points(all_radii, coordinates)
+
+        offsets = np.zeros(len(shells) + 1, dtype=int)
+        offsets[1:] = np.cumsum([len(shell) for shell in shells])
+        points = np.concatenate(shells + [np.empty((0, 3))])
+        if self.n_surface_points is not None and len(points) > self.n_surface_points:
+            indices = _get_evenly_spaced_indices(len(points), self.n_surface_points)
+            points = points[indices]
+            offsets = np.searchsorted(indices, offsets)
+        return points, offsets
+
+    def _generate_sas_shells_with_n_points(self,
+                                           all_radii: List[np.ndarray],
+                                           coordinates: np.ndarray,
+                                           max_n_attempts: int = 10,
+                                           ) -> List[np.ndarray]:
+        """Generate one SAS shell for each array of expanded radii,
+        sharing ``n_surface_points`` between them in proportion to
+        their exposed surface area"""
+        unbounded = self.copy(update={"grid_rmin": 0, "grid_rmax": -1})
+        # the exposed area of each shell is estimated from a pilot
+        # surface. Fibonacci spheres have exactly the requested number
+        # of points, and no upper limit
+        pilot_density = 1.0
+        pilot = unbounded.copy(update={"vdw_point_density": pilot_density,
+                                       "sphere_point_generator": "fibonacci"})
+        areas = np.array([
+            len(pilot.get_shell_within_bounds(radii, coordinates)) / pilot_density
+            for radii in all_radii
+        ])
+        n_targets = _allocate_largest_remainder(areas, self.n_surface_points)
+
+        shells = []
+        for radii, area, n_target in zip(all_radii, areas, n_targets):
+            if not n_target:
+                shells.append(np.empty((0, 3)))
+                continue
+            max_density = np.inf
+            if self.sphere_point_generator == "lebedev" and len(radii):
+                # the largest sphere may not need more points than
+                # the largest Lebedev set allows
+                sphere_area = 4 * np.pi * np.max(radii) ** 2
+                max_density = max(LEBEDEV_ORBITS) * LEBEDEV_MAX_EXCESS / sphere_area
+            # oversample, as points are lost to rounding on every sphere
+            density = min(1.1 * n_target / area, max_density)
+            for _ in range(max_n_attempts):
+                options = unbounded.copy(update={"vdw_point_density": density})
+                shell = options.get_shell_within_bounds(radii, coordinates)
+                if len(shell) >= n_target or density >= max_density:
+                    break
+                density = min(density * max(2, 1.1 * n_target / max(len(shell), 1)),
+                              max_density)
+            if len(shell) > n_target:
+                shell = shell[_get_evenly_spaced_indices(len(shell), n_target)]
+            shells.append(shell)
+        return shells
+
+    def generate_shells(self,
+                        symbols: List[str],
+                        coordinates: np.ndarray,
+                        ) -> Tuple[np.ndarray, np.ndarray]:
+        """Generate surface points for every scale factor with
+        the method given by ``surface_type``.
+
+        See :meth:`~psiresp.grid.GridOptions.generate_vdw_shells`
+        and :meth:`~psiresp.grid.GridOptions.generate_sas_shells`.
+        """
+        if self.surface_type == "sas":
+            return self.generate_sas_shells(symbols, coordinates)
+        return self.generate_vdw_shells(symbols, coordinates)
 
     def _generate_vdw_grid(self,
                            symbols: List[str],
@@ -207,13 +754,8 @@ class GridOptions(base.Model):
         numpy.ndarray
             This has shape (M, 3)
         """
-        symbol_radii = self.get_vdwradii_for_elements(symbols)
-
-        points = []
-        for factor in self.vdw_scale_factors:
-            radii = symbol_radii * factor
-            points.extend(self.get_shell_within_bounds(radii, coordinates))
-        return np.array(points)
+        points, _ = self.generate_vdw_shells(symbols, coordinates)
+        return points
 
     def generate_grid(self,
                       molecule: Union[str, int,
@@ -223,7 +765,7 @@ class GridOptions(base.Model):
                                       ],
                       client: Optional["qcfractal.interface.client.FractalClient"] = None,
                       ) -> np.ndarray:
-        """Generate VdW surface points
+        """Generate surface points
         """
         if isinstance(molecule, dict):
             molecule = qcel.models.Molecule.from_data(molecule, validate=True)
@@ -243,5 +785,218 @@ class GridOptions(base.Model):
 
         bohr2angstrom = qcel.constants.conversion_factor("bohr", "angstrom")
         coordinates = molecule.geometry * bohr2angstrom
-        grid = self._generate_vdw_grid(molecule.symbols, coordinates)
+        grid, _ = self.generate_shells(molecule.symbols, coordinates)
+        if self.merge_tolerance > 0 or self.max_n_points is not None:
+            grid, n_removed = self.thin_grid(grid)
+            logger.info(f"Removed {n_removed} points from grid; {len(grid)} remaining")
+        return grid
+
+    def get_grid_file_for_molecule(self,
+                                   qcmol: "qcelemental.models.Molecule",
+                                   working_directory: Union[str, pathlib.Path] = ".",
+                                   make_directory: bool = False,
+                                   ) -> pathlib.Path:
+        """Get the path of the cached grid for a molecule.
+
+        The file name is keyed by the hashes of both the molecule
+        and the grid options that affect the grid points.
+        """
+        cwd = pathlib.Path(working_directory) / "grids"
+        if make_directory:
+            cwd.mkdir(exist_ok=True, parents=True)
+
+        name = qcmol.name if qcmol.name else qcmol.get_molecular_formula()
+        return cwd / f"{name}_{qcmol.get_hash()}_{self.get_grid_hash()}.npy"
+
+    def load_or_generate_grid(self,
+                              qcmol: "qcelemental.models.Molecule",
+                              working_directory: Union[str, pathlib.Path] = ".",
+                              mmap_mode: Optional[str] = None,
+                              ) -> np.ndarray:
+        """Load the grid for a molecule from ``working_directory``,
+        or generate and save it if it has not been cached yet.
+
+        Parameters
+        ----------
+        qcmol: qcelemental.models.Molecule
+            QCElemental molecule
+        working_directory: Union[str, pathlib.Path]
+            Directory that contains the ``grids`` cache directory
+        mmap_mode: Optional[str]
+            Memory-map mode used to load cached grids.
+            If None, grids are read fully into memory
+            and no file handle is kept open.
+
+        Returns
+        -------
+        numpy.ndarray
+            This has shape (M, 3)
+        """
+        path = self.get_grid_file_for_molecule(qcmol,
+                                               working_directory=working_directory,
+                                               make_directory=False)
+        try:
+            grid = np.load(path, mmap_mode=mmap_mode)
+        except (FileNotFoundError, ValueError, OSError):
+            pass
+        else:
+            logger.debug(f"Loaded grid from {path}")
+            return grid
+
+        grid = self.generate_grid(qcmol)
+        path = self.get_grid_file_for_molecule(qcmol,
+                                               working_directory=working_directory,
+                                               make_directory=True)
+        # write then rename, so concurrent readers never see partial files
+        # each writer gets its own file, as threads share a process ID
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp",
+                                         delete=False) as f:
+            np.save(f, grid)
+        pathlib.Path(f.name).replace(path)
+        logger.debug(f"Wrote grid to {path}")
         return grid
+
+    @staticmethod
+    def _get_poisson_disk_indices(points: np.ndarray,
+                                  radius: float,
+                                  order: Optional[np.ndarray] = None,
+                                  tree: Optional[cKDTree] = None,
+                                  ) -> np.ndarray:
+        """
+        Greedily select points so that no two selected points
+        are closer than ``radius``, visiting points in ``order``.
+        Returns the sorted indices of the selected points.
+        """
+        if order is None:
+            order = np.arange(len(points))
+        if tree is None:
+            tree = cKDTree(points)
+        # points with many neighbors are thinned to few points, and
+        # only the neighbors of kept points are looked up. Otherwise
+        # finding all close pairs at once is faster
+        sample = points[order[:64]]
+        n_neighbors = tree.query_ball_point(sample, radius, return_length=True)
+        if np.mean(n_neighbors) > 16:
+            removed = np.zeros(len(points), dtype=bool)
+            kept = []
+            for i in order:
+                if not removed[i]:
+                    kept.append(i)
+                    removed[tree.query_ball_point(points[i], radius)] = True
+            return np.sort(kept)
+
+        pairs = tree.query_pairs(radius, output_type="ndarray")
+        if not len(pairs):
+            return np.arange(len(points))
+
+        # neighbor lists in compressed form
+        pairs = np.concatenate([pairs, pairs[:, ::-1]])
+        pairs = pairs[np.argsort(pairs[:, 0], kind="stable")]
+        starts = np.searchsorted(pairs[:, 0], np.arange(len(points) + 1))
+        neighbors = pairs[:, 1]
+
+        keep = np.ones(len(points), dtype=bool)
+        for i in order:
+            if keep[i]:
+                keep[neighbors[starts[i]:starts[i + 1]]] = False
+                keep[i] = True
+        return np.flatnonzero(keep)
+
+    def get_thinned_indices(self, points: np.ndarray) -> np.ndarray:
+        """
+        Get the indices of grid points kept after merging points
+        within ``merge_tolerance`` and thinning to ``max_n_points``.
+
+        Merging keeps the earliest point of each close group,
+        so points from inner shells take precedence. Thinning selects
+        points in a fixed pseudo-random order with the largest
+        exclusion radius that leaves at most ``max_n_points``.
+
+        Parameters
+        ----------
+        points: numpy.ndarray
+            This has shape (M, 3)
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted indices of kept points
+        """
+        indices = np.arange(len(points))
+        if not len(points):
+            return indices
+        if self.merge_tolerance > 0:
+            indices = self._get_poisson_disk_indices(points, self.merge_tolerance)
+
+        if self.max_n_points is None or len(indices) <= self.max_n_points:
+            return indices
+        if self.max_n_points <= 0:
+            return indices[:0]
+
+        subset = points[indices]
+        tree = cKDTree(subset)
+        order = np.random.default_rng(0).permutation(len(subset))
+        # start from an estimate of the radius from the area covered by
+        # the points: each point covers about the square of the distance
+        # to its nearest neighbor, and random sequential packing covers
+        # about half of the area with disks. Nearby shells are also
+        # excluded, so the estimate is lowered further
+        distances, _ = tree.query(subset, k=2)
+        spacing = max(np.median(distances[:, 1]), 1e-3)
+        ratio = len(subset) / self.max_n_points
+        min_radius = max(self.merge_tolerance, 1e-3)
+        radius = max(0.55 * spacing * ratio ** 0.5, min_radius)
+        diameter = np.linalg.norm(np.ptp(subset, axis=0))
+
+        # bracket the smallest radius that leaves at most max_n_points
+        step = 1.1
+        kept = self._get_poisson_disk_indices(subset, radius, order, tree)
+        if len(kept) > self.max_n_points:
+            lower = radius
+            while len(kept) > self.max_n_points:
+                lower = radius
+                radius *= step
+                if radius > diameter:
+                    # only one point can be kept
+                    return indices[order[:1]]
+                kept = self._get_poisson_disk_indices(subset, radius, order, tree)
+            upper = radius
+        else:
+            upper = radius
+            while radius > min_radius:
+                radius /= step
+                selected = self._get_poisson_disk_indices(subset, radius, order, tree)
+                if len(selected) > self.max_n_points:
+                    break
+                upper = radius
+                kept = selected
+            lower = radius
+        while upper / lower > 1.005:
+            radius = (lower * upper) ** 0.5
+            selected = self._get_poisson_disk_indices(subset, radius, order, tree)
+            if len(selected) > self.max_n_points:
+                lower = radius
+            else:
+                upper = radius
+                kept = selected
+        return indices[kept]
+
+    def thin_grid(self, points: np.ndarray) -> Tuple[np.ndarray, int]:
+        """
+        Merge grid points within ``merge_tolerance`` and thin the grid
+        to at most ``max_n_points`` with Poisson-disk sampling.
+
+        Parameters
+        ----------
+        points: numpy.ndarray
+            This has shape (M, 3)
+
+        Returns
+        -------
+        points: numpy.ndarray
+            This has shape (L, 3)
+        n_removed: int
+            Number of points removed
+        """
+        indices = self.get_thinned_indices(points)
+        return points[indices], len(points) - len(indices)
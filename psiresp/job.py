@@ -1,5 +1,15 @@
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
+from typing_extensions import Literal
 import multiprocessing
+import multiprocessing.pool
+import os
+import csv
+import json
+import time
+import warnings
+import concurrent.futures
+import contextlib
+import functools
 import itertools
 import pathlib
 import logging
@@ -12,13 +22,50 @@ import scipy.linalg
 from . import base, molecule, charge, qm, grid, resp
 from .charge import MoleculeChargeConstraints
 from .resp import RespCharges
-from .orientation import Orientation
 from .constraint import ESPSurfaceConstraintMatrix
+from .sharedmem import SharedArray, ensure_resource_tracker
+from .task import ESPTask, run_esp_task
 from .utils import require_package
 
 logger = logging.getLogger(__name__)
 
 
+def _iter_future_results(futures):
+    """Iterate over the results of futures as they complete.
+    Futures that are not from :mod:`concurrent.futures`
+    are waited on in order."""
+    if all(isinstance(future, concurrent.futures.Future) for future in futures):
+        futures = concurrent.futures.as_completed(futures)
+    for future in futures:
+        yield future.result()
+
+
+def _submit_to_pool(pool, function, item) -> concurrent.futures.Future:
+    """Submit ``function(item)`` to a :class:`multiprocessing.pool.Pool`,
+    returning a :class:`concurrent.futures.Future` for its result"""
+    future = concurrent.futures.Future()
+    pool.apply_async(function, (item,), callback=future.set_result,
+                     error_callback=future.set_exception)
+    return future
+
+
+def _iter_bounded_results(submit, items, window: int):
+    """Submit ``items`` with ``submit``, keeping at most ``window``
+    of them in flight, and yield results as they complete.
+    ``items`` is only consumed as earlier results are yielded."""
+    items = iter(items)
+    pending = [submit(item) for item in itertools.islice(items, window)]
+    while pending:
+        if all(isinstance(future, concurrent.futures.Future) for future in pending):
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            future = next(iter(done))
+        else:
+            future = pending[0]
+        pending.remove(future)
+        yield future.result()
+        pending.extend(submit(item) for item in itertools.islice(items, 1))
+
+
 class Job(base.Model):
     """Class to manage RESP jobs. It is expected that
     all RESP calculations will be run through this class.
@@ -74,13 +121,102 @@ class Job(base.Model):
         description="Stage 2 charges. These need to be computed by calling `run()` or `compute_charges()` directly."
     )
 
+    reuse_conformer_grids: bool = Field(
+        default=False,
+        description=("Whether to generate the grid once per conformer and "
+                     "map it onto each orientation with the orientation's "
+                     "rigid-body transformation, instead of generating a "
+                     "new grid for every orientation. The fitted surface "
+                     "points are then identical across the orientations "
+                     "of a conformer, relative to its atoms: extra "
+                     "orientations add no new points to the fit, and "
+                     "with the same ESPs give the same charges as a "
+                     "single orientation")
+    )
+
+    cache_grids: bool = Field(
+        default=False,
+        description=("Whether to save generated grids in the working directory, "
+                     "and reuse them when the job is run again")
+    )
+
+    esp_engine: Literal["psi4", "numpy"] = Field(
+        default="psi4",
+        description=("Program used to compute the ESP on grids. "
+                     "'numpy' uses the analytic implementation in "
+                     "psiresp.esp, which does not require psi4")
+    )
+
+    esp_tolerance: float = Field(
+        default=0,
+        description=("Screening tolerance for contributions to the ESP "
+                     "from pairs of primitive basis functions, in atomic units. "
+                     "Negligible pairs are skipped and distant grid points treat "
+                     "pairs as point multipoles. 0 evaluates everything exactly. "
+                     "Only used with esp_engine='numpy'")
+    )
+
+    batch_esps: bool = Field(
+        default=False,
+        description=("Whether to compute ESPs in this process in batches "
+                     "grouped by basis set, instead of in a multiprocessing pool. "
+                     "Batches run serially, so `n_processes` has no effect. "
+                     "With esp_engine='psi4', the psi4 wavefunction and ESP "
+                     "calculator are only shared between grids of the same "
+                     "wavefunction, as psi4 basis sets depend on the geometry")
+    )
+
+    esp_backend: Literal["processes", "threads"] = Field(
+        default="processes",
+        description=("Whether to compute ESPs in a pool of processes, "
+                     "or in a pool of threads that share the orientations "
+                     "in memory instead of pickling them to workers")
+    )
+
+    keep_grids_and_esps: bool = Field(
+        default=True,
+        description=("Whether to keep the grid and ESP of each orientation "
+                     "after its surface constraint matrix has been computed. "
+                     "Discarding them keeps memory flat with respect to "
+                     "the number of orientations")
+    )
+
+    esp_transport: Literal["pickle", "shared_memory"] = Field(
+        default="pickle",
+        description=("How grids, densities and ESPs are passed to and from "
+                     "worker processes. 'shared_memory' computes "
+                     "densities in this process and only sends handles to "
+                     "shared memory blocks, so the cost of passing each task "
+                     "does not depend on the basis set or grid size. Grids "
+                     "that have not been computed yet are generated by the "
+                     "workers. Only used with esp_backend='processes'")
+    )
+
+    constraint_matrix_dtype: Literal["float64", "float32"] = Field(
+        default="float64",
+        description=("Precision used to compute the inverse distances between "
+                     "atoms and grid points, and their products, when constructing "
+                     "surface constraint matrices. 'float32' halves the memory "
+                     "traffic; sums over grid points are still accumulated in "
+                     "float64. Use `compute_charge_deviation_from_float64()` "
+                     "to check the effect on charges")
+    )
+
     n_processes: Optional[int] = Field(
         default=None,
-        description=("Number of processes to use in multiprocessing "
+        description=("Number of processes or threads to use "
                      "during ESP computation. `n_processes=None` uses "
                      "the number of CPUs.")
     )
 
+    n_psi4_threads: Optional[int] = Field(
+        default=None,
+        description=("Number of threads psi4 uses for each ESP evaluation. "
+                     "`n_psi4_threads=None` keeps the psi4 setting.")
+    )
+
+    _esp_timings: List[Dict[str, Any]] = []
+
     @classmethod
     def from_smiles(cls, smiles: str, order_by_map_number: bool = False, **kwargs):
         mol = molecule.Molecule.from_smiles(smiles, order_by_map_number=order_by_map_number)
@@ -95,6 +231,18 @@ class Job(base.Model):
                 return self.stage_1_charges
         return self.stage_2_charges.charges
 
+    @property
+    def esp_timings(self) -> List[Dict[str, Any]]:
+        """Timings of the last :meth:`compute_esps` call, with one entry
+        per orientation. Write them out with :meth:`write_esp_timings`."""
+        return self._esp_timings
+
+    @property
+    def _grid_directory(self):
+        if self.cache_grids:
+            return self.working_directory
+        return None
+
     @property
     def conformers(self):
         return list(self.iter_conformers())
@@ -167,49 +315,323 @@ class Job(base.Model):
         for orient, wfn in zip(orientations, results):
             orient.qc_wavefunction = wfn
 
-    def compute_esps(self):
-        """Compute ESP on a grid for each orientation in a multiprocessing pool"""
-        orientations = [orientation
-                        for mol in self.molecules
-                        for conformer in mol.conformers
-                        for orientation in conformer.orientations
-                        if orientation.esp is None]
-        tqorientations = tqdm.tqdm(orientations,
-                                   desc="compute-esp")
-        # create functions for multiprocessing mapping
-        computer = self._try_compute_esp if self.defer_errors else self._compute_esp
+    def compute_esps(self, executor=None):
+        """Compute ESP on a grid for each orientation in a pool of processes or threads.
+        The time spent on each orientation is stored in :attr:`esp_timings`.
+
+        Parameters
+        ----------
+        executor: concurrent.futures.Executor
+            An existing executor to run the computations in,
+            instead of creating a new pool. This can be any object
+            with a ``submit`` method returning futures with a ``result``
+            method, such as a dask ``distributed.Client``.
+        """
+        if self.reuse_conformer_grids:
+            for conformer in self.iter_conformers():
+                conformer.map_grid_to_orientations(self.grid_options,
+                                                   working_directory=self._grid_directory)
+
+        orientations = []
+        timings = []
+        for i, mol in enumerate(self.molecules):
+            for j, conformer in enumerate(mol.conformers):
+                for k, orientation in enumerate(conformer.orientations):
+                    if orientation.esp is None and orientation._constraint_matrix is None:
+                        orientations.append(orientation)
+                        timings.append({"molecule": i, "conformer": j, "orientation": k,
+                                        "n_atoms": len(orientation.qcmol.symbols)})
+        try:
+            self._compute_esps(orientations, timings, executor=executor)
+        finally:
+            self._esp_timings = timings
+
+    def _compute_esps(self, orientations, timings, executor=None):
+        """Compute ESPs with the configured strategy, filling in ``timings``"""
+        if self.batch_esps:
+            self._compute_esps_in_batches(orientations, timings=timings)
+            return
 
-        with multiprocessing.Pool(processes=self.n_processes) as pool:
-            results = pool.map(computer, tqorientations)
+        if self.esp_transport == "shared_memory" and self.esp_backend == "processes":
+            self._compute_esps_in_shared_memory(orientations, timings=timings,
+                                                executor=executor)
+            return
+
+        # results stream back as they finish, so each orientation
+        # can drop its grid and ESP as soon as its matrix is built
+        # threads share this process, so they use the wavefunctions
+        # directly and cache each density on its orientation
+        in_process = executor is None and self.esp_backend == "threads"
+        tasks = []
+        for i, orientation in enumerate(orientations):
+            wavefunction = orientation.qc_wavefunction if in_process else None
+            tasks.append(ESPTask.from_orientation(i, orientation, wavefunction=wavefunction,
+                                                  **self._esp_task_kwargs))
+        results = self._map_unordered(run_esp_task, tasks, executor=executor)
+        self._set_esp_results(orientations, tasks, results, timings=timings)
 
-        # raise errors if any occurred
-        errors = [r for r in results if not isinstance(r, Orientation)]
+    @property
+    def _esp_task_kwargs(self):
+        return dict(grid_options=self.grid_options,
+                    working_directory=self._grid_directory,
+                    engine=self.esp_engine,
+                    tolerance=self.esp_tolerance,
+                    matrix_dtype=self.constraint_matrix_dtype,
+                    n_psi4_threads=self.n_psi4_threads,
+                    keep_grid_and_esp=self.keep_grids_and_esps,
+                    defer_errors=self.defer_errors)
+
+    def _map_unordered(self, function, items, executor=None):
+        """Apply ``function`` to each item in the executor, or
+        the job's pool, yielding results as they are completed"""
+        for item in items:
+            if isinstance(item, ESPTask):
+                item.submitted = time.time()
+        if executor is not None:
+            futures = [executor.submit(function, item) for item in items]
+            yield from _iter_future_results(futures)
+        elif self.esp_backend == "threads":
+            if self.esp_engine == "psi4":
+                self._set_psi4_threads()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_processes) as executor:
+                futures = [executor.submit(function, item) for item in items]
+                yield from _iter_future_results(futures)
+        else:
+            with multiprocessing.Pool(processes=self.n_processes) as pool:
+                yield from pool.imap_unordered(function, items)
+
+    def _compute_esps_in_shared_memory(self, orientations, timings, executor=None):
+        """Compute ESPs in worker processes, passing densities, and grids
+        and ESPs when this process already has the grid, through shared
+        memory instead of pickling them. Orientations without grids have
+        them generated by the workers. Shared blocks are only allocated
+        for the tasks in flight, and freed as each result is set."""
+        n_processes = self.n_processes or os.cpu_count() or 1
+        # one task running and one queued for each worker
+        window = 2 * n_processes
+        tasks = {}
+        handles = {}
+
+        def iter_tasks():
+            for i, (orientation, timing) in enumerate(zip(orientations, timings)):
+                wfn = orientation.qc_wavefunction
+                cached = wfn.density_is_cached
+                start = time.perf_counter()
+                density = wfn.reconstruct_density()
+                timing["wavefunction"] = time.perf_counter() - start
+                handles[i] = [SharedArray.from_array(density)]
+                if not cached and not self.keep_grids_and_esps:
+                    wfn.clear_density_cache()
+                grid = esp = None
+                if orientation.grid is not None:
+                    grid = SharedArray.from_array(orientation.grid)
+                    esp = SharedArray.empty((len(orientation.grid),))
+                    handles[i].extend([grid, esp])
+                tasks[i] = ESPTask.from_orientation(i, orientation, grid=grid,
+                                                    density=handles[i][0], esp=esp,
+                                                    **self._esp_task_kwargs)
+                yield tasks[i]
+
+        def release(results):
+            for result in results:
+                yield result
+                del tasks[result.index]
+                for handle in handles.pop(result.index):
+                    handle.unlink()
+
+        try:
+            with contextlib.ExitStack() as stack:
+                if executor is None:
+                    # no blocks exist yet, so start the tracker before forking
+                    ensure_resource_tracker()
+                    executor = stack.enter_context(multiprocessing.Pool(processes=self.n_processes))
+                results = self._map_bounded(run_esp_task, iter_tasks(), window,
+                                            executor=executor)
+                self._set_esp_results(orientations, tasks, release(results), timings=timings)
+        finally:
+            for blocks in handles.values():
+                for handle in blocks:
+                    handle.unlink()
+
+    @staticmethod
+    def _map_bounded(function, items, window, executor):
+        """Apply ``function`` to each item in ``executor``, which is
+        either an object with a ``submit`` method or a
+        :class:`multiprocessing.pool.Pool`, with at most
+        ``window`` items in flight"""
+        def submit(item):
+            item.submitted = time.time()
+            if isinstance(executor, multiprocessing.pool.Pool):
+                return _submit_to_pool(executor, function, item)
+            return executor.submit(function, item)
+        return _iter_bounded_results(submit, items, window)
+
+    def _set_esp_results(self, orientations, tasks, results, timings):
+        """Set the grids, ESPs and constraint matrices of orientations
+        from an iterable of :class:`~psiresp.task.ESPTaskResult`,
+        add the timings of each task to ``timings``,
+        and raise any deferred errors. ESPs written to
+        shared memory are copied out of it."""
+        errors = []
+        for result in tqdm.tqdm(results, total=len(orientations), desc="compute-esp"):
+            received = time.time()
+            task = tasks[result.index]
+            timing = timings[result.index]
+            if result.error is not None:
+                timing["error"] = result.error
+                errors.append(result.error)
+                continue
+
+            worker_timings = dict(result.timings)
+            started = worker_timings.pop("started")
+            finished = worker_timings.pop("finished")
+            for key, value in worker_timings.items():
+                if isinstance(value, float):
+                    value += timing.get(key, 0)
+                timing[key] = value
+            # these include pickling, transfer, and waiting
+            # for a free worker or for this process
+            timing["submit_to_start"] = started - task.submitted
+            timing["finish_to_receive"] = received - finished
+
+            orientation = orientations[result.index]
+            if result.grid is not None:
+                orientation.grid = result.grid
+            if result.esp is not None:
+                orientation.esp = result.esp
+            elif task.esp is not None and self.keep_grids_and_esps:
+                orientation.esp = np.array(task.esp.to_numpy())
+            # assigning grids and ESPs clears the matrix, so set it last
+            orientation._constraint_matrix = result.constraint_matrix
+            orientation._constraint_matrix_dtype = task.matrix_dtype
+            if not self.keep_grids_and_esps:
+                orientation.discard_grid_and_esp()
         if errors:
             raise ValueError(*errors)
-        for orientation, o2 in zip(orientations, results):
-            # TODO: fix this, it's clumsy
-            orientation.esp = o2.esp
-            orientation.grid = o2.grid
 
-    def _compute_esp(self, orientation):
-        """Compute the grid and ESP for an orientation with the job's grid options"""
-        require_package("psi4")
-        if orientation.grid is None:
-            orientation.compute_grid(grid_options=self.grid_options)
-        orientation.compute_esp()
-        assert orientation.esp is not None
-        return orientation
-
-    def _try_compute_esp(self, orientation):
-        """Wrap ESP computation in a try/except to defer errors"""
-        require_package("psi4")
+    def _compute_esps_in_batches(self, orientations, timings=None):
+        """Compute the grids, then the ESPs of orientations grouped by basis set.
+        ESPs are timed per batch, and each orientation is given a share
+        of its batch's time in proportion to its number of points.
+        Batches are computed serially in this process."""
+        if self.n_processes is not None and self.n_processes > 1:
+            warnings.warn("ESPs are computed serially when batch_esps=True, "
+                          f"so n_processes={self.n_processes} has no effect")
+        if self.esp_engine == "psi4":
+            require_package("psi4")
+            from .psi4utils import compute_esps
+            self._set_psi4_threads()
+        else:
+            from .esp import compute_esps as compute_numpy_esps
+            compute_esps = functools.partial(compute_numpy_esps, tolerance=self.esp_tolerance)
+
+        if timings is None:
+            timings = [{} for orientation in orientations]
+        errors = []
+
+        def defer(error, indices):
+            if not self.defer_errors:
+                raise error
+            for i in indices:
+                timings[i]["error"] = str(error)
+            errors.append(str(error))
+
+        batched = []
+        for i, (orientation, timing) in enumerate(zip(orientations, timings)):
+            if orientation.grid is None:
+                start = time.perf_counter()
+                try:
+                    orientation.compute_grid(grid_options=self.grid_options,
+                                             working_directory=self._grid_directory)
+                except Exception as e:
+                    defer(e, [i])
+                    continue
+                timing["grid"] = time.perf_counter() - start
+            timing["n_points"] = len(orientation.grid)
+            batched.append(i)
+
         try:
-            return self._compute_esp(orientation)
-        except BaseException as e:
-            return str(e)
+            esps, batch_timings = compute_esps([orientations[i].qc_wavefunction for i in batched],
+                                               [orientations[i].grid for i in batched])
+        except Exception as e:
+            defer(e, batched)
+            raise ValueError(*errors)
 
-    def run(self, client=None, update_molecules: bool = True) -> np.ndarray:
-        """Run the whole job"""
+        for batch, batch_timing in enumerate(batch_timings):
+            n_points = max(batch_timing["n_points"], 1)
+            for j in batch_timing["indices"]:
+                timing = timings[batched[j]]
+                timing["batch"] = batch
+                timing["esp"] = batch_timing["total"] * timing["n_points"] / n_points
+
+        for i, esp in zip(batched, esps):
+            orientation = orientations[i]
+            orientation.esp = esp
+            start = time.perf_counter()
+            try:
+                orientation.construct_constraint_matrix(dtype=self.constraint_matrix_dtype)
+            except Exception as e:
+                defer(e, [i])
+            else:
+                timings[i]["constraint_matrix"] = time.perf_counter() - start
+            if not self.keep_grids_and_esps:
+                orientation.discard_grid_and_esp()
+        if errors:
+            raise ValueError(*errors)
+        return batch_timings
+
+    def write_esp_timings(self, filename: Optional[str] = None):
+        """Write the timings of the last :meth:`compute_esps` call.
+
+        Parameters
+        ----------
+        filename: str
+            File to write to. Files ending in ``.json`` are written
+            as JSON, and anything else as CSV. The default is
+            ``esp_timings.csv`` in the working directory.
+
+        Returns
+        -------
+        pathlib.Path
+            The file written
+        """
+        if filename is None:
+            filename = self.working_directory / "esp_timings.csv"
+        filename = pathlib.Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+
+        if filename.suffix == ".json":
+            with open(filename, "w") as f:
+                json.dump(self.esp_timings, f, indent=2)
+            return filename
+
+        # orientations that failed or were batched lack some columns
+        columns = {}
+        for timing in self.esp_timings:
+            columns.update(dict.fromkeys(timing))
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(columns))
+            writer.writeheader()
+            writer.writerows(self.esp_timings)
+        return filename
+
+    def _set_psi4_threads(self):
+        if self.n_psi4_threads is not None:
+            import psi4
+            psi4.set_num_threads(self.n_psi4_threads, quiet=True)
+
+    def run(self, client=None, update_molecules: bool = True, executor=None) -> np.ndarray:
+        """Run the whole job
+
+        Parameters
+        ----------
+        client: qcfractal.interface.FractalClient
+            Client to run QM computations with
+        update_molecules: bool
+            Whether to update the charges on the molecules
+        executor: concurrent.futures.Executor
+            Executor to compute ESPs with; see :meth:`compute_esps`
+        """
         # die early on failure to import
         # we can't decorate the function because pickle is sad
         require_package("psi4")
@@ -217,26 +639,39 @@ class Job(base.Model):
         self.generate_conformers()
         self.optimize_geometries(client=client)
         self.generate_orientations()
-        return self.compute_esps_and_charges(client=client, update_molecules=update_molecules)
+        return self.compute_esps_and_charges(client=client, update_molecules=update_molecules,
+                                             executor=executor)
 
-    def compute_esps_and_charges(self, client=None, update_molecules: bool = True) -> np.ndarray:
+    def compute_esps_and_charges(self, client=None, update_molecules: bool = True,
+                                 executor=None) -> np.ndarray:
         require_package("psi4")
 
         self.compute_orientation_energies(client=client)
-        self.compute_esps()
+        self.compute_esps(executor=executor)
         self.compute_charges(update_molecules=update_molecules)
         return self.charges
 
-    def construct_surface_constraint_matrix(self) -> ESPSurfaceConstraintMatrix:
+    def construct_surface_constraint_matrix(self, dtype: Optional[str] = None) -> ESPSurfaceConstraintMatrix:
         """
         Construct the constraint matrix for each atom,
         as generated by the ESP at each grid point
+
+        Parameters
+        ----------
+        dtype: str
+            Precision to construct orientation matrices with.
+            The default is :attr:`constraint_matrix_dtype`.
+            Orientation matrices cached with another precision
+            are reconstructed if their grid and ESP are available.
         """
+        if dtype is None:
+            dtype = self.constraint_matrix_dtype
         if not self.charge_constraints.split_conformers:
             matrices = [
                 ESPSurfaceConstraintMatrix.from_orientations(
                     orientations=[o for conf in mol.conformers for o in conf.orientations],
                     temperature=self.temperature,
+                    dtype=dtype,
                 )
                 for mol in self.molecules
             ]
@@ -246,6 +681,7 @@ class Job(base.Model):
                 ESPSurfaceConstraintMatrix.from_orientations(
                     orientations=[o for o in conf.orientations],
                     temperature=self.temperature,
+                    dtype=dtype,
                 )
                 for mol in self.molecules
                 for conf in mol.conformers
@@ -282,6 +718,17 @@ class Job(base.Model):
         the ESP computed, and there must be at least one orientation present.
         """
         surface_constraints = self.construct_surface_constraint_matrix()
+        stage_1_charges, stage_2_charges = self._fit_charges(surface_constraints)
+        self.stage_1_charges = stage_1_charges
+        if stage_2_charges is not None:
+            self.stage_2_charges = stage_2_charges
+
+        if update_molecules:
+            self.update_molecule_charges()
+        return self.charges
+
+    def _fit_charges(self, surface_constraints):
+        """Fit stage 1 and, if enabled, stage 2 charges to the surface constraints"""
         stage_1_constraints = self.generate_molecule_charge_constraints()
 
         if self.resp_options.stage_2:
@@ -291,24 +738,53 @@ class Job(base.Model):
         else:
             stage_1_constraints.constrain_methyl_hydrogens_between_conformers = True
 
-        self.stage_1_charges = RespCharges(charge_constraints=stage_1_constraints,
-                                           surface_constraints=surface_constraints,
-                                           restraint_height=self.resp_options.restraint_height_stage_1,
-                                           **self.resp_options._base_kwargs)
-        self.stage_1_charges.solve()
+        stage_1_charges = RespCharges(charge_constraints=stage_1_constraints,
+                                      surface_constraints=surface_constraints,
+                                      restraint_height=self.resp_options.restraint_height_stage_1,
+                                      **self.resp_options._base_kwargs)
+        stage_1_charges.solve()
 
+        stage_2_charges = None
         if self.resp_options.stage_2:
             stage_2_constraints.prepare_stage_2_constraints()
-            stage_2_constraints.add_constraints_from_charges(self.stage_1_charges._charges)
-            self.stage_2_charges = RespCharges(charge_constraints=stage_2_constraints,
-                                               surface_constraints=surface_constraints,
-                                               restraint_height=self.resp_options.restraint_height_stage_2,
-                                               **self.resp_options._base_kwargs)
-            self.stage_2_charges.solve()
-
-        if update_molecules:
-            self.update_molecule_charges()
-        return self.charges
+            stage_2_constraints.add_constraints_from_charges(stage_1_charges._charges)
+            stage_2_charges = RespCharges(charge_constraints=stage_2_constraints,
+                                          surface_constraints=surface_constraints,
+                                          restraint_height=self.resp_options.restraint_height_stage_2,
+                                          **self.resp_options._base_kwargs)
+            stage_2_charges.solve()
+        return stage_1_charges, stage_2_charges
+
+    def compute_charge_deviation_from_float64(self) -> float:
+        """
+        Refit the charges with surface constraint matrices constructed
+        in float64, and return the maximum absolute difference from the
+        charges computed with :attr:`constraint_matrix_dtype`.
+
+        The surface constraint matrix of every orientation is rebuilt
+        from its grid and ESP, so the job must have been run with
+        :attr:`keep_grids_and_esps`. The rebuilt float64 matrices
+        replace those cached on the orientations, but the charges
+        stored on the job and molecules are not changed.
+        """
+        if self.charges is None:
+            raise ValueError("Charges must be computed first")
+        if not self.keep_grids_and_esps:
+            raise ValueError("Comparing with float64 charges rebuilds the surface "
+                             "constraint matrices from the grids and ESPs, "
+                             "which requires keep_grids_and_esps=True")
+        if not all(o.grid is not None and o.esp is not None
+                   for o in self.iter_orientations()):
+            raise ValueError("Orientations must keep their grids and ESPs "
+                             "to reconstruct the float64 matrices")
+
+        surface_constraints = self.construct_surface_constraint_matrix(dtype="float64")
+        stage_1_charges, stage_2_charges = self._fit_charges(surface_constraints)
+        reference = stage_1_charges if stage_2_charges is None else stage_2_charges
+        return max(
+            np.max(np.abs(np.asarray(charges) - np.asarray(reference_charges)), initial=0)
+            for charges, reference_charges in zip(self.charges, reference.charges)
+        )
 
     def update_molecule_charges(self):
         """
@@ -232,6 +232,39 @@ class Molecule(BaseMolecule):
 
         return np.array(orientations)
 
+    def generate_orientation_transformations(
+        self,
+        coordinates: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Generate the affine matrices that map ``coordinates``
+        onto each orientation from
+        :meth:`~psiresp.molecule.Molecule.generate_orientation_coordinates`
+
+        Returns
+        -------
+        numpy.ndarray
+            This has shape (N, 4, 4), where N is the number of orientations
+        """
+        if coordinates is None:
+            coordinates = self.coordinates
+
+        matrices = []
+        if self.keep_original_orientation:
+            matrices.append(np.identity(4))
+
+        for indices in self.reorientations:
+            matrices.append(orutils.get_affine_matrix(orutils.rigid_orient,
+                                                      *indices, coordinates))
+
+        for indices in self.rotations:
+            matrices.append(orutils.get_affine_matrix(orutils.rigid_rotate,
+                                                      *indices, coordinates))
+
+        for shift in self.translations:
+            matrices.append(orutils.get_translation_matrix(shift))
+
+        return np.array(matrices).reshape((-1, 4, 4))
+
     def generate_conformers(self):
         """Generate conformers"""
         if not self.conformers:
@@ -268,10 +301,12 @@ class Molecule(BaseMolecule):
             if clear_existing_orientations:
                 conf.orientations = []
             coords = self.generate_orientation_coordinates(conf.coordinates)
-            for coord in coords:
-                conf.add_orientation_with_coordinates(coord)
+            matrices = self.generate_orientation_transformations(conf.coordinates)
+            for coord, matrix in zip(coords, matrices):
+                conf.add_orientation_with_coordinates(coord, transformation=matrix)
             if not len(conf.orientations):
-                conf.add_orientation_with_coordinates(conf.coordinates)
+                conf.add_orientation_with_coordinates(conf.coordinates,
+                                                      transformation=np.identity(4))
 
     def get_atoms_from_smarts(self, smiles):
         indices = self.get_smarts_matches(smiles)
@@ -1,4 +1,7 @@
-from typing import Optional
+from typing import Optional, Union
+import pathlib
+
+from typing_extensions import Literal
 
 import numpy as np
 from pydantic import Field, validator
@@ -23,19 +26,39 @@ class Orientation(BaseMolecule):
         default=1,
         description="How much to weight this orientation in the ESP surface constraints"
     )
+    transformation: Optional[np.ndarray] = Field(
+        default=None,
+        description=("Affine matrix with shape (4, 4) of the rigid-body "
+                     "transformation from the parent conformer "
+                     "coordinates to this orientation, if known")
+    )
     qc_wavefunction: Optional[QCWaveFunction] = None
     grid: Optional[np.ndarray] = None
     esp: Optional[np.ndarray] = None
 
     _constraint_matrix: Optional[ESPSurfaceConstraintMatrix] = None
+    _constraint_matrix_dtype: Optional[str] = None
     _qc_id: Optional[int] = None
 
-    @validator("grid", "esp", pre=True)
+    @validator("transformation", "grid", "esp", pre=True)
     def _convert_array(cls, v):
         if v is not None:
             v = np.asarray(v)
         return v
 
+    def __setattr__(self, attr, value):
+        if attr in ("grid", "esp"):
+            self._constraint_matrix = None
+        super().__setattr__(attr, value)
+
+    def discard_grid_and_esp(self):
+        """Free the grid and ESP, keeping the
+        surface constraint matrix computed from them"""
+        matrix = self.constraint_matrix
+        self.grid = None
+        self.esp = None
+        self._constraint_matrix = matrix
+
     @property
     def energy(self):
         try:
@@ -43,10 +66,38 @@ class Orientation(BaseMolecule):
         except AttributeError:
             return None
 
-    def compute_grid(self, grid_options: GridOptions = GridOptions()):
-        self.grid = grid_options.generate_grid(self.qcmol)
-
-    def compute_esp(self):
+    def compute_grid(self, grid_options: GridOptions = GridOptions(),
+                     working_directory: Optional[Union[str, pathlib.Path]] = None):
+        """Compute the grid for this orientation.
+
+        If ``working_directory`` is given, a grid previously saved
+        there for the same geometry and grid options is loaded instead,
+        and new grids are saved to it.
+        """
+        if working_directory is None:
+            self.grid = grid_options.generate_grid(self.qcmol)
+        else:
+            self.grid = grid_options.load_or_generate_grid(self.qcmol,
+                                                           working_directory=working_directory)
+
+    def compute_esp(self, engine: Literal["psi4", "numpy"] = "psi4",
+                    tolerance: float = 0):
+        """Compute the ESP on the grid.
+
+        Parameters
+        ----------
+        engine: str
+            Whether to compute the ESP with psi4, or with
+            the pure NumPy implementation in :mod:`psiresp.esp`
+        tolerance: float
+            Screening tolerance for the NumPy engine.
+            See :func:`psiresp.esp.compute_electronic_esp`
+        """
+        if engine == "numpy":
+            from . import esp
+            self.esp = esp.compute_esp(self.qc_wavefunction, self.grid,
+                                       tolerance=tolerance)
+            return self.esp
         require_package("psi4")
         from . import psi4utils
         self.esp = psi4utils.compute_esp(self.qc_wavefunction, self.grid)
@@ -72,23 +123,30 @@ class Orientation(BaseMolecule):
         kb_jk = qcel.constants.Boltzmann_constant
         return joules / (kb_jk * temperature)
 
-    def get_weighted_matrix(self, temperature: float = 298.15):
-        weight = self.get_weight(temperature=temperature)
-        return self.constraint_matrix * (weight ** 2)
-
-    def construct_constraint_matrix(self):
-        displacement = self.coordinates - self.grid.reshape((-1, 1, 3))
-
-        # r_inv should be in bohr units, even though
-        # coordinates and displacement are in angstrom?
-        BOHR_TO_ANGSTROM = qcel.constants.conversion_factor("bohr", "angstrom")
-        r_inv = BOHR_TO_ANGSTROM / np.sqrt(
-            np.einsum("ijk, ijk->ij", displacement, displacement)
-        )
-
-        a = np.einsum("ij, ik->jk", r_inv, r_inv)
-        b = np.einsum("i, ij->j", self.esp, r_inv)
+    def get_constraint_matrix(self, dtype: str = "float64"):
+        """Get the surface constraint matrix, constructing it with the
+        given precision if it has not been, or if it was constructed with
+        a different one. A matrix with a different precision is returned
+        as-is if the grid and ESP have been discarded."""
+        if self._constraint_matrix is None:
+            return self.construct_constraint_matrix(dtype=dtype)
+        if (np.dtype(dtype).name != self._constraint_matrix_dtype
+                and self.grid is not None and self.esp is not None):
+            return self.construct_constraint_matrix(dtype=dtype)
+        return self._constraint_matrix
 
-        matrix = ESPSurfaceConstraintMatrix.from_coefficient_matrix(a, b)
+    def get_weighted_matrix(self, temperature: float = 298.15,
+                            dtype: Optional[str] = None):
+        weight = self.get_weight(temperature=temperature)
+        if dtype is None:
+            matrix = self.constraint_matrix
+        else:
+            matrix = self.get_constraint_matrix(dtype=dtype)
+        return matrix * (weight ** 2)
+
+    def construct_constraint_matrix(self, dtype: str = "float64"):
+        matrix = ESPSurfaceConstraintMatrix.from_grid(self.coordinates, self.grid, self.esp,
+                                                      dtype=dtype)
         self._constraint_matrix = matrix
+        self._constraint_matrix_dtype = np.dtype(dtype).name
         return matrix
@@ -213,3 +213,80 @@ def rigid_rotate(i: int,
         New rotated coordinates
     """
     return coordinates[i] + rigid_orient(i, j, k, coordinates)
+
+
+def get_affine_matrix(transform, i: int, j: int, k: int,
+                      coordinates: np.ndarray,
+                      ) -> np.ndarray:
+    """
+    Get the affine matrix of a rigid-body transformation
+    such as :func:`rigid_orient` or :func:`rigid_rotate`.
+
+    The origin and unit vectors are appended to ``coordinates``
+    and transformed alongside them, so the atom coordinates are
+    transformed exactly as they would be without the extra rows.
+
+    Parameters
+    ----------
+    transform: callable
+        Function with the signature ``transform(i, j, k, coordinates)``
+    i: int
+        index
+    j: int
+        index
+    k: int
+        index
+    coordinates: numpy.ndarray of shape (N, 3)
+        coordinates
+
+    Returns
+    -------
+    matrix: numpy.ndarray of shape (4, 4)
+        Affine matrix such that
+        ``apply_affine_matrix(matrix, coordinates) == transform(i, j, k, coordinates)``
+    """
+    n_atoms = len(coordinates)
+    augmented = np.concatenate([coordinates, np.zeros((1, 3)), np.identity(3)])
+    transformed = transform(i, j, k, augmented)[n_atoms:]
+    origin = transformed[0]
+    matrix = np.identity(4)
+    matrix[:3, :3] = (transformed[1:] - origin).T
+    matrix[:3, 3] = origin
+    return matrix
+
+
+def get_translation_matrix(shift: np.ndarray) -> np.ndarray:
+    """
+    Get the affine matrix of a translation
+
+    Parameters
+    ----------
+    shift: numpy.ndarray of shape (3,)
+        translation vector
+
+    Returns
+    -------
+    matrix: numpy.ndarray of shape (4, 4)
+    """
+    matrix = np.identity(4)
+    matrix[:3, 3] = shift
+    return matrix
+
+
+def apply_affine_matrix(matrix: np.ndarray, coordinates: np.ndarray) -> np.ndarray:
+    """
+    Apply an affine transformation to coordinates
+
+    Parameters
+    ----------
+    matrix: numpy.ndarray of shape (4, 4)
+        affine matrix
+    coordinates: numpy.ndarray of shape (N, 3)
+        coordinates
+
+    Returns
+    -------
+    coordinates: numpy.ndarray of shape (N, 3)
+        New transformed coordinates
+    """
+    return coordinates @ matrix[:3, :3].T + matrix[:3, 3]
@@ -1,4 +1,6 @@
 from typing import List, Dict
+import threading
+import time
 
 try:
     import psi4
@@ -11,21 +13,26 @@ import numpy as np
 
 psi4.core.be_quiet()
 
+# psi4.geometry() sets the global active molecule, and
+# Wavefunction.build() reads global options, so wavefunctions
+# built in different threads must not be built at the same time
+_WAVEFUNCTION_LOCK = threading.Lock()
+
 
 def psi4mol_from_qcmol(qcmol):
     return psi4.geometry(qcmol.to_string("psi4", "angstrom"))
 
 
 def construct_psi4_wavefunction(qc_wavefunction):
-    psi4mol = psi4mol_from_qcmol(qc_wavefunction.qcmol)
-    psi4mol.reset_point_group("c1")
-
     qcdensity = qc_wavefunction.reconstruct_density()
-    density = psi4.core.Matrix.from_array(qcdensity)
-    psi4wfn = psi4.core.RHF(
-        psi4.core.Wavefunction.build(psi4mol, qc_wavefunction.basis),
-        psi4.core.SuperFunctional(),
-    )
+    density = psi4.core.Matrix.from_array(np.asarray(qcdensity, dtype=float))
+    with _WAVEFUNCTION_LOCK:
+        psi4mol = psi4mol_from_qcmol(qc_wavefunction.qcmol)
+        psi4mol.reset_point_group("c1")
+        psi4wfn = psi4.core.RHF(
+            psi4.core.Wavefunction.build(psi4mol, qc_wavefunction.basis),
+            psi4.core.SuperFunctional(),
+        )
     psi4wfn.Da().copy(density)
     return psi4wfn
 
@@ -38,6 +45,41 @@ def compute_esp(qc_wavefunction, grid):
     return np.array(psi4esp)
 
 
+def compute_esps(qc_wavefunctions, grids):
+    """Compute the ESPs of many (wavefunction, grid) pairs.
+
+    psi4 basis sets are built for a specific geometry, so
+    the psi4 wavefunction and ESP calculator are only reused
+    for grids paired with the same wavefunction object.
+    Timings are reported per batch of pairs sharing a basis set.
+
+    Returns
+    -------
+    esps: List[numpy.ndarray]
+    timings: List[Dict[str, Any]]
+    """
+    from .esp import group_by_basis, get_batch_timing
+
+    if len(qc_wavefunctions) != len(grids):
+        raise ValueError("The number of wavefunctions and grids must be the same")
+
+    esps = [None] * len(grids)
+    timings = []
+    for signature, wavefunction_indices in group_by_basis(qc_wavefunctions).items():
+        start = time.perf_counter()
+        n_points = 0
+        for i, indices in wavefunction_indices.items():
+            psi4wfn = construct_psi4_wavefunction(qc_wavefunctions[i])
+            esp_calc = psi4.core.ESPPropCalc(psi4wfn)
+            for j in indices:
+                psi4grid = psi4.core.Matrix.from_array(np.asarray(grids[j]))
+                esps[j] = np.array(esp_calc.compute_esp_over_grid_in_memory(psi4grid))
+                n_points += len(esps[j])
+        timings.append(get_batch_timing(signature, wavefunction_indices,
+                                        n_points=n_points, start=start))
+    return esps, timings
+
+
 def get_connectivity(molecule) -> List[List[int]]:
     if hasattr(molecule, "qcmol"):
         molecule = molecule.qcmol
@@ -1,8 +1,15 @@
+import functools
+import pathlib
+from typing import Optional, Tuple, Union
+
 import numpy as np
 import qcelemental as qcel
 
 from .moleculebase import BaseMolecule
 
+# fields that the cached density depends on
+_DENSITY_FIELDS = {"qc_wavefunction", "n_alpha"}
+
 
 class QCWaveFunction(BaseMolecule):
     qc_wavefunction: qcel.models.results.WavefunctionProperties
@@ -10,6 +17,8 @@ class QCWaveFunction(BaseMolecule):
     energy: float
     basis: str
 
+    _density: Optional[np.ndarray] = None
+
     @classmethod
     def from_atomicresult(cls, result):
         return cls(qc_wavefunction=result.wavefunction,
@@ -30,51 +39,122 @@ class QCWaveFunction(BaseMolecule):
                    basis=qcrecord.basis,
                    energy=qcrecord.properties.return_energy)
 
-    def get_density_ordering(self):
-        # Re-order the density matrix to match the ordering expected by psi4.
-        angular_momenta = {
-            angular_momentum
+    def __setattr__(self, attr, value):
+        if attr in _DENSITY_FIELDS:
+            self._density = None
+        super().__setattr__(attr, value)
+
+    def copy(self, *, update=None, **kwargs):
+        new = super().copy(update=update, **kwargs)
+        if update and _DENSITY_FIELDS.intersection(update):
+            new._density = None
+        return new
+
+    def get_basis_layout(self) -> Tuple[Tuple[bool, int], ...]:
+        """Get whether each shell is pure, and its angular momentum,
+        in the order of the atomic orbitals"""
+        return tuple(
+            (shell.harmonic_type != "cartesian", angular_momentum)
             for atom in self.qc_wavefunction.basis.atom_map
             for shell in self.qc_wavefunction.basis.center_data[atom].electron_shells
             for angular_momentum in shell.angular_momentum
-        }
-
-        spherical_maps = {
-            L: np.array(
-                list(range(L * 2 - 1, 0, -2)) + [0] + list(range(2, L * 2 + 1, 2))
-            )
-            for L in angular_momenta
-        }
-
-        # Build a flat index that we can transform the AO quantities
-        ao_map = []
-        counter = 0
-
-        for atom in self.qc_wavefunction.basis.atom_map:
-
-            center = self.qc_wavefunction.basis.center_data[atom]
-            for shell in center.electron_shells:
-
-                if shell.harmonic_type == "cartesian":
-                    ao_map.append(np.arange(counter, counter + shell.nfunctions()))
-
-                else:
-                    smap = spherical_maps[shell.angular_momentum[0]]
-                    ao_map.append(smap + counter)
+        )
 
-                counter += shell.nfunctions()
+    def get_density_ordering(self):
+        # Re-order the density matrix to match the ordering expected by psi4.
+        return get_density_ordering(self.get_basis_layout())
 
-        ao_map = np.hstack(ao_map)
+    @property
+    def density_is_cached(self) -> bool:
+        """Whether the density from :meth:`reconstruct_density` is cached"""
+        return self._density is not None
 
-        reverse_ao_map = {map_index: i for i, map_index in enumerate(ao_map)}
-        reverse_ao_map = np.array([reverse_ao_map[i] for i in range(len(ao_map))])
-        return reverse_ao_map
+    def clear_density_cache(self):
+        """Free the cached density"""
+        self._density = None
 
     def reconstruct_density(self):
+        """Get the alpha density matrix in psi4 ordering.
+
+        This is computed once and cached; see :meth:`cache_density`.
+        """
+        if self._density is None:
+            self.cache_density()
+        return self._density
+
+    def cache_density(self, dtype: np.dtype = np.float64,
+                      filename: Optional[Union[str, pathlib.Path]] = None) -> np.ndarray:
+        """Compute the alpha density matrix in psi4 ordering
+        and cache it on this wavefunction.
+
+        Parameters
+        ----------
+        dtype: numpy.dtype
+            Data type of the cached density. ``numpy.float32``
+            halves the memory used by large basis sets.
+        filename: Union[str, pathlib.Path]
+            If given, the density is stored in a memory-mapped
+            .npy file at this path instead of in memory.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
         reverse_ao_map = self.get_density_ordering()
         orbitals = getattr(self.qc_wavefunction, self.qc_wavefunction.orbitals_a)[:, :self.n_alpha]
-        density = np.dot(orbitals, orbitals.T)
-        return density[reverse_ao_map[:, None], reverse_ao_map]
+        orbitals = orbitals[reverse_ao_map]
+        density = np.dot(orbitals, orbitals.T).astype(dtype, copy=False)
+        if filename is not None:
+            cached = np.lib.format.open_memmap(filename, mode="w+",
+                                               dtype=density.dtype,
+                                               shape=density.shape)
+            cached[:] = density
+            cached.flush()
+            density = cached
+        density.flags.writeable = False
+        self._density = density
+        return density
+
+
+@functools.lru_cache(maxsize=128)
+def get_density_ordering(basis_layout: Tuple[Tuple[bool, int], ...]) -> np.ndarray:
+    """Get the indices that re-order atomic orbitals from the
+    QCSchema ordering to the ordering expected by psi4.
+
+    This is shared between every wavefunction with the same basis layout.
+
+    Parameters
+    ----------
+    basis_layout: Tuple[Tuple[bool, int], ...]
+        Whether each shell is pure, and its angular momentum,
+        as returned by :meth:`QCWaveFunction.get_basis_layout`
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    # Build a flat index that we can transform the AO quantities
+    ao_map = []
+    counter = 0
+    for pure, L in basis_layout:
+        if pure:
+            ao_map.append(_get_spherical_map(L) + counter)
+            counter += 2 * L + 1
+        else:
+            n_functions = (L + 1) * (L + 2) // 2
+            ao_map.append(np.arange(counter, counter + n_functions))
+            counter += n_functions
+
+    if not ao_map:
+        return np.zeros(0, dtype=int)
+    # the inverse permutation
+    reverse_ao_map = np.argsort(np.concatenate(ao_map))
+    reverse_ao_map.flags.writeable = False
+    return reverse_ao_map
+
+
+def _get_spherical_map(L):
+    return np.array(list(range(L * 2 - 1, 0, -2)) + [0] + list(range(2, L * 2 + 1, 2)))
 
 
 def get_vdwradii(element):
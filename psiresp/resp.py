@@ -3,6 +3,7 @@ import warnings
 
 import numpy as np
 from pydantic import Field
+from typing_extensions import Literal
 
 from . import base, charge
 from .constraint import (ESPSurfaceConstraintMatrix,
@@ -27,6 +28,29 @@ class BaseRespOptions(base.Model):
         default=500,
         description="max number of iterations to solve constraint matrices",
     )
+    reuse_factorization: bool = Field(
+        default=False,
+        description=("Whether to reuse the column ordering of the sparse LU "
+                     "factorization, and update the restrained diagonal in place, "
+                     "between restraint iterations instead of "
+                     "refactorizing from scratch"),
+    )
+    constraint_formulation: Literal["kkt", "reduced"] = Field(
+        default="kkt",
+        description=("How charge constraints are applied. 'kkt' solves the "
+                     "sparse system of the ESP matrix bordered by constraints. "
+                     "'reduced' eliminates the constraints once, and solves "
+                     "a dense system with one unknown per degree of freedom "
+                     "left by the constraints"),
+    )
+    restraint_solver: Literal["fixed_point", "newton"] = Field(
+        default="fixed_point",
+        description=("How the hyperbolic restraint is solved. 'fixed_point' "
+                     "re-solves with the restraint linearized at the previous "
+                     "charges, converging linearly. 'newton' takes Newton steps "
+                     "on the restrained objective with a backtracking line "
+                     "search, usually converging in a few iterations"),
+    )
 
 
 class RespOptions(BaseRespOptions):
@@ -56,6 +80,8 @@ class RespCharges(BaseRespOptions):
     _restrained_charges: Optional[np.ndarray] = None
     _unrestrained_charges: Optional[np.ndarray] = None
     _matrix: Optional[SparseGlobalConstraintMatrix] = None
+    _n_iterations: Optional[int] = None
+    _residual: Optional[float] = None
 
     charge_constraints: charge.MoleculeChargeConstraints
     surface_constraints: ESPSurfaceConstraintMatrix
@@ -82,18 +108,33 @@ class RespCharges(BaseRespOptions):
         )
 
     def solve(self):
-        self._matrix._solve()
+        reduced = self.constraint_formulation == "reduced"
+        self._matrix._solve(reduced=reduced)
         self._unrestrained_charges = self._matrix._charges.flatten()
         if not self.restrained_fit or not self.restraint_height:
             return
 
         n_iter = 0
         b2 = self.restraint_slope ** 2
-        while (self._matrix.charge_difference > self.convergence_tolerance
-               and n_iter < self.max_iter):
-            self._matrix._iter_solve(self.restraint_height, self.restraint_slope, b2)
+        solver_kwargs = dict(reuse_factorization=self.reuse_factorization,
+                             reduced=reduced)
+        if self.restraint_solver == "newton":
+            while (self._matrix.charge_difference > self.convergence_tolerance
+                   and n_iter < self.max_iter):
+                self._matrix._newton_iter_solve(self.restraint_height, self.restraint_slope, b2,
+                                                **solver_kwargs)
+                n_iter += 1
+        else:
+            while (self._matrix.charge_difference > self.convergence_tolerance
+                   and n_iter < self.max_iter):
+                self._matrix._iter_solve(self.restraint_height, self.restraint_slope, b2,
+                                         **solver_kwargs)
+                n_iter += 1
+            self._matrix._iter_solve(self.restraint_height, self.restraint_slope, b2,
+                                     **solver_kwargs)
             n_iter += 1
-        self._matrix._iter_solve(self.restraint_height, self.restraint_slope, b2)
+        self._n_iterations = n_iter
+        self._residual = self._matrix._get_restraint_residual(self.restraint_height, b2)
 
         if self._matrix.charge_difference > self.convergence_tolerance:
             warnings.warn("Charge fitting did not converge to "
@@ -101,6 +142,17 @@ class RespCharges(BaseRespOptions):
                           f"with max_iter={self.max_iter}")
         self._restrained_charges = self._matrix._charges.flatten()
 
+    @property
+    def n_iterations(self):
+        """Number of restrained solves in the last fit"""
+        return self._n_iterations
+
+    @property
+    def residual(self):
+        """Largest gradient of the Lagrangian of the
+        restrained fit with respect to the charges"""
+        return self._residual
+
     @property
     def restrained_charges(self):
         if self._restrained_charges is None:
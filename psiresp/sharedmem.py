@@ -0,0 +1,164 @@
+"""
+NumPy arrays in shared memory, passed between processes by handle.
+"""
+
+import multiprocessing
+import os
+import sys
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+
+#: Environment variable holding the ID of the process that started
+#: its resource tracker. Processes forked or spawned afterwards inherit
+#: both the variable and the tracker.
+TRACKER_PID_VARIABLE = "PSIRESP_RESOURCE_TRACKER_PID"
+
+#: ID of the process this module was imported in
+_IMPORT_PID = os.getpid()
+
+
+def ensure_resource_tracker():
+    """Start the resource tracker of this process, if the platform
+    uses one. Processes forked afterwards share it, instead of each
+    starting their own that unlinks the blocks they attached to
+    when they exit."""
+    if os.name == "posix":
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+        # the variable may have been inherited from another process
+        pid = str(os.getpid())
+        if os.environ.get(TRACKER_PID_VARIABLE) != pid:
+            os.environ[TRACKER_PID_VARIABLE] = pid
+
+
+def _shares_resource_tracker() -> bool:
+    """Whether this process shares the resource tracker of the
+    process that creates shared memory blocks.
+
+    Spawned processes, and processes started by a fork server, are
+    always passed the tracker of the process that started them, and
+    import this module themselves. Forked processes inherit this
+    module, and only share the tracker if their parent started it
+    before they were forked, such as workers of pools created by
+    psiresp. Workers of an executor that was started earlier would
+    start their own."""
+    if os.getpid() == _IMPORT_PID:
+        return True
+    parent = multiprocessing.parent_process()
+    return (parent is not None
+            and os.environ.get(TRACKER_PID_VARIABLE) == str(parent.pid))
+
+
+def _get_tracked_name(shm: shared_memory.SharedMemory) -> str:
+    """Name a shared memory block is registered under in the resource tracker"""
+    if os.name == "posix" and not shm.name.startswith("/"):
+        return "/" + shm.name
+    return shm.name
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing shared memory block.
+
+    Attaching registers the block with the resource tracker of this
+    process. Processes that share the tracker of the process that
+    created the block register it again harmlessly. Other processes
+    would start their own tracker, which unlinks the block and warns
+    about a leak when the process exits. Those processes attach
+    without registering the block."""
+    if os.name != "posix" or _shares_resource_tracker():
+        return shared_memory.SharedMemory(name=name)
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    from multiprocessing import resource_tracker
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(_get_tracked_name(shm), "shared_memory")
+    return shm
+
+
+class SharedArray:
+    """Handle to a NumPy array in :mod:`multiprocessing.shared_memory`.
+
+    Pickling a handle only sends the name, shape and dtype of the
+    block, so the cost of passing it to another process does not
+    depend on the size of the array. The process that created the
+    array is responsible for calling :meth:`unlink` when done.
+
+    Parameters
+    ----------
+    name: str
+        Name of the shared memory block
+    shape: Tuple[int, ...]
+        Shape of the array
+    dtype: numpy.dtype
+        Data type of the array
+    """
+
+    __slots__ = ("name", "shape", "dtype", "_shm")
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype=np.float64):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._shm = None
+
+    def __repr__(self):
+        return f"SharedArray(name={self.name!r}, shape={self.shape}, dtype={self.dtype})"
+
+    def __getstate__(self):
+        return self.name, self.shape, self.dtype.str
+
+    def __setstate__(self, state):
+        name, shape, dtype = state
+        self.__init__(name, shape, dtype)
+
+    @classmethod
+    def empty(cls, shape: Tuple[int, ...], dtype=np.float64) -> "SharedArray":
+        """Create an uninitialized array in a new shared memory block"""
+        dtype = np.dtype(dtype)
+        # creating the block registers it, which starts the tracker
+        ensure_resource_tracker()
+        n_bytes = int(np.prod(shape)) * dtype.itemsize
+        # blocks cannot be empty
+        shm = shared_memory.SharedMemory(create=True, size=max(n_bytes, 1))
+        array = cls(shm.name, shape, dtype)
+        array._shm = shm
+        return array
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> "SharedArray":
+        """Copy an array into a new shared memory block"""
+        array = np.asarray(array)
+        shared = cls.empty(array.shape, dtype=array.dtype)
+        shared.to_numpy()[:] = array
+        return shared
+
+    def _attach(self):
+        if self._shm is None:
+            self._shm = _attach_shared_memory(self.name)
+        return self._shm
+
+    def to_numpy(self) -> np.ndarray:
+        """Get a NumPy view of the shared array"""
+        shm = self._attach()
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    def close(self):
+        """Close this process's access to the shared memory block"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        """Close and free the shared memory block"""
+        shm = self._attach()
+        self._shm = None
+        try:
+            shm.close()
+        except BufferError:
+            # views of the array are still alive, and the memory
+            # is released once they are garbage collected
+            pass
+        shm.unlink()
@@ -0,0 +1,270 @@
+"""
+Compact records for computing ESPs in worker processes.
+
+Mapping over :class:`~psiresp.orientation.Orientation` models pickles
+each full model, including its RDKit molecule and complete set of
+orbitals. An :class:`ESPTask` only carries what the worker needs,
+and the orientation itself is only updated in the parent process.
+"""
+
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+import qcelemental as qcel
+
+from .constraint import ESPSurfaceConstraintMatrix
+from .grid import GridOptions
+from .qcutils import QCWaveFunction
+from .sharedmem import SharedArray
+from .utils import require_package
+
+ArrayOrHandle = Union[np.ndarray, SharedArray]
+
+
+def _as_array(array: Optional[ArrayOrHandle]) -> Optional[np.ndarray]:
+    if isinstance(array, SharedArray):
+        return array.to_numpy()
+    return array
+
+
+class ESPTask:
+    """Everything needed to compute the grid, ESP and surface
+    constraint matrix of one orientation.
+
+    Parameters
+    ----------
+    index: int
+        Index of the orientation, used to match results
+    qcmol: qcelemental.models.Molecule
+        Molecule in the orientation geometry
+    basis: str
+        Name of the basis set
+    basis_set: qcelemental.models.BasisSet
+        QCSchema basis set of the wavefunction
+    orbitals: numpy.ndarray
+        Occupied alpha orbitals, in QCSchema order.
+        Not needed if ``density`` or ``wavefunction`` is given.
+    density: Union[numpy.ndarray, SharedArray]
+        Alpha density matrix, in psi4 order
+    wavefunction: QCWaveFunction
+        Wavefunction to use directly, for tasks run in the
+        same process. Its density is computed once and
+        cached on it, and nothing is copied.
+    grid: Union[numpy.ndarray, SharedArray]
+        Grid points in angstrom. If not given,
+        the grid is generated with ``grid_options``
+    esp: SharedArray
+        If given, the ESP is written here
+        instead of being returned
+    grid_options: GridOptions
+        Options for generating the grid
+    working_directory: Union[str, pathlib.Path]
+        If given, grids are cached in this directory
+    engine: str
+        Program used to compute the ESP
+    tolerance: float
+        Screening tolerance for the NumPy engine
+    matrix_dtype: str
+        Precision used to construct the surface constraint matrix
+    n_psi4_threads: int
+        Number of threads for psi4 to use
+    keep_grid_and_esp: bool
+        Whether to return the grid and ESP along with the matrix
+    defer_errors: bool
+        Whether to return errors as results instead of raising them
+    submitted: float
+        Time the task was submitted to a worker, from :func:`time.time`
+    """
+
+    __slots__ = ("index", "qcmol", "basis", "basis_set", "orbitals", "density",
+                 "wavefunction", "grid", "esp", "grid_options", "working_directory", "engine",
+                 "tolerance", "matrix_dtype", "n_psi4_threads", "keep_grid_and_esp", "defer_errors",
+                 "submitted")
+
+    def __init__(self, index: int,
+                 qcmol: qcel.models.Molecule,
+                 basis: str,
+                 basis_set: qcel.models.BasisSet,
+                 orbitals: Optional[np.ndarray] = None,
+                 density: Optional[ArrayOrHandle] = None,
+                 wavefunction: Optional[QCWaveFunction] = None,
+                 grid: Optional[ArrayOrHandle] = None,
+                 esp: Optional[SharedArray] = None,
+                 grid_options: GridOptions = GridOptions(),
+                 working_directory: Optional[Union[str, pathlib.Path]] = None,
+                 engine: str = "psi4",
+                 tolerance: float = 0,
+                 matrix_dtype: str = "float64",
+                 n_psi4_threads: Optional[int] = None,
+                 keep_grid_and_esp: bool = True,
+                 defer_errors: bool = False,
+                 submitted: Optional[float] = None):
+        if orbitals is None and density is None and wavefunction is None:
+            raise ValueError("One of `orbitals`, `density` or `wavefunction` must be given")
+        self.index = index
+        self.qcmol = qcmol
+        self.basis = basis
+        self.basis_set = basis_set
+        self.orbitals = orbitals
+        self.density = density
+        self.wavefunction = wavefunction
+        self.grid = grid
+        self.esp = esp
+        self.grid_options = grid_options
+        self.working_directory = working_directory
+        self.engine = engine
+        self.tolerance = tolerance
+        self.matrix_dtype = matrix_dtype
+        self.n_psi4_threads = n_psi4_threads
+        self.keep_grid_and_esp = keep_grid_and_esp
+        self.defer_errors = defer_errors
+        self.submitted = submitted
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    @classmethod
+    def from_orientation(cls, index: int, orientation, **kwargs) -> "ESPTask":
+        """Create a task from an orientation with a wavefunction.
+        The orientation's grid is used if it has one; the orbitals
+        are only included if neither ``density`` nor ``wavefunction``
+        is given."""
+        wfn = orientation.qc_wavefunction
+        properties = wfn.qc_wavefunction
+        if kwargs.get("density") is None and kwargs.get("wavefunction") is None:
+            orbitals = getattr(properties, properties.orbitals_a)[:, :wfn.n_alpha]
+            kwargs["orbitals"] = np.ascontiguousarray(orbitals)
+        kwargs.setdefault("grid", orientation.grid)
+        return cls(index=index, qcmol=orientation.qcmol, basis=wfn.basis,
+                   basis_set=properties.basis, **kwargs)
+
+    def get_wavefunction(self) -> QCWaveFunction:
+        """Assemble a wavefunction without validation,
+        so no RDKit molecule is created"""
+        if self.wavefunction is not None:
+            return self.wavefunction
+        if self.orbitals is None:
+            properties = qcel.models.results.WavefunctionProperties.construct(
+                basis=self.basis_set, restricted=True,
+            )
+            n_alpha = 0
+        else:
+            properties = qcel.models.results.WavefunctionProperties.construct(
+                basis=self.basis_set, restricted=True,
+                scf_orbitals_a=self.orbitals, orbitals_a="scf_orbitals_a",
+            )
+            n_alpha = self.orbitals.shape[1]
+        wfn = QCWaveFunction.construct(qcmol=self.qcmol, qc_wavefunction=properties,
+                                       n_alpha=n_alpha, energy=0.0, basis=self.basis)
+        if self.density is not None:
+            wfn._density = _as_array(self.density)
+        return wfn
+
+    def get_grid(self) -> np.ndarray:
+        if self.grid is not None:
+            return _as_array(self.grid)
+        if self.working_directory is None:
+            return self.grid_options.generate_grid(self.qcmol)
+        return self.grid_options.load_or_generate_grid(self.qcmol,
+                                                       working_directory=self.working_directory)
+
+    def compute_esp(self, grid: np.ndarray,
+                    wfn: Optional[QCWaveFunction] = None) -> np.ndarray:
+        if wfn is None:
+            wfn = self.get_wavefunction()
+        if self.engine == "numpy":
+            from . import esp
+            return esp.compute_esp(wfn, grid, tolerance=self.tolerance)
+
+        require_package("psi4")
+        from . import psi4utils
+        if self.n_psi4_threads is not None:
+            psi4utils.psi4.set_num_threads(self.n_psi4_threads, quiet=True)
+        return psi4utils.compute_esp(wfn, grid)
+
+    def run(self) -> "ESPTaskResult":
+        """Compute the grid, ESP and surface constraint matrix,
+        timing each step"""
+        timings = {
+            "worker": f"{os.getpid()}-{threading.current_thread().name}",
+            "started": time.time(),
+        }
+        try:
+            start = time.perf_counter()
+            grid = self.get_grid()
+            timings["grid"] = time.perf_counter() - start
+            timings["n_points"] = len(grid)
+
+            start = time.perf_counter()
+            wfn = self.get_wavefunction()
+            wfn.reconstruct_density()
+            timings["wavefunction"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            esp = self.compute_esp(grid, wfn)
+            timings["esp"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            coordinates = self.qcmol.geometry * qcel.constants.conversion_factor("bohr", "angstrom")
+            matrix = ESPSurfaceConstraintMatrix.from_grid(coordinates, grid, esp,
+                                                          dtype=self.matrix_dtype)
+            timings["constraint_matrix"] = time.perf_counter() - start
+        except BaseException as e:
+            if not self.defer_errors:
+                raise
+            return ESPTaskResult(self.index, error=str(e))
+
+        if self.esp is not None:
+            _as_array(self.esp)[:] = esp
+            esp = None
+        if self.grid is not None:
+            # the parent already has the grid
+            grid = None
+        if not self.keep_grid_and_esp:
+            grid = esp = None
+        timings["finished"] = time.time()
+        return ESPTaskResult(self.index, grid=grid, esp=esp, constraint_matrix=matrix,
+                             timings=timings)
+
+
+class ESPTaskResult:
+    """Results of an :class:`ESPTask`. ``grid`` and ``esp``
+    are None if the parent process already has them,
+    or if they should be discarded. ``timings`` holds the
+    worker name, the start and finish times from
+    :func:`time.time`, and the seconds spent on each step."""
+
+    __slots__ = ("index", "grid", "esp", "constraint_matrix", "error", "timings")
+
+    def __init__(self, index: int,
+                 grid: Optional[np.ndarray] = None,
+                 esp: Optional[np.ndarray] = None,
+                 constraint_matrix: Optional[ESPSurfaceConstraintMatrix] = None,
+                 error: Optional[str] = None,
+                 timings: Optional[Dict[str, Any]] = None):
+        self.index = index
+        self.grid = grid
+        self.esp = esp
+        self.constraint_matrix = constraint_matrix
+        self.error = error
+        self.timings = timings if timings is not None else {}
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+
+def run_esp_task(task: ESPTask) -> ESPTaskResult:
+    """Run a task; a module-level function for pickling into workers"""
+    return task.run()
@@ -12,6 +12,7 @@ pytest_plugins = [
     "psiresp.tests.fixtures.qcrecords",
     "psiresp.tests.fixtures.molecules",
     "psiresp.tests.fixtures.options",
+    "psiresp.tests.fixtures.orientations",
 ]
 
 
@@ -0,0 +1,16 @@
+import pytest
+
+import psiresp
+from psiresp.tests.datafiles import DMSO_JOB_WITH_ORIENTATION_ENERGIES
+
+
+@pytest.fixture(scope="module")
+def dmso_orientation():
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    return job.molecules[0].conformers[0].orientations[0]
+
+
+@pytest.fixture
+def dmso_wavefunction():
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    return job.molecules[0].conformers[0].orientations[0].qc_wavefunction
@@ -1,6 +1,9 @@
+import itertools
+
 import pytest
 from numpy.testing import assert_allclose, assert_equal
 import numpy as np
+import qcelemental as qcel
 import scipy.sparse
 
 import psiresp
@@ -10,7 +13,7 @@ from psiresp.charge import (ChargeSumConstraint,
                             )
 from psiresp.molecule import Atom
 from psiresp.job import Job
-from psiresp.constraint import SparseGlobalConstraintMatrix
+from psiresp.constraint import ESPSurfaceConstraintMatrix, SparseGlobalConstraintMatrix
 
 from psiresp.tests.datafiles import (
     DMSO_STAGE_2_A, DMSO_STAGE_2_B,
@@ -135,3 +138,138 @@ class TestSurfaceConstraintMatrix:
         charge_options.split_conformers = True
         surface_constraints = job.construct_surface_constraint_matrix()
         assert surface_constraints.matrix.shape == split
+
+    @pytest.mark.parametrize("max_block_memory", [1, 4096, 2 ** 25])
+    def test_from_grid_blocks(self, max_block_memory):
+        job = Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+        dmso_orientation = job.molecules[0].conformers[0].orientations[0]
+        coordinates = dmso_orientation.coordinates
+        grid = dmso_orientation.grid
+        esp = dmso_orientation.esp
+
+        displacement = coordinates - grid.reshape((-1, 1, 3))
+        r_inv = qcel.constants.conversion_factor("bohr", "angstrom") / np.linalg.norm(displacement, axis=-1)
+        reference_a = r_inv.T @ r_inv
+        reference_b = esp @ r_inv
+
+        matrix = ESPSurfaceConstraintMatrix.from_grid(coordinates, grid, esp,
+                                                      max_block_memory=max_block_memory)
+        assert_allclose(matrix.coefficient_matrix, reference_a, rtol=1e-12)
+        assert_allclose(matrix.constant_vector, reference_b, rtol=1e-12)
+
+    def test_float32_matrices(self):
+        job = Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+        job.compute_charges()
+        reference = [np.array(charges) for charges in job.charges]
+
+        job.constraint_matrix_dtype = "float32"
+        job.compute_charges()
+        orientation = job.molecules[0].conformers[0].orientations[0]
+        assert orientation._constraint_matrix_dtype == "float32"
+        for charges, reference_charges in zip(job.charges, reference):
+            assert_allclose(charges, reference_charges, atol=1e-3)
+
+        stage_charges = (job.stage_1_charges, job.stage_2_charges)
+        float32_charges = [np.array(charges) for charges in job.charges]
+        molecule = job.molecules[0]
+        molecule_charges = molecule.charges
+        deviation = job.compute_charge_deviation_from_float64()
+        assert 0 < deviation < 1e-3
+        assert deviation == max(np.abs(charges - reference_charges).max()
+                                for charges, reference_charges in zip(job.charges, reference))
+
+        # the job and molecule charges are left as they were
+        assert job.stage_1_charges is stage_charges[0]
+        assert job.stage_2_charges is stage_charges[1]
+        assert molecule.charges is molecule_charges
+        for charges, previous in zip(job.charges, float32_charges):
+            assert_equal(charges, previous)
+        assert_equal(molecule.charges, float32_charges[0])
+
+    def test_float32_deviation_requires_grids_and_esps(self):
+        job = Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+        job.compute_charges()
+        job.keep_grids_and_esps = False
+        with pytest.raises(ValueError, match="keep_grids_and_esps=True"):
+            job.compute_charge_deviation_from_float64()
+
+
+def test_reuse_factorization():
+    job = Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.compute_charges()
+    reference = [np.array(charges) for charges in job.charges]
+
+    job.resp_options.reuse_factorization = True
+    job.compute_charges()
+    assert job.stage_1_charges._matrix._column_order is not None
+    assert_allclose(job.charges, reference, atol=1e-10)
+
+
+def test_reduced_formulation():
+    job = Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.compute_charges()
+    stage_1_reference = job.stage_1_charges._charges
+    stage_2_reference = job.stage_2_charges._charges
+
+    job.resp_options.constraint_formulation = "reduced"
+    job.compute_charges()
+    assert_allclose(job.stage_1_charges._charges, stage_1_reference, atol=1e-10)
+    assert_allclose(job.stage_2_charges._charges, stage_2_reference, atol=1e-10)
+
+
+def test_reduced_formulation_constraint_types():
+    rng = np.random.default_rng(0)
+    r_inv = rng.uniform(0.1, 1, size=(50, 6))
+    a = r_inv.T @ r_inv
+    b = r_inv.T @ rng.normal(size=50)
+    constraints = np.array([
+        [1, -1, 0, 0, 0, 0],  # equivalence
+        [0, 0, 2, 0, 0, 0],  # fixed charge
+        [0, 0, 0, 1, 1, 1],  # charge sum
+    ], dtype=float)
+    d = np.array([0, 0.4, -1])
+    kkt = np.block([[a, constraints.T], [constraints, np.zeros((3, 3))]])
+    matrix = SparseGlobalConstraintMatrix(
+        coefficient_matrix=scipy.sparse.csr_matrix(kkt),
+        constant_vector=np.r_[b, d],
+        mask=np.array([True, True, True, True, False, True]),
+    )
+    matrix._solve(reduced=True)
+    assert_allclose(matrix._charges, np.linalg.solve(kkt, np.r_[b, d]), atol=1e-10)
+
+    matrix._iter_solve(0.01, 0.1, 0.01, reduced=True)
+    increment = np.zeros(9)
+    increment[[0, 1, 2, 3, 5]] = 0.01 / np.sqrt(matrix._previous_charges[[0, 1, 2, 3, 5]] ** 2 + 0.01)
+    expected = np.linalg.solve(kkt + np.diag(increment), np.r_[b, d])
+    assert_allclose(matrix._charges, expected, atol=1e-10)
+
+
+@pytest.mark.parametrize("constraint_formulation", ["kkt", "reduced"])
+def test_newton_restraint_solver(constraint_formulation):
+    job = Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.resp_options.constraint_formulation = constraint_formulation
+    job.compute_charges()
+    reference = [np.array(charges) for charges in job.charges]
+    fixed_point_iterations = job.stage_1_charges.n_iterations
+
+    job.resp_options.restraint_solver = "newton"
+    job.compute_charges()
+    assert_allclose(job.charges, reference, atol=1e-5)
+    for charges in (job.stage_1_charges, job.stage_2_charges):
+        assert charges.n_iterations < fixed_point_iterations
+        assert charges.residual < 1e-12
+
+
+def test_newton_restraint_solver_falls_back_to_fixed_point(monkeypatch):
+    job = Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.compute_charges()
+    reference = [np.array(charges) for charges in job.charges]
+
+    # every trial step looks worse, so the line search always fails
+    objective = SparseGlobalConstraintMatrix._get_restraint_objective
+    offsets = itertools.count(step=1e6)
+    monkeypatch.setattr(SparseGlobalConstraintMatrix, "_get_restraint_objective",
+                        lambda *args: objective(*args) + next(offsets))
+    job.resp_options.restraint_solver = "newton"
+    job.compute_charges()
+    assert_allclose(job.charges, reference, atol=1e-5)
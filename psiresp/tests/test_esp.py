@@ -0,0 +1,168 @@
+import pytest
+from numpy.testing import assert_allclose
+
+import numpy as np
+import qcelemental as qcel
+from scipy.integrate import quad
+
+import psiresp
+from psiresp import esp
+from psiresp.tests.datafiles import DMSO_JOB_WITH_ORIENTATION_ENERGIES
+
+
+@pytest.mark.parametrize("n_max", [0, 2, 6])
+def test_boys_function(n_max):
+    t = np.array([0, 1e-14, 1e-3, 0.5, 3, 25, 120])
+    values = esp.boys_function(n_max, t)
+    for n in range(n_max + 1):
+        for i, t_ in enumerate(t):
+            reference, _ = quad(lambda x: x ** (2 * n) * np.exp(-t_ * x ** 2), 0, 1,
+                                epsabs=1e-14, epsrel=1e-12)
+            assert_allclose(values[n, i], reference, rtol=1e-10)
+
+
+@pytest.mark.parametrize("angular_momentum", [0, 1, 2, 3, 4])
+def test_spherical_transformation_orthonormal(angular_momentum):
+    transformation = esp.get_spherical_transformation(angular_momentum)
+    components = esp.get_cartesian_components(angular_momentum)
+    assert transformation.shape == (2 * angular_momentum + 1, len(components))
+
+    # integrate over the unit sphere with a product Gauss-Legendre grid
+    cos_theta, weights = np.polynomial.legendre.leggauss(angular_momentum + 1)
+    phi = np.linspace(0, 2 * np.pi, 2 * angular_momentum + 2, endpoint=False)
+    sin_theta = np.sqrt(1 - cos_theta ** 2)
+    points = np.stack([
+        np.outer(sin_theta, np.cos(phi)).ravel(),
+        np.outer(sin_theta, np.sin(phi)).ravel(),
+        np.repeat(cos_theta, len(phi)),
+    ], axis=1)
+    weights = np.repeat(weights, len(phi))
+    cartesians = np.prod(points[:, None, :] ** components[None, :, :], axis=-1)
+    harmonics = cartesians @ transformation.T * np.sqrt(weights)[:, None]
+    x_l = points[:, 0] ** angular_momentum * np.sqrt(weights)
+    overlap = harmonics.T @ harmonics / (x_l @ x_l)
+    assert_allclose(overlap, np.eye(len(transformation)), atol=1e-10)
+
+
+def test_compute_esp_matches_psi4(dmso_orientation):
+    values = esp.compute_esp(dmso_orientation.qc_wavefunction,
+                             dmso_orientation.grid, block_size=100)
+    assert values.shape == dmso_orientation.esp.shape
+    assert_allclose(values, dmso_orientation.esp, atol=1e-10)
+
+
+def test_compute_esp_pure_p_shells(dmso_orientation):
+    # relabel Cartesian p shells as pure, moving the orbital
+    # coefficients to the order expected by get_density_ordering
+    wfn = dmso_orientation.qc_wavefunction
+    orbitals = wfn.qc_wavefunction.scf_orbitals_a.copy()
+    for shell in esp.get_shells(wfn):
+        if shell.angular_momentum == 1:
+            rows = np.arange(shell.offset, shell.offset + 3)
+            orbitals[rows] = orbitals[rows[[0, 2, 1]]]
+
+    data = wfn.qc_wavefunction.dict()
+    data["scf_orbitals_a"] = orbitals
+    for center in data["basis"]["center_data"].values():
+        for shell in center["electron_shells"]:
+            if shell["angular_momentum"] == [1]:
+                shell["harmonic_type"] = "spherical"
+    qcwfn = qcel.models.results.WavefunctionProperties(**data)
+    wfn = wfn.copy(update={"qc_wavefunction": qcwfn})
+
+    values = esp.compute_esp(wfn, dmso_orientation.grid)
+    assert_allclose(values, dmso_orientation.esp, atol=1e-10)
+
+
+def test_orientation_compute_esp_numpy(dmso_orientation):
+    orientation = dmso_orientation.copy(deep=True)
+    reference = orientation.esp
+    orientation.esp = None
+    orientation.compute_esp(engine="numpy")
+    assert_allclose(orientation.esp, reference, atol=1e-10)
+
+
+@pytest.mark.parametrize("batch_esps, esp_backend, esp_transport", [
+    (False, "processes", "pickle"),
+    (False, "threads", "pickle"),
+    (True, "processes", "pickle"),
+    (False, "processes", "shared_memory"),
+])
+def test_job_compute_esps_numpy(batch_esps, esp_backend, esp_transport):
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.esp_engine = "numpy"
+    job.n_processes = 2
+    job.batch_esps = batch_esps
+    job.esp_backend = esp_backend
+    job.esp_transport = esp_transport
+    orientation = job.molecules[0].conformers[0].orientations[0]
+    reference = orientation.esp
+    orientation.esp = None
+    job.compute_esps()
+    assert_allclose(orientation.esp, reference, atol=1e-10)
+
+    assert len(job.esp_timings) == 1
+    timing = job.esp_timings[0]
+    assert timing["orientation"] == 0
+    assert timing["n_points"] == len(reference)
+    assert timing["esp"] > 0
+    assert timing["constraint_matrix"] > 0
+    if batch_esps:
+        assert timing["batch"] == 0
+    else:
+        assert timing["submit_to_start"] >= 0
+
+
+def test_job_compute_esps_batched_deferred_error():
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.esp_engine = "numpy"
+    job.batch_esps = True
+    job.defer_errors = True
+    orientation = job.molecules[0].conformers[0].orientations[0]
+    orientation.grid = np.zeros((5, 4))
+    orientation.esp = None
+    with pytest.raises(ValueError):
+        job.compute_esps()
+    assert "error" in job.esp_timings[0]
+    assert orientation._constraint_matrix is None
+
+
+def test_job_compute_esps_batched_warns_about_processes():
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.esp_engine = "numpy"
+    job.batch_esps = True
+    job.n_processes = 2
+    job.molecules[0].conformers[0].orientations[0].esp = None
+    with pytest.warns(UserWarning, match="n_processes=2 has no effect"):
+        job.compute_esps()
+
+
+def test_compute_esps_batched(dmso_orientation):
+    wfn = dmso_orientation.qc_wavefunction
+    grid = dmso_orientation.grid
+    wfns = [wfn, wfn, wfn.copy()]
+    grids = [grid[:100], grid[100:], grid]
+    esps, timings = esp.compute_esps(wfns, grids)
+
+    assert len(timings) == 1
+    assert timings[0]["n_wavefunctions"] == 2
+    assert timings[0]["n_grids"] == 3
+    assert timings[0]["n_points"] == 2 * len(grid)
+    assert timings[0]["indices"] == [0, 1, 2]
+    assert_allclose(np.concatenate(esps[:2]), dmso_orientation.esp, atol=1e-10)
+    assert_allclose(esps[2], dmso_orientation.esp, atol=1e-10)
+
+
+def test_boys_function_asymptotic():
+    t = np.array([0.1, 5, 30, 50, 200])
+    exact = esp.boys_function(4, t)
+    far = esp.boys_function(4, t, t_far=40)
+    assert_allclose(far[:, :3], exact[:, :3])
+    assert_allclose(far[:, 3:], exact[:, 3:], rtol=1e-14)
+
+
+@pytest.mark.parametrize("tolerance", [1e-6, 1e-10])
+def test_compute_esp_tolerance(dmso_orientation, tolerance):
+    values = esp.compute_esp(dmso_orientation.qc_wavefunction,
+                             dmso_orientation.grid, tolerance=tolerance)
+    assert_allclose(values, dmso_orientation.esp, atol=10 * tolerance)
@@ -1,12 +1,15 @@
+import warnings
+
 import pytest
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_equal
 
 import qcelemental as qcel
 
 import numpy as np
-from psiresp.grid import GridOptions
+from psiresp.grid import GridOptions, get_template_cache_info, clear_template_cache
 
 from psiresp.tests.datafiles import (UNIT_SPHERE_3, UNIT_SPHERE_64,
+                                     NME2ALA2_OPT_C1,
                                      DMSO, DMSO_GRID,
                                      DMSO_O1, DMSO_O1_GRID,
                                      DMSO_O2, DMSO_O2_GRID,
@@ -28,6 +31,63 @@ def test_generate_unit_sphere(n_points, ref_file):
     assert_allclose(points, reference, atol=1e-10)
 
 
+@pytest.mark.parametrize("generator, n_points, n_expected", [
+    ("fibonacci", 1, 1),
+    ("fibonacci", 35, 35),
+    ("fibonacci", 246, 246),
+    ("lebedev", 0, 0),
+    ("lebedev", 5, 6),
+    ("lebedev", 35, 38),
+    ("lebedev", 100, 110),
+    ("lebedev", 350, 302),
+])
+def test_generate_unit_sphere_generators(generator, n_points, n_expected):
+    points = GridOptions.generate_unit_sphere(n_points, generator=generator)
+    assert points.shape == (n_expected, 3)
+    assert_allclose(np.linalg.norm(points, axis=1), 1)
+    assert len(np.unique(points.round(10), axis=0)) == n_expected
+
+
+def test_lebedev_sphere_too_many_points():
+    with pytest.raises(ValueError, match="at most 302 points"):
+        GridOptions.generate_unit_sphere(1000, generator="lebedev")
+
+    options = GridOptions(sphere_point_generator="lebedev", vdw_point_density=20)
+    with pytest.raises(ValueError, match="Lower the point density"):
+        options.generate_grid(qcel.models.Molecule(symbols=["S"], geometry=[0, 0, 0]))
+
+
+@pytest.mark.parametrize("n_points", [6, 14, 26, 38, 50, 74, 86, 110, 146, 170, 194, 302])
+def test_lebedev_sphere_is_symmetric(n_points):
+    points = GridOptions.generate_unit_sphere(n_points, generator="lebedev")
+    assert len(points) == n_points
+    # point sets are invariant under the octahedral group
+    assert_allclose(points.mean(axis=0), 0, atol=1e-14)
+    assert_allclose((points ** 2).mean(axis=0), 1 / 3)
+
+
+@pytest.mark.parametrize("qcmol", [DMSO, NME2ALA2_OPT_C1], indirect=True)
+@pytest.mark.parametrize("generator", ["fibonacci", "lebedev"])
+def test_generate_grid_with_generators(qcmol, generator):
+    options = GridOptions(sphere_point_generator=generator)
+    grid = options.generate_grid(qcmol)
+    assert grid.shape[0] > 0
+    kdtree_options = GridOptions(sphere_point_generator=generator,
+                                 neighbor_search="kdtree")
+    assert_allclose(kdtree_options.generate_grid(qcmol), grid)
+
+
+def test_unit_sphere_is_cached_and_readonly():
+    clear_template_cache()
+    first = GridOptions.generate_unit_sphere(64)
+    second = GridOptions.generate_unit_sphere(64)
+    assert first is second
+    assert not first.flags.writeable
+    info = get_template_cache_info()["unit_sphere"]
+    assert info.hits == 1
+    assert info.misses == 1
+
+
 @pytest.mark.parametrize("radii, density, n_points", [
     ([1.68, 2.1, 1.96], 0.0, [0, 0, 0]),
     ([1.68, 2.1, 1.96], 1.0, [35, 55, 48]),
@@ -44,6 +104,143 @@ def test_generate_connolly_spheres(radii, density, n_points):
         assert len(col[~np.isnan(col)]) <= n
 
 
+@pytest.mark.parametrize("qcmol", [DMSO], indirect=True)
+def test_connolly_spheres_cached_across_grids(qcmol, default_grid_options):
+    clear_template_cache()
+    first = default_grid_options.generate_grid(qcmol)
+    misses = get_template_cache_info()["connolly_sphere"].misses
+    second = default_grid_options.generate_grid(qcmol)
+    info = get_template_cache_info()["connolly_sphere"]
+    assert info.misses == misses
+    assert info.hits >= misses
+    assert_allclose(first, second)
+
+
+@pytest.mark.parametrize("qcmol", [DMSO, NME2ALA2_OPT_C1], indirect=True)
+def test_generate_vdw_shells_offsets(qcmol, default_grid_options):
+    coordinates = qcmol.geometry * qcel.constants.conversion_factor("bohr", "angstrom")
+    points, offsets = default_grid_options.generate_vdw_shells(qcmol.symbols, coordinates)
+    assert len(offsets) == len(default_grid_options.vdw_scale_factors) + 1
+    assert offsets[0] == 0
+    assert offsets[-1] == len(points)
+
+    radii = default_grid_options.get_vdwradii_for_elements(qcmol.symbols)
+    for i, factor in enumerate(default_grid_options.vdw_scale_factors):
+        shell = default_grid_options.get_shell_within_bounds(radii * factor, coordinates)
+        assert_allclose(points[offsets[i]:offsets[i + 1]], shell)
+
+
+@pytest.mark.parametrize("qcmol", [NME2ALA2_OPT_C1], indirect=True)
+@pytest.mark.parametrize("neighbor_search", ["cdist", "kdtree"])
+@pytest.mark.parametrize("grid_memory_limit, n_blocks", [
+    (None, 1),
+    (0.01, 25),
+    (1e-6, 25),
+])
+def test_chunked_grid_matches_unchunked(qcmol, neighbor_search,
+                                        grid_memory_limit, n_blocks):
+    options = GridOptions(neighbor_search=neighbor_search,
+                          grid_memory_limit=grid_memory_limit)
+    coordinates = qcmol.geometry * qcel.constants.conversion_factor("bohr", "angstrom")
+    radii = options.get_vdwradii_for_elements(qcmol.symbols) * 2
+    blocks = list(options.iter_shell_within_bounds(radii, coordinates))
+    assert len(blocks) == n_blocks
+
+    reference = GridOptions(neighbor_search=neighbor_search).generate_grid(qcmol)
+    assert_allclose(options.generate_grid(qcmol), reference)
+
+
+@pytest.mark.parametrize("qcmol", [DMSO, NME2ALA2_OPT_C1], indirect=True)
+def test_sas_without_probe_matches_vdw(qcmol, default_grid_options):
+    sas = GridOptions(surface_type="sas", probe_radius=0)
+    assert_allclose(sas.generate_grid(qcmol), default_grid_options.generate_grid(qcmol))
+
+
+@pytest.mark.parametrize("qcmol", [DMSO, NME2ALA2_OPT_C1], indirect=True)
+@pytest.mark.parametrize("n_surface_points", [None, 300, 2000])
+def test_generate_sas_shells(qcmol, n_surface_points):
+    from scipy.spatial.distance import cdist
+
+    options = GridOptions(surface_type="sas",
+                          sphere_point_generator="fibonacci",
+                          n_surface_points=n_surface_points)
+    coordinates = qcmol.geometry * qcel.constants.conversion_factor("bohr", "angstrom")
+    points, offsets = options.generate_shells(qcmol.symbols, coordinates)
+    assert offsets[-1] == len(points)
+    if n_surface_points is not None:
+        assert len(points) == n_surface_points
+
+    radii = options.get_vdwradii_for_elements(qcmol.symbols)
+    for i, factor in enumerate(options.vdw_scale_factors):
+        shell = points[offsets[i]:offsets[i + 1]]
+        distances = cdist(shell, coordinates) - (radii * factor + options.probe_radius)
+        # every point lies on one expanded sphere and outside all others
+        assert_allclose(np.abs(distances).min(axis=1), 0, atol=1e-10)
+        assert distances.min() > -1e-10
+
+
+@pytest.mark.parametrize("qcmol", [DMSO, NME2ALA2_OPT_C1], indirect=True)
+@pytest.mark.parametrize("sphere_point_generator", ["gamess", "fibonacci", "lebedev"])
+@pytest.mark.parametrize("n_surface_points", [1, 5, 20, 300, 3000])
+def test_generate_sas_shells_n_surface_points(qcmol, sphere_point_generator, n_surface_points):
+    options = GridOptions(surface_type="sas",
+                          sphere_point_generator=sphere_point_generator,
+                          n_surface_points=n_surface_points)
+    coordinates = qcmol.geometry * qcel.constants.conversion_factor("bohr", "angstrom")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        points, offsets = options.generate_shells(qcmol.symbols, coordinates)
+    assert offsets[-1] == len(points)
+    assert len(points) <= n_surface_points
+    if sphere_point_generator == "lebedev":
+        # Lebedev spheres have at most 302 points
+        assert len(points) >= min(n_surface_points, 1500)
+    else:
+        assert len(points) == n_surface_points
+
+
+@pytest.mark.parametrize("qcmol", [NME2ALA2_OPT_C1], indirect=True)
+@pytest.mark.parametrize("merge_tolerance, max_n_points", [
+    (0.3, None),
+    (0.5, None),
+    (0, 1000),
+    (0.3, 500),
+    (0, 100),
+])
+def test_thin_grid(qcmol, merge_tolerance, max_n_points):
+    from scipy.spatial import cKDTree
+
+    full = GridOptions(vdw_point_density=2.5).generate_grid(qcmol)
+    options = GridOptions(vdw_point_density=2.5,
+                          merge_tolerance=merge_tolerance,
+                          max_n_points=max_n_points)
+    points, n_removed = options.thin_grid(full)
+    assert len(points) + n_removed == len(full)
+    assert n_removed > 0
+    if max_n_points is not None:
+        assert len(points) <= max_n_points
+        assert len(points) >= 0.9 * max_n_points
+    if len(points) > 1:
+        distances, _ = cKDTree(points).query(points, k=2)
+        assert distances[:, 1].min() >= merge_tolerance
+    assert_allclose(options.generate_grid(qcmol), points)
+
+
+@pytest.mark.parametrize("radius", [0.05, 0.1, 0.3, 1.5])
+def test_poisson_disk_indices_match_sequential_selection(radius):
+    from scipy.spatial.distance import cdist
+
+    points = np.random.default_rng(1).uniform(size=(2000, 3))
+    order = np.random.default_rng(2).permutation(len(points))
+    close = cdist(points, points) <= radius
+    reference = []
+    for i in order:
+        if not close[i, reference].any():
+            reference.append(i)
+    indices = GridOptions._get_poisson_disk_indices(points, radius, order)
+    assert_equal(indices, np.sort(reference))
+
+
 @pytest.mark.xfail(reason="Incorrect reference grids calculated in bohr")
 @pytest.mark.parametrize("qcmol, reference_grid", [
     (DMSO, DMSO_GRID),
@@ -53,3 +250,45 @@ def test_generate_connolly_spheres(radii, density, n_points):
 def test_generate_vdw_grid(qcmol, reference_grid, default_grid_options):
     grid = default_grid_options.generate_grid(qcmol)
     assert_allclose(grid, reference_grid)
+
+
+@pytest.mark.parametrize("qcmol", [DMSO, NME2ALA2_OPT_C1], indirect=True)
+@pytest.mark.parametrize("grid_rmin, grid_rmax", [
+    (0, -1),
+    (0, 2.1),
+    (1.2, 3),
+])
+def test_kdtree_grid_matches_cdist(qcmol, grid_rmin, grid_rmax):
+    dense = GridOptions(grid_rmin=grid_rmin, grid_rmax=grid_rmax)
+    tree = GridOptions(grid_rmin=grid_rmin, grid_rmax=grid_rmax,
+                       neighbor_search="kdtree")
+    reference = dense.generate_grid(qcmol)
+    assert_allclose(tree.generate_grid(qcmol), reference)
+
+
+def test_load_or_generate_grid(dmso_qcmol, tmp_path):
+    options = GridOptions()
+    path = options.get_grid_file_for_molecule(dmso_qcmol, working_directory=tmp_path)
+    assert not path.exists()
+
+    grid = options.load_or_generate_grid(dmso_qcmol, working_directory=tmp_path)
+    assert path.exists()
+    assert not list(path.parent.glob("*.tmp"))
+    assert_allclose(grid, options.generate_grid(dmso_qcmol))
+
+    cached = options.load_or_generate_grid(dmso_qcmol, working_directory=tmp_path)
+    assert not isinstance(cached, np.memmap)
+    assert_allclose(cached, grid)
+
+    mapped = options.load_or_generate_grid(dmso_qcmol, working_directory=tmp_path,
+                                           mmap_mode="r")
+    assert isinstance(mapped, np.memmap)
+    assert_allclose(mapped, grid)
+
+    # options that do not change the points share the cached grid
+    blocked = GridOptions(neighbor_search="kdtree", grid_memory_limit=1)
+    assert blocked.get_grid_file_for_molecule(dmso_qcmol, working_directory=tmp_path) == path
+
+    other = GridOptions(vdw_point_density=2.0)
+    other_path = other.get_grid_file_for_molecule(dmso_qcmol, working_directory=tmp_path)
+    assert other_path != path
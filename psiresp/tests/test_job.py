@@ -1,17 +1,22 @@
 import pytest
+import concurrent.futures
+import json
+import os
 import pathlib
 import glob
 import shutil
 import random
+import subprocess
+import sys
 
 import numpy as np
 from numpy.testing import assert_allclose
 
 
 import psiresp
-from psiresp.job import Job
+from psiresp.job import Job, _iter_bounded_results
 from psiresp.resp import RespOptions
-from .utils import requires_qcfractal
+from .utils import requires_qcfractal, requires_psi4
 
 from psiresp.tests.datafiles import (AMM_NME_OPT_ESPA1_CHARGES,
                                      AMM_NME_OPT_RESPA2_CHARGES,
@@ -19,12 +24,12 @@ from psiresp.tests.datafiles import (AMM_NME_OPT_ESPA1_CHARGES,
                                      MANUAL_JOBS_WKDIR,
                                      TRIFLUOROETHANOL_JOB,
                                      FORMIC_ACID_JSON,
-                                     FORMIC_ACID_WKDIR
+                                     FORMIC_ACID_WKDIR,
+                                     DMSO_JOB_WITH_ORIENTATION_ENERGIES,
                                      )
 
-pytest.importorskip("psi4")
-
 
+@requires_psi4
 def test_load_job_from_json():
     job = Job.parse_file(TRIFLUOROETHANOL_JOB)
     assert len(job.molecules) == 1
@@ -35,6 +40,7 @@ def test_load_job_from_json():
     assert job.charges is None
 
 
+@requires_psi4
 @requires_qcfractal
 class TestSingleResp:
     def test_unrestrained(self, dmso, fractal_client):
@@ -68,6 +74,7 @@ class TestSingleResp:
         assert_allclose(job.stage_2_charges.restrained_charges, resp_2, atol=1e-5)
 
 
+@requires_psi4
 class TestMultiRespWithoutClient:
     @pytest.mark.parametrize("stage_2, restraint_height, red_charges", [
         (False, 0.0, AMM_NME_OPT_ESPA1_CHARGES),
@@ -211,6 +218,7 @@ class TestMultiRespWithoutClient:
             assert_allclose(job.charges[1], nme2ala2_charges, atol=1e-6)
 
 
+@requires_psi4
 @requires_qcfractal
 @pytest.mark.slow
 class TestMultiResp:
@@ -339,6 +347,7 @@ class TestMultiResp:
         assert_allclose(nme2ala2_job, nme2ala2_charges, atol=5e-2)
 
 
+@requires_psi4
 def test_symmetric_constraints(tmpdir):
     pytest.importorskip("rdkit")
 
@@ -361,3 +370,246 @@ def test_symmetric_constraints(tmpdir):
         ).run()[0]
 
         assert_allclose(equiv[0], equiv[2])
+
+
+@pytest.mark.parametrize("executor_class", [
+    concurrent.futures.ThreadPoolExecutor,
+    concurrent.futures.ProcessPoolExecutor,
+])
+def test_job_compute_esps_executor(executor_class):
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.esp_engine = "numpy"
+    orientation = job.molecules[0].conformers[0].orientations[0]
+    reference = orientation.esp
+
+    with executor_class(max_workers=2) as executor:
+        # reuse the same executor across jobs
+        for _ in range(2):
+            orientation.esp = None
+            job.compute_esps(executor=executor)
+            assert_allclose(orientation.esp, reference, atol=1e-10)
+
+
+@pytest.mark.parametrize("esp_backend, esp_transport", [
+    ("processes", "pickle"),
+    ("threads", "pickle"),
+    ("processes", "shared_memory"),
+])
+def test_job_compute_esps_discard_grids(esp_backend, esp_transport):
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    reference = job.construct_surface_constraint_matrix().matrix
+    for orientation in job.iter_orientations():
+        orientation.esp = None
+
+    job.esp_engine = "numpy"
+    job.esp_backend = esp_backend
+    job.esp_transport = esp_transport
+    job.n_processes = 2
+    job.keep_grids_and_esps = False
+    job.compute_esps()
+    for orientation in job.iter_orientations():
+        assert orientation.grid is None
+        assert orientation.esp is None
+        assert orientation._constraint_matrix is not None
+
+    matrix = job.construct_surface_constraint_matrix().matrix
+    assert_allclose(matrix, reference, atol=1e-8)
+
+
+def test_job_compute_esps_twice_reuse_conformer_grids():
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    for orientation in job.iter_orientations():
+        orientation.esp = None
+        orientation.grid = None
+        orientation.transformation = np.identity(4)
+
+    job.esp_engine = "numpy"
+    job.esp_backend = "threads"
+    job.reuse_conformer_grids = True
+    job.keep_grids_and_esps = False
+    job.compute_esps()
+    assert len(job.esp_timings) == 1
+    matrix = job.molecules[0].conformers[0].orientations[0]._constraint_matrix
+    assert matrix is not None
+
+    job.compute_esps()
+    assert len(job.esp_timings) == 0
+    orientation = job.molecules[0].conformers[0].orientations[0]
+    assert orientation.grid is None
+    assert orientation._constraint_matrix is matrix
+
+
+def test_job_reuse_conformer_grids_matches_single_orientation():
+    reference = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    # the restraint does not scale with the number of orientations
+    reference.resp_options.restrained_fit = False
+    expected = reference.compute_charges()
+
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.resp_options.restrained_fit = False
+    conformer = job.molecules[0].conformers[0]
+    esp = conformer.orientations[0].esp
+    conformer.orientations = []
+    for angle in [0, np.pi / 3, 2 * np.pi / 3]:
+        matrix = np.identity(4)
+        matrix[:2, :2] = [[np.cos(angle), -np.sin(angle)],
+                          [np.sin(angle), np.cos(angle)]]
+        matrix[:3, 3] = [angle, -1, 2]
+        coordinates = psiresp.orutils.apply_affine_matrix(matrix, conformer.coordinates)
+        conformer.add_orientation_with_coordinates(coordinates, transformation=matrix)
+
+    conformer.map_grid_to_orientations(job.grid_options)
+    first = conformer.orientations[0]
+    for orientation in conformer.orientations:
+        distances = np.linalg.norm(orientation.grid[:, None] - orientation.coordinates, axis=-1)
+        reference_distances = np.linalg.norm(first.grid[:, None] - first.coordinates, axis=-1)
+        assert_allclose(distances, reference_distances, atol=1e-10)
+        orientation.esp = esp
+        orientation.weight = 1
+
+    charges = job.compute_charges()
+    for molecule_charges, expected_charges in zip(charges, expected):
+        assert_allclose(molecule_charges, expected_charges, atol=1e-8)
+
+
+@pytest.mark.parametrize("executor_class", [None, concurrent.futures.ThreadPoolExecutor])
+def test_job_compute_esps_shared_memory_generates_grids(executor_class):
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.esp_engine = "numpy"
+    job.esp_transport = "shared_memory"
+    job.n_processes = 1
+    orientations = list(job.iter_orientations())
+    references = [(o.grid, o.esp) for o in orientations]
+    for orientation in orientations:
+        orientation.grid = None
+        orientation.esp = None
+
+    if executor_class is None:
+        job.compute_esps()
+    else:
+        with executor_class(max_workers=1) as executor:
+            job.compute_esps(executor=executor)
+    for orientation, (grid, reference) in zip(orientations, references):
+        assert_allclose(orientation.grid, grid)
+        assert_allclose(orientation.esp, reference, atol=1e-10)
+    assert all(timing["grid"] > 0 for timing in job.esp_timings)
+
+
+@requires_psi4
+def test_job_compute_esps_threads_psi4():
+    from psiresp.psi4utils import compute_esp
+
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    conformer = job.molecules[0].conformers[0]
+    original = conformer.orientations[0]
+    # translating a molecule leaves its AO density unchanged,
+    # so each copy is a distinct geometry with a valid wavefunction
+    orientations = []
+    for shift in [0, 4, -6, 9]:
+        geometry = original.qcmol.geometry + shift
+        qcmol = original.qcmol.copy(update={"geometry": geometry})
+        wavefunction = original.qc_wavefunction.copy(update={"qcmol": qcmol})
+        orientations.append(original.copy(update={"qcmol": qcmol,
+                                                  "qc_wavefunction": wavefunction,
+                                                  "grid": None, "esp": None}))
+    conformer.orientations = orientations
+
+    job.esp_engine = "psi4"
+    job.esp_backend = "threads"
+    job.n_processes = 4
+    job.compute_esps()
+    for orientation in orientations:
+        reference = compute_esp(orientation.qc_wavefunction, orientation.grid)
+        assert_allclose(orientation.esp, reference, atol=1e-10)
+
+
+SHARED_MEMORY_EXECUTOR_SCRIPT = """
+import concurrent.futures
+import multiprocessing
+
+import psiresp
+
+if __name__ == "__main__":
+    job = psiresp.Job.parse_file({filename!r})
+    job.esp_engine = "numpy"
+    job.esp_transport = "shared_memory"
+    job.n_processes = 2
+    orientation = job.molecules[0].conformers[0].orientations[0]
+    context = multiprocessing.get_context({start_method!r})
+    with concurrent.futures.ProcessPoolExecutor(2, mp_context=context) as executor:
+        # start the workers before any shared memory exists in this process
+        list(executor.map(abs, range(4)))
+        for _ in range(2):
+            orientation.esp = None
+            job.compute_esps(executor=executor)
+    assert orientation.esp is not None
+"""
+
+
+@pytest.mark.skipif(not pathlib.Path("/dev/shm").is_dir(),
+                    reason="requires POSIX shared memory in /dev/shm")
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_job_compute_esps_shared_memory_external_executor(tmp_path, start_method):
+    script = tmp_path / "run.py"
+    script.write_text(SHARED_MEMORY_EXECUTOR_SCRIPT.format(
+        filename=str(DMSO_JOB_WITH_ORIENTATION_ENERGIES),
+        start_method=start_method,
+    ))
+    before = set(os.listdir("/dev/shm"))
+    env = dict(os.environ, PYTHONPATH=str(pathlib.Path(psiresp.__file__).parents[1]))
+    process = subprocess.run([sys.executable, str(script)], capture_output=True,
+                             text=True, cwd=tmp_path, env=env)
+    assert process.returncode == 0, process.stderr
+    assert "resource_tracker" not in process.stderr
+    assert "leaked" not in process.stderr
+    assert set(os.listdir("/dev/shm")) - before == set()
+
+
+def test_iter_bounded_results():
+    submitted = []
+
+    def submit(item):
+        submitted.append(item)
+        future = concurrent.futures.Future()
+        future.set_result(item)
+        return future
+
+    results = _iter_bounded_results(submit, range(10), window=3)
+    first = next(results)
+    # later items are only submitted as results are consumed
+    assert submitted == [0, 1, 2]
+    assert sorted([first, *results]) == list(range(10))
+    assert submitted == list(range(10))
+
+
+def test_write_esp_timings(tmpdir):
+    job = psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES)
+    job.esp_engine = "numpy"
+    job.esp_backend = "threads"
+    job.working_directory = str(tmpdir)
+    job.molecules[0].conformers[0].orientations[0].esp = None
+    job.compute_esps()
+
+    filename = job.write_esp_timings()
+    assert filename == tmpdir / "esp_timings.csv"
+    with open(filename) as f:
+        header, row = f.read().splitlines()
+    assert "esp" in header.split(",")
+    assert row.startswith("0,0,0,")
+
+    filename = job.write_esp_timings(tmpdir / "timings.json")
+    with open(filename) as f:
+        assert json.load(f) == job.esp_timings
+
+
+def test_esp_timings_do_not_affect_equality():
+    jobs = [psiresp.Job.parse_file(DMSO_JOB_WITH_ORIENTATION_ENERGIES) for _ in range(2)]
+    for job in jobs:
+        job.esp_engine = "numpy"
+        job.esp_backend = "threads"
+        job.molecules[0].conformers[0].orientations[0].esp = None
+        job.compute_esps()
+        assert len(job.esp_timings) == 1
+        assert "esp_timings" not in job.json()
+    assert jobs[0] == jobs[1]
+    assert jobs[0].get_hash() == jobs[1].get_hash()
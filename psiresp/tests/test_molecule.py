@@ -106,3 +106,37 @@ def test_minimize_conformers():
     uff = create_molecule("uff")
     diff = np.abs(uff.coordinates - uff.conformers[0].coordinates).sum()
     assert diff > 1
+
+
+def test_orientation_transformations(methylammonium_qcmol):
+    mol = psiresp.Molecule(qcmol=methylammonium_qcmol,
+                           keep_original_orientation=True,
+                           reorientations=[(0, 4, 5)],
+                           rotations=[(5, 4, 0)],
+                           translations=[(1.0, -2.0, 0.5)])
+    mol.generate_orientations()
+    conformer = mol.conformers[0]
+    assert conformer.n_orientations == 4
+    for orientation in conformer.orientations:
+        matrix = orientation.transformation
+        assert matrix.shape == (4, 4)
+        transformed = conformer.coordinates @ matrix[:3, :3].T + matrix[:3, 3]
+        assert_allclose(transformed, orientation.coordinates, atol=1e-10)
+
+
+def test_map_grid_to_orientations(methylammonium_qcmol):
+    from scipy.spatial.distance import cdist
+
+    mol = psiresp.Molecule(qcmol=methylammonium_qcmol,
+                           reorientations=[(0, 4, 5), (5, 4, 0)],
+                           translations=[(1.0, -2.0, 0.5)])
+    mol.generate_orientations()
+    conformer = mol.conformers[0]
+    conformer.map_grid_to_orientations()
+
+    reference = psiresp.GridOptions().generate_grid(conformer.qcmol)
+    reference_distances = cdist(reference, conformer.coordinates)
+    for orientation in conformer.orientations:
+        assert orientation.grid.shape == reference.shape
+        distances = cdist(orientation.grid, orientation.coordinates)
+        assert_allclose(distances, reference_distances, atol=1e-8)
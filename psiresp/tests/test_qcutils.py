@@ -0,0 +1,128 @@
+from numpy.testing import assert_allclose, assert_equal
+
+import numpy as np
+import qcelemental as qcel
+
+from psiresp.qcutils import get_density_ordering
+
+
+def test_get_density_ordering():
+    layout = ((False, 0), (True, 1), (True, 2), (False, 2))
+    # s, then pure p and d from QCSchema to psi4 order, then Cartesian d
+    reference = [0, 2, 1, 3, 6, 5, 7, 4, 8, 9, 10, 11, 12, 13, 14]
+    assert_equal(get_density_ordering(layout), reference)
+
+
+def test_reconstruct_density_cached(dmso_wavefunction):
+    get_density_ordering.cache_clear()
+    density = dmso_wavefunction.reconstruct_density()
+    assert dmso_wavefunction.reconstruct_density() is density
+    assert not density.flags.writeable
+
+    orbitals = dmso_wavefunction.qc_wavefunction.scf_orbitals_a[:, :dmso_wavefunction.n_alpha]
+    assert_allclose(density, orbitals @ orbitals.T)
+
+    other = dmso_wavefunction.copy(deep=True)
+    other._density = None
+    other.reconstruct_density()
+    assert get_density_ordering.cache_info().hits == 1
+
+
+def test_density_invalidated(dmso_wavefunction):
+    density = dmso_wavefunction.reconstruct_density()
+    dmso_wavefunction.n_alpha -= 1
+    smaller = dmso_wavefunction.reconstruct_density()
+    assert smaller is not density
+    assert not np.allclose(smaller, density)
+
+    copied = dmso_wavefunction.copy(update={"n_alpha": dmso_wavefunction.n_alpha + 1})
+    assert_allclose(copied.reconstruct_density(), density)
+
+
+def test_cache_density_float32_memmap(dmso_wavefunction, tmp_path):
+    reference = dmso_wavefunction.reconstruct_density()
+    filename = tmp_path / "density.npy"
+    density = dmso_wavefunction.cache_density(dtype=np.float32, filename=filename)
+    assert density.dtype == np.float32
+    assert isinstance(density, np.memmap)
+    assert dmso_wavefunction.reconstruct_density() is density
+    assert_allclose(np.load(filename), reference, atol=1e-6)
+
+
+def _reorder_density(wavefunction):
+    # the re-ordering before the AO map was cached
+    basis = wavefunction.qc_wavefunction.basis
+    angular_momenta = {
+        shell.angular_momentum[0]
+        for center in basis.center_data.values()
+        for shell in center.electron_shells
+    }
+    spherical_maps = {
+        L: np.array(list(range(L * 2 - 1, 0, -2)) + [0] + list(range(2, L * 2 + 1, 2)))
+        for L in angular_momenta
+    }
+    ao_map = []
+    counter = 0
+    for atom in basis.atom_map:
+        for shell in basis.center_data[atom].electron_shells:
+            if shell.harmonic_type == "cartesian":
+                ao_map.append(np.arange(counter, counter + shell.nfunctions()))
+            else:
+                ao_map.append(spherical_maps[shell.angular_momentum[0]] + counter)
+            counter += shell.nfunctions()
+    ao_map = np.hstack(ao_map)
+    reverse_ao_map = {map_index: i for i, map_index in enumerate(ao_map)}
+    reverse_ao_map = np.array([reverse_ao_map[i] for i in range(len(ao_map))])
+
+    orbitals = wavefunction.qc_wavefunction.scf_orbitals_a[:, :wavefunction.n_alpha]
+    density = np.dot(orbitals, orbitals.T)
+    return density[reverse_ao_map[:, None], reverse_ao_map]
+
+
+def test_reconstruct_density_pure_shells(dmso_wavefunction):
+    # make the d shells pure and add a pure f shell to sulfur
+    properties = dmso_wavefunction.qc_wavefunction
+    f_shell = qcel.models.basis.ElectronShell(angular_momentum=[3], harmonic_type="spherical",
+                                              exponents=[0.5], coefficients=[[1.0]])
+    center_data = {}
+    for name, center in properties.basis.center_data.items():
+        shells = [
+            shell.copy(update={"harmonic_type": "spherical"})
+            if shell.angular_momentum[0] >= 2 else shell
+            for shell in center.electron_shells
+        ]
+        if name.endswith("_S1"):
+            shells.append(f_shell)
+        center_data[name] = center.copy(update={"electron_shells": shells})
+    basis = properties.basis.copy(update={"center_data": center_data})
+    n_functions = sum(shell.nfunctions()
+                      for atom in basis.atom_map
+                      for shell in basis.center_data[atom].electron_shells)
+    orbitals = np.random.default_rng(0).normal(size=(n_functions, n_functions))
+    properties = properties.copy(update={"basis": basis, "scf_orbitals_a": orbitals})
+    wavefunction = dmso_wavefunction.copy(update={"qc_wavefunction": properties})
+
+    layout = wavefunction.get_basis_layout()
+    assert (True, 2) in layout and (True, 3) in layout
+    assert_allclose(wavefunction.reconstruct_density(), _reorder_density(wavefunction))
+
+
+def test_density_cache_cleared(dmso_wavefunction):
+    dmso_wavefunction.reconstruct_density()
+    assert dmso_wavefunction.density_is_cached
+    assert dmso_wavefunction.copy().density_is_cached
+
+    dmso_wavefunction.energy += 1
+    assert dmso_wavefunction.density_is_cached
+
+    properties = dmso_wavefunction.qc_wavefunction.copy()
+    copied = dmso_wavefunction.copy(update={"qc_wavefunction": properties})
+    assert copied._density is None
+    assert dmso_wavefunction.density_is_cached
+
+    dmso_wavefunction.qc_wavefunction = properties
+    assert dmso_wavefunction._density is None
+
+    dmso_wavefunction.reconstruct_density()
+    dmso_wavefunction.clear_density_cache()
+    assert not dmso_wavefunction.density_is_cached
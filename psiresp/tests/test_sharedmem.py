@@ -0,0 +1,49 @@
+import multiprocessing
+import pickle
+
+import pytest
+from numpy.testing import assert_equal
+
+import numpy as np
+
+from psiresp.sharedmem import SharedArray
+
+
+def _double(handle):
+    handle.to_numpy()[:] *= 2
+    handle.close()
+    return handle.shape
+
+
+@pytest.mark.parametrize("array", [
+    np.arange(12, dtype=float).reshape((4, 3)),
+    np.arange(5, dtype=np.float32),
+    np.zeros((0, 3)),
+])
+def test_shared_array_roundtrip(array):
+    shared = SharedArray.from_array(array)
+    try:
+        assert shared.shape == array.shape
+        assert shared.dtype == array.dtype
+        assert_equal(shared.to_numpy(), array)
+
+        # pickling only sends the handle
+        unpickled = pickle.loads(pickle.dumps(shared))
+        assert len(pickle.dumps(shared)) < 200
+        assert_equal(unpickled.to_numpy(), array)
+        unpickled.close()
+    finally:
+        shared.unlink()
+
+
+def test_shared_array_between_processes():
+    handles = [SharedArray.from_array(np.arange(10, dtype=float) + i) for i in range(3)]
+    try:
+        with multiprocessing.Pool(2) as pool:
+            shapes = pool.map(_double, handles)
+        assert shapes == [(10,)] * 3
+        for i, handle in enumerate(handles):
+            assert_equal(handle.to_numpy(), 2 * (np.arange(10) + i))
+    finally:
+        for handle in handles:
+            handle.unlink()
@@ -0,0 +1,46 @@
+import pickle
+
+from numpy.testing import assert_allclose
+
+import numpy as np
+
+from psiresp.task import ESPTask, run_esp_task
+
+
+def test_task_smaller_than_orientation(dmso_orientation):
+    task = ESPTask.from_orientation(0, dmso_orientation, grid=None)
+    n_task = len(pickle.dumps(task))
+    n_orientation = len(pickle.dumps(dmso_orientation.copy(update={"grid": None, "esp": None})))
+    assert n_task < n_orientation / 2
+
+
+def test_run_esp_task(dmso_orientation):
+    task = ESPTask.from_orientation(3, dmso_orientation, engine="numpy")
+    task = pickle.loads(pickle.dumps(task))
+    result = run_esp_task(task)
+    assert result.index == 3
+    assert result.error is None
+    # the task was sent the grid, so it is not returned
+    assert result.grid is None
+    assert_allclose(result.esp, dmso_orientation.esp, atol=1e-10)
+    assert_allclose(result.constraint_matrix.matrix,
+                    dmso_orientation.constraint_matrix.matrix, rtol=1e-8)
+
+
+def test_run_esp_task_deferred_error(dmso_orientation):
+    task = ESPTask.from_orientation(0, dmso_orientation, engine="numpy",
+                                    grid=np.zeros((5, 4)), defer_errors=True)
+    result = run_esp_task(task)
+    assert result.error is not None
+    assert result.constraint_matrix is None
+
+
+def test_run_esp_task_shared_wavefunction(dmso_orientation):
+    wfn = dmso_orientation.qc_wavefunction
+    task = ESPTask.from_orientation(0, dmso_orientation, engine="numpy",
+                                    wavefunction=wfn)
+    assert task.orbitals is None
+    assert task.get_wavefunction() is wfn
+    result = run_esp_task(task)
+    assert_allclose(result.esp, dmso_orientation.esp, atol=1e-10)
+    assert wfn._density is not None
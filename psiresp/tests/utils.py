@@ -1,3 +1,5 @@
+import importlib.util
+
 import pytest
 
 import numpy as np
@@ -10,7 +12,10 @@ except ImportError:
 else:
     qcfractal_is_installed = True
 
+psi4_is_installed = importlib.util.find_spec("psi4") is not None
+
 requires_qcfractal = pytest.mark.skipif(not qcfractal_is_installed, reason="requires QCFractal")
+requires_psi4 = pytest.mark.skipif(not psi4_is_installed, reason="requires psi4")
 
 
 def load_gamess_esp(file):